@@ -1,15 +1,18 @@
 from dotenv import load_dotenv
-from flask import Flask, session, jsonify, request
+from flask import Flask, session, jsonify, request, Response, stream_with_context
 import os
 from cryptography.fernet import Fernet
 import sqlite3
 import bcrypt
-from rag import build_faiss_index, combine_retrieved_chunks
+from rag import IndexBuilder, combine_retrieved_chunks, RetrievalEngine, split_page, reciprocal_rank_fusion, estimate_tokens, embedding_cache, delete_index_chunks, read_index_spec, validate_vectorstore, create_fts_table
+from langchain_core.documents import Document
 import re
-from scraper import scraper
+from scraper import CrawlFrontier, iter_pages, iter_pages_http, iter_pages_pool
+from semantic_cache import SemanticCache
+from intent import IntentRouter
+import metrics
 import threading
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+import queue
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.tools import Tool
 from langchain.agents import initialize_agent
@@ -30,6 +33,69 @@ cipher = Fernet(key)
 # scraping status
 scraping_status = {"running":False, "progress":""}
 
+# index activation status (load, validate, warm up, then switch)
+activation_status = {"running": False, "index_name": None, "stage": "idle", "progress": "", "timings": {}, "error": None}
+activation_lock = threading.Lock()
+
+# embedding model + active FAISS index, shared by all chat requests
+retrieval_engine = RetrievalEngine(
+    max_batch_size=int(os.getenv("EMBED_BATCH_SIZE", "16")),
+    max_wait=float(os.getenv("EMBED_BATCH_WAIT_MS", "5")) / 1000,
+)
+
+# "hybrid" fuses FAISS and FTS5 hits, "vector" / "lexical" use only one of them
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "6"))
+# re-embed only pages that changed since the previous index
+INCREMENTAL_BUILDS = os.getenv("INCREMENTAL_BUILDS", "1") == "1"
+# processes and batch size for embedding chunks during index builds
+BUILD_WORKERS = int(os.getenv("BUILD_WORKERS", "1"))
+BUILD_BATCH_SIZE = int(os.getenv("BUILD_BATCH_SIZE", "64"))
+# FAISS index type for new builds, e.g. "flat", "hnsw:m=32", "ivf_pq:nlist=128,m=16", "sq8:rerank=4"
+BUILD_INDEX_SPEC = os.getenv("BUILD_INDEX_SPEC", "flat")
+# "mmap": vectors memory-mapped, chunks in SQLite; "pickle": LangChain's save_local
+BUILD_STORAGE = os.getenv("BUILD_STORAGE", "mmap")
+# recent guest/user questions replayed against a new index before it goes live
+WARMUP_QUERIES = int(os.getenv("WARMUP_QUERIES", "20"))
+# lines on this many pages of a crawl are dropped as site chrome; chunks this similar are collapsed (0 = off)
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", "5"))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+# "http" fetches pages directly (headless Chrome only for JavaScript pages), "browser" renders every page in
+# one Chrome, "browser_pool" in BROWSER_WORKERS Chromes restarted every BROWSER_RECYCLE_PAGES pages
+SCRAPER_MODE = os.getenv("SCRAPER_MODE", "http")
+SCRAPER_CONCURRENCY = int(os.getenv("SCRAPER_CONCURRENCY", "8"))
+SCRAPER_DELAY_MS = float(os.getenv("SCRAPER_DELAY_MS", "100"))
+BROWSER_WORKERS = int(os.getenv("BROWSER_WORKERS", "4"))
+BROWSER_RECYCLE_PAGES = int(os.getenv("BROWSER_RECYCLE_PAGES", "50"))
+# Chrome skips images, fonts, media and tracker scripts; pages are read once the DOM or network has been
+# quiet for SCRAPER_QUIET_MS, waiting at most SCRAPER_MAX_SETTLE_MS after the load event
+SCRAPER_BLOCK_RESOURCES = os.getenv("SCRAPER_BLOCK_RESOURCES", "1") == "1"
+SCRAPER_QUIET_MS = float(os.getenv("SCRAPER_QUIET_MS", "500"))
+SCRAPER_MAX_SETTLE_MS = float(os.getenv("SCRAPER_MAX_SETTLE_MS", "2000"))
+# http re-crawls send the stored ETag/Last-Modified and carry unchanged pages forward from the previous index
+CONDITIONAL_RECRAWL = os.getenv("CONDITIONAL_RECRAWL", "1") == "1"
+# the crawl frontier is checkpointed in SQLite; a scrape interrupted by a crash or restart resumes on the next trigger
+CRAWL_RESUME = os.getenv("CRAWL_RESUME", "1") == "1"
+# "main" keeps a page's main content (lxml, with "# heading" / "- item" markup), "text" all of its text
+SCRAPER_EXTRACTOR = os.getenv("SCRAPER_EXTRACTOR", "main")
+# pages buffered between crawl, DB write and embedding stages of a scrape
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+# prompt context budget, filled with the fused candidates in relevance order
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "750"))
+
+# onboarding / goodbye detection for guests, before any LLM call
+intent_router = IntentRouter(
+    retrieval_engine.embed_documents,
+    threshold=float(os.getenv("INTENT_THRESHOLD", "0.8")),
+)
+
+# answers to recent queries, matched by embedding similarity
+response_cache = SemanticCache(
+    threshold=float(os.getenv("CHAT_CACHE_THRESHOLD", "0.92")),
+    max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=int(os.getenv("CHAT_CACHE_TTL", "3600")),
+)
+
 # db and admin cred
 def init_db():
     conn = sqlite3.connect('database.db')
@@ -42,9 +108,30 @@ def init_db():
                 index_name TEXT, 
                 page_url TEXT,
                 content TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                title TEXT
             )
     ''')
+    # databases created before pages kept their HTTP validators and title
+    columns = {row[1] for row in c.execute("PRAGMA table_info(knowledge)")}
+    for column in ("etag", "last_modified", "content_hash", "title"):
+        if column not in columns:
+            c.execute(f"ALTER TABLE knowledge ADD COLUMN {column} TEXT")
+
+    # BM25 index over knowledge, one row per chunk; rebuilt for databases whose FTS index has no chunk_index
+    fts_columns = [row[1] for row in c.execute("PRAGMA table_info(knowledge_fts)").fetchall()]
+    if fts_columns and "chunk_index" not in fts_columns:
+        c.execute("DROP TABLE knowledge_fts")
+    create_fts_table(c)
+    if c.execute("SELECT COUNT(*) FROM knowledge_fts").fetchone()[0] == 0:
+        # databases created before the FTS index existed
+        rows = c.execute("SELECT index_name, page_url, content FROM knowledge").fetchall()
+        for index_name, page_url, content in rows:
+            c.executemany("INSERT INTO knowledge_fts (content, index_name, page_url, chunk_index) VALUES (?, ?, ?, ?)",
+                          [(chunk, index_name, page_url, i) for i, chunk in enumerate(split_page(content or ""))])
 
     c.execute('''
         CREATE TABLE IF NOT EXISTS users
@@ -94,8 +181,17 @@ def init_db():
 # calling db init
 init_db()
 
+metrics.register_gauges(lambda: {
+    f"response_cache_{key}": value for key, value in response_cache.stats().items()
+})
+metrics.register_gauges(lambda: {
+    f"embed_batch_{key}": value for key, value in retrieval_engine.batcher.stats().items()
+    if isinstance(value, (int, float))
+})
+
 # <----------------------------------------------------- HELper FUNCIONS ------------------------------------------------------------>
 
+@metrics.timed("db.get_active_index_name")
 def get_active_index_name():
     conn = sqlite3.connect('database.db')
     c = conn.cursor()
@@ -105,20 +201,47 @@ def get_active_index_name():
     return result[0] if result else ""
 
 
+@metrics.timed("db.set_active_index")
 def set_active_index(index_name):
     conn = sqlite3.connect('database.db')
     c = conn.cursor()
     c.execute("REPLACE INTO config (key, value) VALUES ('active_index_name', ?)", (index_name,))
     conn.commit()
     conn.close()
+    response_cache.clear() # cached answers came from the previous index
 
 
+@metrics.timed("db.crawl_checkpoint")
+def crawl_checkpoint():
+    """Index name of the scrape that started but never finished, or ""."""
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute("SELECT value FROM config WHERE key='crawl_in_progress'")
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else ""
+
+
+@metrics.timed("db.set_crawl_checkpoint")
+def set_crawl_checkpoint(index_name):
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute("REPLACE INTO config (key, value) VALUES ('crawl_in_progress', ?)", (index_name,))
+    conn.commit()
+    conn.close()
+
+
+@metrics.timed("db.delete_index")
 def delete_index(index_name):
+    retrieval_engine.evict(index_name)
+    response_cache.clear(index_name)
     conn = sqlite3.connect('database.db')
     c = conn.cursor()
     c.execute("DELETE FROM knowledge WHERE index_name=?", (index_name,))
+    c.execute("DELETE FROM knowledge_fts WHERE index_name=?", (index_name,))
     conn.commit()
     conn.close()
+    delete_index_chunks(index_name)
     
     if os.path.exists(index_name) and os.path.isdir(index_name):
         try:
@@ -131,15 +254,63 @@ def delete_index(index_name):
         set_active_index("")
         print(f"Reset active index.")
 
+@metrics.timed("db.insert_knowledge")
 def insert_knowledge(index_name, data_list):
     conn = sqlite3.connect('database.db')
     c = conn.cursor()
     for item in data_list:
-        c.execute("INSERT INTO knowledge (index_name, page_url, content) VALUES (?, ?, ?)", 
-                  (index_name, item['url'], item['content']))
+        c.execute("INSERT INTO knowledge (index_name, page_url, content, etag, last_modified, content_hash, title) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (index_name, item['url'], item['content'], item.get('etag'), item.get('last_modified'), item.get('content_hash'),
+                   item.get('title')))
+        # provisional rows from the raw page; IndexBuilder.finish() replaces them with the indexed chunks
+        c.executemany("INSERT INTO knowledge_fts (content, index_name, page_url, chunk_index) VALUES (?, ?, ?, ?)",
+                      [(chunk, index_name, item['url'], i) for i, chunk in enumerate(split_page(item['content']))])
     conn.commit()
     conn.close()
 
+
+@metrics.timed("db.page_validators")
+def page_validators(index_name):
+    """url -> {'title', 'content', 'etag', 'last_modified', 'content_hash'} of every page in index_name, for a conditional re-crawl."""
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute("SELECT page_url, title, content, etag, last_modified, content_hash FROM knowledge WHERE index_name=?", (index_name,))
+    pages = {url: {'url': url, 'title': title, 'content': content, 'etag': etag, 'last_modified': last_modified,
+                   'content_hash': content_hash}
+             for url, title, content, etag, last_modified, content_hash in c.fetchall()}
+    conn.close()
+    return pages
+
+
+@metrics.timed("db.latest_index_name")
+def latest_index_name(exclude=None):
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT index_name FROM knowledge WHERE index_name != ? ORDER BY index_name DESC LIMIT 1", (exclude or "",))
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+
+@metrics.timed("db.lexical_search")
+def lexical_search(index_name, query, k=6):
+    """Returns the k best BM25 chunk matches for query in index_name."""
+    terms = re.findall(r"\w+", (query or "").lower())
+    if not terms:
+        return []
+    match = " OR ".join(f'"{term}"' for term in terms)
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute('''
+        SELECT content, page_url, chunk_index FROM knowledge_fts
+        WHERE knowledge_fts MATCH ? AND index_name = ?
+        ORDER BY rank LIMIT ?
+    ''', (match, index_name, k))
+    rows = c.fetchall()
+    conn.close()
+    return [Document(page_content=content, metadata={'page_url': page_url, 'chunk_index': chunk_index})
+            for content, page_url, chunk_index in rows]
+
 def validate_email(email):
     if not isinstance(email, str):
         return False
@@ -150,6 +321,7 @@ def validate_phone(phone):
     return bool(phone) and len(phone) == 10 and phone.isdigit()
 
 
+@metrics.timed("db.store_pii")
 def store_pii(name, email, phone):
     # if not validate_email(email) or not validate_phone(phone):
     #     return None
@@ -177,6 +349,7 @@ def store_pii(name, email, phone):
         return None
     
 
+@metrics.timed("db.get_user_name")
 def get_user_name(user_id):
     if not user_id: return None
     conn = sqlite3.connect('database.db')
@@ -187,6 +360,18 @@ def get_user_name(user_id):
     return result[0] if result else None
 
 
+@metrics.timed("db.recent_questions")
+def recent_questions(limit):
+    """The latest distinct user messages from chat_history, newest first."""
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute("SELECT message FROM chat_history WHERE is_bot = 0 GROUP BY message ORDER BY MAX(timestamp) DESC, MAX(rowid) DESC LIMIT ?", (limit,))
+    questions = [row[0] for row in c.fetchall()]
+    conn.close()
+    return questions
+
+
+@metrics.timed("db.is_onboarded")
 def is_onboarded(user_id):
     if not user_id: return False
     conn = sqlite3.connect('database.db')
@@ -197,6 +382,7 @@ def is_onboarded(user_id):
     return bool(result[0]) if result else False
 
 
+@metrics.timed("db.log_chat")
 def log_chat(user_id, message, is_bot):
     if not user_id: return 
     conn = sqlite3.connect('database.db')
@@ -206,6 +392,52 @@ def log_chat(user_id, message, is_bot):
     conn.close()
 
 
+@metrics.timed("db.log_chat_rows")
+def log_chat_rows(rows):
+    """Writes several (user_id, message, is_bot) rows in one transaction."""
+    rows = [row for row in rows if row[0]]
+    if not rows: return
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.executemany("INSERT INTO chat_history (user_id, message, is_bot) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+# chat history rows waiting for the background writer
+chat_log_queue = queue.Queue()
+chat_log_thread = None
+chat_log_thread_lock = threading.Lock()
+
+def chat_log_writer():
+    while True:
+        rows = [chat_log_queue.get()]
+        try:
+            while True:
+                rows.append(chat_log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            log_chat_rows(rows)
+        except Exception as e:
+            print(f"Error writing chat history: {e}")
+        finally:
+            for _ in rows:
+                chat_log_queue.task_done()
+
+
+def log_chat_later(user_id, message, reply):
+    """Queues both sides of a chat for the background writer and returns the reply."""
+    global chat_log_thread
+    with chat_log_thread_lock:
+        if chat_log_thread is None:
+            chat_log_thread = threading.Thread(target=chat_log_writer, daemon=True)
+            chat_log_thread.start()
+    chat_log_queue.put((user_id, message, False))
+    chat_log_queue.put((user_id, reply['response'], True))
+    return reply
+
+
 def trigger_onboarding_tool(query=""):
     return "ACTION_TRIGGER_ONBOARDING"
 
@@ -227,34 +459,233 @@ def fallback_response(query):
     return f"Sorry, our chatbot service is unavailable or not yet configured. Please visit our site: {links['services']}"
 
 
+_PIPELINE_END = object()
+
+def _pipeline_put(out_queue, item, stop):
+    """Blocks while out_queue is full (backpressure) unless the pipeline is being stopped."""
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _pipeline_items(in_queue, stop):
+    while not stop.is_set():
+        try:
+            item = in_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        if item is _PIPELINE_END:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _pipeline_stage(source, out_queue, stop, handle=None):
+    """Moves items from source to out_queue, calling handle on each; errors are passed downstream."""
+    try:
+        for item in source:
+            if handle:
+                handle(item)
+            if not _pipeline_put(out_queue, item, stop):
+                break
+        else:
+            _pipeline_put(out_queue, _PIPELINE_END, stop)
+    except Exception as e:
+        _pipeline_put(out_queue, e, stop)
+    finally:
+        if hasattr(source, "close"):
+            source.close() # lets the crawler quit its browser
+
+
+def stream_pages_to_index(pages, index_name, builder, on_page=None):
+    """
+    Runs crawl -> knowledge table -> chunk/embed as a pipeline: pages (an
+    iterator, normally the crawler) and the DB writes each get a thread, and
+    the caller's thread feeds builder. Bounded queues between the stages
+    make a fast stage wait for a slow one instead of piling up pages.
+    Returns the number of pages indexed; builder.finish() is left to the caller.
+    """
+    stop = threading.Event()
+    crawled = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stored = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stages = [
+        threading.Thread(target=_pipeline_stage, args=(pages, crawled, stop), daemon=True),
+        threading.Thread(target=_pipeline_stage, args=(_pipeline_items(crawled, stop), stored, stop,
+                                                       lambda page: insert_knowledge(index_name, [page])), daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+    count = 0
+    try:
+        for page in _pipeline_items(stored, stop):
+            builder.add_page(page)
+            count += 1
+            if on_page:
+                on_page(count)
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+    return count
+
+
+def count_crawl(pages, counts):
+    """Passes pages through, counting the ones fetched and the ones carried forward unchanged."""
+    try:
+        for page in pages:
+            counts["unchanged" if page.get('reused') else "fetched"] += 1
+            yield page
+    finally:
+        if hasattr(pages, "close"):
+            pages.close()
+
+
 def run_scraper_background():
     global scraping_status
     scraping_status["running"] = True
     scraping_status["progress"] = "Starting ....."
+    frontier = builder = None
     try:
-        scraped_data = scraper()
-        if not scraped_data:
+        resumed = crawl_checkpoint() if CRAWL_RESUME else ""
+        new_index_name = resumed or f"faiss_{int(time.time())}"
+        set_crawl_checkpoint(new_index_name)
+        frontier = CrawlFrontier(path='database.db', crawl_id=new_index_name)
+        # pages the interrupted crawl already stored are kept; the ones it fetched but lost are fetched again
+        stored = page_validators(new_index_name) if resumed else {}
+        frontier.requeue_done(keep=stored)
+        # unchanged pages keep their content and vectors from the active (or newest) index
+        last_index = get_active_index_name() or latest_index_name(exclude=new_index_name)
+        previous_index = last_index if INCREMENTAL_BUILDS else None
+        known = page_validators(last_index) if CONDITIONAL_RECRAWL and last_index else None
+        counts = {"fetched": 0, "unchanged": 0}
+        builder = IndexBuilder(new_index_name, previous_index=previous_index,
+                               workers=BUILD_WORKERS, batch_size=BUILD_BATCH_SIZE,
+                               index_spec=BUILD_INDEX_SPEC, storage=BUILD_STORAGE,
+                               boilerplate_min_pages=BOILERPLATE_MIN_PAGES,
+                               near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD)
+        if stored:
+            scraping_status["progress"] = f"Resuming {new_index_name}: {len(stored)} pages already crawled"
+            for page in stored.values():
+                builder.add_page(page)
+
+        # pages are saved and embedded while the crawl is still running
+        def on_page(count):
+            scraping_status["progress"] = (f"Crawling and indexing under {new_index_name}: {count} pages"
+                                           f" ({counts['unchanged']} unchanged), {len(builder.texts)} chunks")
+        with metrics.span("scrape.crawl_and_embed"):
+            crawl_options = {'block_resources': SCRAPER_BLOCK_RESOURCES, 'max_settle': SCRAPER_MAX_SETTLE_MS / 1000,
+                             'quiet': SCRAPER_QUIET_MS / 1000, 'extractor': SCRAPER_EXTRACTOR}
+            if SCRAPER_MODE == "browser":
+                crawl = iter_pages(frontier=frontier, **crawl_options)
+            elif SCRAPER_MODE == "browser_pool":
+                crawl = iter_pages_pool(workers=BROWSER_WORKERS, delay=SCRAPER_DELAY_MS / 1000,
+                                        recycle_after=BROWSER_RECYCLE_PAGES, frontier=frontier, **crawl_options)
+            else:
+                crawl = iter_pages_http(concurrency=SCRAPER_CONCURRENCY, delay=SCRAPER_DELAY_MS / 1000, known=known,
+                                        frontier=frontier, **crawl_options)
+            pages = stream_pages_to_index(count_crawl(crawl, counts), new_index_name, builder, on_page=on_page)
+        if not pages and not stored:
+            frontier.clear()
+            set_crawl_checkpoint("")
             scraping_status["progress"] = "Scraping completed, but no data found."
             scraping_status["running"] = False
             return
         
-        new_index_name = f"faiss_{int(time.time())}"
-        scraping_status["progress"] = f"Saving to DB under index: {new_index_name}"
-        insert_knowledge(new_index_name, scraped_data)
-        
         scraping_status["progress"] = f"Building FAISS index: {new_index_name}"
-        build_faiss_index(new_index_name, scraped_data)
+        with metrics.span("scrape.build_index"):
+            stats = builder.finish() or {}
+        frontier.clear()
+        set_crawl_checkpoint("")
         
-        scraping_status["progress"] = f"Completed. New index created: {new_index_name}. Admin must set it as active."
+        resume = f" Resumed an interrupted crawl with {len(stored)} pages already stored." if stored else ""
+        crawled = f" Fetched {counts['fetched']} pages, {counts['unchanged']} unchanged since {last_index}." if counts['unchanged'] else ""
+        reused = f" Reused {stats['pages_reused']} unchanged pages from {previous_index}." if stats.get('pages_reused') else ""
+        speed = f" Embedded {stats['chunks_embedded']} chunks at {stats['chunks_per_sec']} chunks/sec." if stats.get('chunks_per_sec') else ""
+        recall = f" {stats['index_type']} recall@10: {stats['recall_at_10']:.3f}." if stats.get('index_type', 'flat') != 'flat' else ""
+        dedup = (f" Removed {stats['chunks_removed']} boilerplate/duplicate chunks"
+                 f" ({stats['vectors_removed']} already embedded)." if stats.get('chunks_removed') else "")
+        scraping_status["progress"] = f"Completed. New index created: {new_index_name}.{resume}{crawled}{reused}{speed}{recall}{dedup} Admin must set it as active."
     
     except Exception as e:
+        metrics.inc("scrape_error")
         scraping_status["progress"] = f"ERROR: {str(e)}"
     finally:
+        if builder is not None:
+            builder.close()
+        if frontier is not None:
+            frontier.close()
         scraping_status["running"] = False
 
 
+# used when there is no chat history to replay yet
+DEFAULT_WARMUP_QUERIES = ["What services do you offer?", "How can I contact you?", "How do I sign up?"]
+
+def run_activation_background(index_name):
+    """
+    Loads index_name next to the one being served, validates it, replays
+    recent questions against it (which also loads the embedding model and
+    pages in the index), and only then makes it the active index. On any
+    failure the active index is left as it was.
+    """
+    global activation_status
+    timings = {}
+    activation_status.update({"running": True, "index_name": index_name, "stage": "loading",
+                              "progress": "Loading index", "timings": timings, "error": None})
+    try:
+        start = time.perf_counter()
+        with metrics.span("activation.load"):
+            vectorstore = retrieval_engine.load(index_name)
+        timings["load_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        activation_status.update({"stage": "validating", "progress": "Validating index"})
+        questions = recent_questions(WARMUP_QUERIES) or DEFAULT_WARMUP_QUERIES
+        start = time.perf_counter()
+        with metrics.span("activation.validate"):
+            query_vector = retrieval_engine.embed_query(questions[0])
+            validate_vectorstore(vectorstore, dim=len(query_vector))
+        timings["validate_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        activation_status["stage"] = "warming"
+        query_ms = []
+        for i, question in enumerate(questions, start=1):
+            activation_status["progress"] = f"Warm-up query {i}/{len(questions)}"
+            start = time.perf_counter()
+            with metrics.span("activation.warmup_query"):
+                query_vector = retrieval_engine.embed_query(question)
+                intent_router.classify(question, query_vector)
+                vectorstore.similarity_search_by_vector(query_vector, k=RETRIEVAL_CANDIDATES)
+                if RETRIEVAL_MODE != "vector":
+                    lexical_search(index_name, question, k=RETRIEVAL_CANDIDATES)
+            query_ms.append(round((time.perf_counter() - start) * 1000, 1))
+        timings.update({
+            "warmup_queries": len(query_ms),
+            "warmup_ms": round(sum(query_ms), 1),
+            "first_query_ms": query_ms[0],
+            "last_query_ms": query_ms[-1],
+            "max_query_ms": max(query_ms),
+        })
+
+        # the pointer flips only now; the previous store keeps serving until then
+        retrieval_engine.install(index_name, vectorstore)
+        set_active_index(index_name)
+        activation_status.update({"stage": "active", "progress": f"Index {index_name} is active"})
+
+    except Exception as e:
+        metrics.inc("activation_error")
+        print(f"Activation of FAISS index {index_name} failed: {e}")
+        activation_status.update({"stage": "failed", "progress": f"ERROR: {e}", "error": str(e)})
+    finally:
+        activation_status["running"] = False
+
+
 # <----------------------------------------------------- ROUTING ----------------------------------------------------->
 
+@metrics.timed("db.check_admin_auth")
 def check_admin_auth(user_id):
     if not user_id: return False
     conn = sqlite3.connect('database.db')
@@ -283,6 +714,30 @@ def scrape_status():
     return jsonify(scraping_status)
 
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    user_id = request.args.get('user_id')
+    if not check_admin_auth(user_id):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(response_cache.stats())
+
+
+@app.route('/embedding_stats', methods=['GET'])
+def embedding_stats():
+    user_id = request.args.get('user_id')
+    if not check_admin_auth(user_id):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(retrieval_engine.batcher.stats())
+
+
+@app.route('/embedding_cache_stats', methods=['GET'])
+def embedding_cache_stats():
+    user_id = request.args.get('user_id')
+    if not check_admin_auth(user_id):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(embedding_cache.stats())
+
+
 @app.route('/indexes', methods=['GET'])
 def get_indexes():
     user_id = request.args.get('user_id')
@@ -293,7 +748,9 @@ def get_indexes():
     c.execute("SELECT DISTINCT index_name FROM knowledge ORDER BY index_name DESC")
     indexes = [row[0] for row in c.fetchall()]
     conn.close()
-    return jsonify({'indexes': indexes, 'active': get_active_index_name()})
+    # type, recall@10 and vector memory of each index, from its index_spec.json
+    details = {name: read_index_spec(name) for name in indexes}
+    return jsonify({'indexes': indexes, 'active': get_active_index_name(), 'details': details})
 
 
 @app.route('/set_active_index', methods=['POST'])
@@ -304,8 +761,25 @@ def set_active_index_route():
     index_name = request.json.get('index_name')
     if index_name is None:
         return jsonify({'error': 'Missing index_name'}), 400
-    set_active_index(index_name)
-    return jsonify({'status': 'Active index set', 'index_name': index_name})
+    if not index_name:
+        retrieval_engine.evict()
+        set_active_index(index_name)
+        return jsonify({'status': 'Active index set', 'index_name': index_name})
+    # checked and claimed under the lock before the thread starts, so double clicks and concurrent requests are refused
+    with activation_lock:
+        if activation_status["running"]:
+            return jsonify({'error': "Activation in progress"}), 429
+        activation_status["running"] = True
+    threading.Thread(target=run_activation_background, args=(index_name,)).start()
+    return jsonify({'status': 'Activation started', 'index_name': index_name}), 202
+
+
+@app.route('/activation_status', methods=['GET'])
+def activation_status_route():
+    user_id = request.args.get('user_id')
+    if not check_admin_auth(user_id):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(activation_status)
     
 
 @app.route('/delete_index', methods=['POST'])
@@ -393,61 +867,22 @@ def get_chat_history():
     return jsonify(history)
 
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    user_id = request.json.get('user_id') 
-    message = request.json.get('message')
-    name = get_user_name(user_id)
-    onboarded = is_onboarded(user_id)
+# <----------------------------------------------------- CHAT PIPELINE ----------------------------------------------------->
 
-    active_index = get_active_index_name()
-    if not active_index:
-        print("Chat Fallback: No active index set.")
-        response_text = fallback_response(message)
-        log_chat(user_id, message, False)
-        log_chat(user_id, response_text, True)
-        return jsonify({'response': response_text})
-    
-    try:
-        faiss_path = active_index
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        vectorstore = FAISS.load_local(faiss_path, embeddings, allow_dangerous_deserialization=True)
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-    except Exception as e:
-        print(f"Chat Fallback: Failed to load FAISS index {faiss_path}. Error: {e}")
-        response_text = fallback_response(message)
-        log_chat(user_id, message, False)
-        log_chat(user_id, response_text, True)
-        return jsonify({'response': response_text})
-    
-    # --- RAG Logic ---
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3)
-    tools = []
-    
-    # Only add onboarding tool for GUESTS (user_id is None)
-    if not user_id: 
-        tools = [Tool(
-            name="trigger_onboarding",
-            func=trigger_onboarding_tool,
-            description="Use if user explicitly mentions onboarding/sign up (e.g., 'sign up', 'join', 'register') or conversation is ending (e.g., 'bye', 'thanks')."
-        )]
+ONBOARDING_RESPONSE = "I can help with that! Please complete the form below to sign up."
 
-    try:
-        retrieved_docs = retriever.invoke(message)
-        context_string = combine_retrieved_chunks(retrieved_docs)
-    except Exception as e:
-        print(f"ERROR: Retriever failed. Error: {e}")
-        context_string = ""
+ONBOARDING_TRIGGERS = [
+    "ACTION_TRIGGER_ONBOARDING",
+    "onboarding process initiated",
+    "sign-up process",
+    "please complete the form",
+    "ready to onboard",
+    "let’s get you registered",
+    "action_trigger_onboarding",
+    "initiated",
+]
 
-    prompt = f"""You are a helpful assistant for Occams Advisory. 
-    Answer using retrieved context. 
-    Personalize with name if needed: {name or 'User'}. Query: {message}. Context: {context_string}"""
-    
-    # --- AGENT vs. LLM Call ---
-    try:
-        if tools:
-            # --- PATH 1: Use Agent (for GUESTS) ---
-            tool_priority_instructions = """
+TOOL_PRIORITY_INSTRUCTIONS = """
                             ---
                             IMPORTANT INSTRUCTIONS:
                             You have a special tool called 'trigger_onboarding'.
@@ -456,41 +891,250 @@ def chat():
                             You MUST use the 'trigger_onboarding' tool.
                             For these specific cases, DO NOT use the retrieved context to answer.
                             """
-            prompt += tool_priority_instructions
-            
-            agent = initialize_agent(tools, llm, agent_type="zero-shot-react-description", verbose=True)
-            response_text = agent.run(prompt)
-
-            
-            onboarding_triggers = [
-                "ACTION_TRIGGER_ONBOARDING",
-                "onboarding process initiated",
-                "sign-up process",
-                "please complete the form",
-                "ready to onboard",
-                "let’s get you registered",
-                "action_trigger_onboarding",
-                "initiated",
-            ]
-
-            if any(trigger.lower() in response_text.lower() for trigger in onboarding_triggers):
-                response_text = "I can help with that! Please complete the form below to sign up."
-                log_chat(user_id, message, False)
-                log_chat(user_id, response_text, True)
-                return jsonify({'response': response_text, 'action': 'open_pii_dialog'})
-        
-        else:
-            # --- PATH 2: Use direct LLM (for LOGGED-IN USERS) ---
-            response = llm.invoke(prompt)
-            response_text = response.content
 
+
+def get_llm():
+    return ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3)
+
+
+def prepare_chat(user_id, message, active_index=None, query_vector=None):
+    """
+    Runs every chat stage before the LLM call. The returned state has a
+    finished 'reply' when the message can be answered without the LLM
+    (fallback or cache hit); otherwise it carries the retrieved context and
+    cache key. Callers that already looked up the active index or embedded
+    the query can pass them in.
+    """
+    state = {'reply': None, 'context': "", 'cache_scope': None, 'query_vector': query_vector, 'intent': None}
+
+    if active_index is None:
+        active_index = get_active_index_name()
+    if not active_index:
+        print("Chat Fallback: No active index set.")
+        metrics.inc("chat_fallback")
+        state['reply'] = {'response': fallback_response(message)}
+        return state
+
+    lexical_docs = []
+    if RETRIEVAL_MODE != "vector":
+        try:
+            with metrics.span("chat.lexical_search"):
+                lexical_docs = lexical_search(active_index, message, RETRIEVAL_CANDIDATES)
+        except Exception as e:
+            metrics.inc("retriever_error")
+            print(f"ERROR: Lexical search failed. Error: {e}")
+
+    vectorstore = None
+    if RETRIEVAL_MODE != "lexical":
+        vectorstore = retrieval_engine.peek(active_index)
+        if vectorstore is None and lexical_docs and RETRIEVAL_MODE == "hybrid":
+            # cold index: answer from the lexical hits while the vectors load
+            metrics.inc("lexical_only")
+            retrieval_engine.load_in_background(active_index)
+        elif vectorstore is None:
+            try:
+                with metrics.span("chat.index_load"):
+                    vectorstore = retrieval_engine.get_vectorstore(active_index)
+            except Exception as e:
+                metrics.inc("index_load_error")
+                print(f"Failed to load FAISS index {active_index}. Error: {e}")
+                if not lexical_docs:
+                    print("Chat Fallback: No vector or lexical results.")
+                    metrics.inc("chat_fallback")
+                    state['reply'] = {'response': fallback_response(message)}
+                    return state
+
+    # --- Response Cache ---
+    # guests and logged-in users take different paths (agent vs direct LLM)
+    state['cache_scope'] = (active_index, bool(user_id))
+    if state['query_vector'] is None and vectorstore is not None:
+        try:
+            with metrics.span("chat.embed_query"):
+                state['query_vector'] = retrieval_engine.embed_query(message)
+        except Exception as e:
+            print(f"ERROR: Query embedding failed. Error: {e}")
+
+    if state['query_vector'] is not None:
+        with metrics.span("chat.cache_lookup"):
+            cached = response_cache.lookup(state['cache_scope'], state['query_vector'])
+        if cached:
+            metrics.inc("cache_hit")
+            state['reply'] = {'response': cached['response']}
+            if cached['action']:
+                state['reply']['action'] = cached['action']
+            return state
+        metrics.inc("cache_miss")
+
+    # --- Guest Intent ---
+    # clear onboarding/goodbye messages skip retrieval and the LLM;
+    # only ambiguous ones go through the agent
+    if not user_id:
+        try:
+            with metrics.span("chat.intent"):
+                state['intent'] = intent_router.classify(message, state['query_vector'])
+        except Exception as e:
+            print(f"ERROR: Intent router failed. Error: {e}")
+            state['intent'] = "ambiguous"
+        metrics.inc(f"intent_{state['intent']}")
+        if state['intent'] in ("onboarding", "goodbye"):
+            state['reply'] = {'response': ONBOARDING_RESPONSE, 'action': 'open_pii_dialog'}
+            return state
+    
+    # --- RAG Logic ---
+    vector_docs = []
+    if vectorstore is not None:
+        try:
+            with metrics.span("chat.vector_search"):
+                vector_docs = vectorstore.similarity_search_by_vector(state['query_vector'], k=RETRIEVAL_CANDIDATES)
+        except Exception as e:
+            metrics.inc("retriever_error")
+            print(f"ERROR: Retriever failed. Error: {e}")
+
+    try:
+        with metrics.span("chat.context_pack"):
+            retrieved_docs = reciprocal_rank_fusion([vector_docs, lexical_docs])
+            state['context'] = combine_retrieved_chunks(retrieved_docs, token_budget=CONTEXT_TOKEN_BUDGET)
     except Exception as e:
-        print(f"CRITICAL: Agent/LLM failed to run. Error: {e}")
-        response_text = fallback_response(message)
+        print(f"ERROR: Combining retrieved chunks failed. Error: {e}")
+    return state
+
+
+def build_prompt(name, message, context_string):
+    return f"""You are a helpful assistant for Occams Advisory. 
+    Answer using retrieved context. 
+    Personalize with name if needed: {name or 'User'}. Query: {message}. Context: {context_string}"""
+
+
+def run_guest_agent(llm, prompt):
+    """Runs the onboarding agent for GUESTS. Returns (response_text, action)."""
+    tools = [Tool(
+        name="trigger_onboarding",
+        func=trigger_onboarding_tool,
+        description="Use if user explicitly mentions onboarding/sign up (e.g., 'sign up', 'join', 'register') or conversation is ending (e.g., 'bye', 'thanks')."
+    )]
+    agent = initialize_agent(tools, llm, agent_type="zero-shot-react-description", verbose=True)
+    response_text = agent.run(prompt + TOOL_PRIORITY_INSTRUCTIONS)
+
+    if any(trigger.lower() in response_text.lower() for trigger in ONBOARDING_TRIGGERS):
+        return ONBOARDING_RESPONSE, 'open_pii_dialog'
+    return response_text, None
+
 
+def cache_reply(state, name, reply, llm_seconds):
+    if state['query_vector'] is None:
+        return
+    # answers that greet the user by name are not shared with other users
+    if not reply.get('action') and name and name.lower() in reply['response'].lower():
+        return
+    response_cache.store(state['cache_scope'], state['query_vector'], reply['response'], reply.get('action'), llm_seconds)
+
+
+def finish_chat(user_id, message, reply):
     log_chat(user_id, message, False)
-    log_chat(user_id, response_text, True)
-    return jsonify({'response': response_text})
+    log_chat(user_id, reply['response'], True)
+    return reply
+
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    user_id = request.json.get('user_id') 
+    message = request.json.get('message')
+
+    with metrics.request_scope("chat", guest=not user_id) as log_fields:
+        name = get_user_name(user_id)
+        onboarded = is_onboarded(user_id)
+
+        state = prepare_chat(user_id, message)
+        if state['reply']:
+            return jsonify(finish_chat(user_id, message, state['reply']))
+        prompt = build_prompt(name, message, state['context'])
+        log_fields['prompt_tokens'] = estimate_tokens(prompt)
+        
+        # --- AGENT vs. LLM Call ---
+        llm_start = time.time()
+        try:
+            llm = get_llm()
+            if state['intent'] == "ambiguous":
+                # --- PATH 1: Use Agent (for GUESTS the router couldn't decide on) ---
+                with metrics.span("chat.agent"):
+                    response_text, action = run_guest_agent(llm, prompt)
+            else:
+                # --- PATH 2: Use direct LLM (for everyone else) ---
+                with metrics.span("chat.llm"):
+                    response_text, action = llm.invoke(prompt).content, None
+
+            reply = {'response': response_text}
+            if action:
+                reply['action'] = action
+            cache_reply(state, name, reply, time.time() - llm_start)
+
+        except Exception as e:
+            metrics.inc("llm_error")
+            print(f"CRITICAL: Agent/LLM failed to run. Error: {e}")
+            reply = {'response': fallback_response(message)}
+
+        return jsonify(finish_chat(user_id, message, reply))
+
+
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """
+    Same as /chat, but answers as JSON lines: {"token": ...} while the LLM
+    generates, then {"done": true, "response": ..., "action"?: ...} with the
+    full reply once it is logged.
+    """
+    user_id = request.json.get('user_id') 
+    message = request.json.get('message')
+
+    def generate():
+        with metrics.request_scope("chat_stream", guest=not user_id) as log_fields:
+            name = get_user_name(user_id)
+            state = prepare_chat(user_id, message)
+            if state['reply']:
+                reply = state['reply']
+                yield json.dumps({'token': reply['response']}) + "\n"
+                yield json.dumps({'done': True, **finish_chat(user_id, message, reply)}) + "\n"
+                return
+            prompt = build_prompt(name, message, state['context'])
+            log_fields['prompt_tokens'] = estimate_tokens(prompt)
+
+            llm_start = time.time()
+            try:
+                llm = get_llm()
+                if state['intent'] == "ambiguous":
+                    # the agent picks its tool before answering, so its reply arrives in one piece
+                    with metrics.span("chat.agent"):
+                        response_text, action = run_guest_agent(llm, prompt)
+                    yield json.dumps({'token': response_text}) + "\n"
+                else:
+                    parts, action = [], None
+                    for chunk in llm.stream(prompt):
+                        if chunk.content:
+                            if not parts:
+                                metrics.observe("chat.first_token", time.time() - llm_start)
+                            parts.append(chunk.content)
+                            yield json.dumps({'token': chunk.content}) + "\n"
+                    response_text = "".join(parts)
+                    metrics.observe("chat.llm", time.time() - llm_start)
+
+                reply = {'response': response_text}
+                if action:
+                    reply['action'] = action
+                cache_reply(state, name, reply, time.time() - llm_start)
+
+            except Exception as e:
+                metrics.inc("llm_error")
+                print(f"CRITICAL: Agent/LLM failed to run. Error: {e}")
+                reply = {'response': fallback_response(message)}
+
+            yield json.dumps({'done': True, **finish_chat(user_id, message, reply)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/onboard', methods=['POST'])
 def onboard():
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import time
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+import app as backend
+import metrics
+
+# Async serving path: /chat runs on the event loop, every other route is the
+# Flask app mounted as WSGI. Run with: uvicorn asgi_app:app
+
+# max Gemini calls in flight per process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+def embed_query(message):
+    try:
+        return backend.retrieval_engine.embed_query(message)
+    except Exception as e:
+        print(f"ERROR: Query embedding failed. Error: {e}")
+        return None
+
+
+async def chat(request):
+    data = await request.json()
+    user_id = data.get('user_id')
+    message = data.get('message')
+
+    with metrics.request_scope("chat_async", guest=not user_id):
+        # the DB lookups and the query embedding don't depend on each other
+        name, active_index, query_vector = await asyncio.gather(
+            asyncio.to_thread(backend.get_user_name, user_id),
+            asyncio.to_thread(backend.get_active_index_name),
+            asyncio.to_thread(embed_query, message),
+        )
+        state = await asyncio.to_thread(backend.prepare_chat, user_id, message, active_index, query_vector)
+        if state['reply']:
+            return JSONResponse(backend.log_chat_later(user_id, message, state['reply']))
+        prompt = backend.build_prompt(name, message, state['context'])
+
+        llm_start = time.time()
+        try:
+            llm = backend.get_llm()
+            with metrics.span("chat.llm_queue"):
+                await llm_semaphore.acquire()
+            try:
+                if state['intent'] == "ambiguous":
+                    # the agent is synchronous, keep it off the event loop
+                    with metrics.span("chat.agent"):
+                        response_text, action = await asyncio.to_thread(backend.run_guest_agent, llm, prompt)
+                else:
+                    with metrics.span("chat.llm"):
+                        response_text, action = (await llm.ainvoke(prompt)).content, None
+            finally:
+                llm_semaphore.release()
+
+            reply = {'response': response_text}
+            if action:
+                reply['action'] = action
+            backend.cache_reply(state, name, reply, time.time() - llm_start)
+
+        except Exception as e:
+            metrics.inc("llm_error")
+            print(f"CRITICAL: Agent/LLM failed to run. Error: {e}")
+            reply = {'response': backend.fallback_response(message)}
+
+        # history is written by the background writer, not before we respond
+        return JSONResponse(backend.log_chat_later(user_id, message, reply))
+
+
+app = Starlette(routes=[
+    Route('/chat', chat, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(backend.app)),
+])
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=5000)
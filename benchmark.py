@@ -0,0 +1,326 @@
+"""
+Offline benchmark for page extraction, index builds, retrieval and the /chat path.
+
+Runs against a synthetic corpus shaped like the knowledge table (or a JSON
+export of it) in a scratch directory, with a hashing embedder (or the local
+MiniLM copy) and a stub LLM, so nothing is downloaded or called remotely.
+
+    python benchmark.py --output benchmark_results.json
+    python benchmark.py --compare benchmark_results.json   # exit code 1 on regressions
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+# lower-is-better metrics; everything else is higher-is-better
+LOWER_IS_BETTER = {
+    "extract_ms_per_page", "extracted_bytes_per_page",
+    "build_seconds", "index_disk_bytes", "load_seconds",
+    "vector_query_p50_ms", "vector_query_p99_ms",
+    "lexical_query_p50_ms", "lexical_query_p99_ms",
+    "chat_p50_ms", "chat_p99_ms",
+}
+# recall metrics are compared by absolute difference, the rest relative to the baseline
+RECALL_METRICS = {"vector_recall_at_k", "lexical_recall_at_k", "hybrid_recall_at_k", "ann_recall_at_10"}
+# reported for context only
+INFO_METRICS = {"build_chunks", "chunks_removed", "extract_text_ms_per_page", "text_bytes_per_page"}
+
+VOCABULARY = (
+    "tax credit payroll employee retention business owner advisory capital growth strategy accounting "
+    "audit compliance revenue expense deduction filing deadline refund quarter annual report investor "
+    "valuation merger acquisition funding loan equity debt partner client service consultation fee "
+    "schedule meeting office team expert specialist planning estate retirement benefit insurance risk "
+    "portfolio market analysis forecast budget cash flow invoice bookkeeping software platform cloud "
+    "security privacy contract agreement policy regulation federal state local incentive research "
+    "development innovation startup enterprise industry manufacturing healthcare technology retail "
+    "restaurant construction real estate hospitality nonprofit eligibility application review approval"
+).split()
+MENU = ["Home", "Services", "About Us", "Insights", "Careers", "Contact", "Get Started"]
+FOOTER = ["© Occams Advisory. All rights reserved.", "Privacy Policy", "Terms of Use",
+          "This site uses cookies to improve your experience."]
+
+
+class HashingEmbeddings(Embeddings):
+    """Bag-of-words vectors hashed into dim buckets: deterministic, fast and offline."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(word.encode()) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def stub_llm(latency_ms=0.0):
+    """A chat model that answers every prompt (agent prompts included) with a fixed final answer."""
+    return FakeListChatModel(responses=["Final Answer: This is a benchmark answer."],
+                             sleep=latency_ms / 1000 if latency_ms else None)
+
+
+def pseudo_words(count, seed):
+    """Made-up words (product names, jargon), so pages have terms of their own."""
+    rng = random.Random(seed)
+    syllables = ["ka", "ro", "ti", "men", "val", "qu", "ex", "dor", "lin", "sa", "ver", "po", "tri", "zen", "ul"]
+    return sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(count)})
+
+
+def generate_corpus(pages=200, seed=0):
+    """
+    A fixed list of {'url', 'content'} pages: site chrome around paragraphs
+    of common business words mixed with a few terms specific to the page.
+    """
+    rng = random.Random(seed)
+    jargon = pseudo_words(pages * 6, seed)
+    corpus = []
+    for page in range(pages):
+        terms = rng.sample(jargon, 4)
+        paragraphs = []
+        for _ in range(rng.randint(2, 10)):
+            sentences = []
+            for _ in range(rng.randint(2, 5)):
+                words = [rng.choice(terms) if rng.random() < 0.25 else rng.choice(VOCABULARY)
+                         for _ in range(rng.randint(8, 16))]
+                sentences.append(" ".join(words).capitalize() + ".")
+            paragraphs.append(" ".join(sentences))
+        title = " ".join([terms[0]] + rng.sample(VOCABULARY, 2)).title()
+        content = "\n".join(MENU + [title] + paragraphs + FOOTER)
+        corpus.append({'url': f"https://bench.example.com/page-{page}", 'content': content})
+    return corpus
+
+
+def generate_queries(corpus, count=100, seed=1):
+    """(query, source page url) pairs: a sentence of a page with a few words dropped."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        page = rng.choice(corpus)
+        sentences = [s for s in re.split(r"(?<=\.)\s+", page['content']) if len(s.split()) >= 8]
+        words = rng.choice(sentences).rstrip(".").split()
+        keep = sorted(rng.sample(range(len(words)), max(4, len(words) * 2 // 3)))
+        queries.append((" ".join(words[i] for i in keep), page['url']))
+    return queries
+
+
+def page_html(page):
+    """page wrapped in the HTML a crawl would fetch: a menu, its lines as paragraphs in <main>, a footer."""
+    menu = "".join(f"<li><a href='/{item.lower().replace(' ', '-')}'>{item}</a></li>" for item in MENU)
+    body = "".join(f"<p>{line}</p>" for line in page['content'].split("\n"))
+    footer = "".join(f"<p>{line}</p>" for line in FOOTER)
+    return (f"<html><head><title>{page['url']}</title><script>window.dataLayer = [];</script></head><body>"
+            f"<header><nav><ul>{menu}</ul></nav></header><main>{body}</main><footer>{footer}</footer></body></html>")
+
+
+def extraction_benchmark(corpus):
+    """Time per page and bytes kept per page for the main-content extractor against whole-page text."""
+    from extract import get_extractor
+    pages = [(page_html(page), page['url']) for page in corpus]
+    results = {}
+    for name, prefix in (("main", "extract"), ("text", "extract_text")):
+        extractor = get_extractor(name)
+        start = time.perf_counter()
+        kept = sum(len(extractor.extract(html, url)["content"].encode()) for html, url in pages)
+        results[f"{prefix}_ms_per_page"] = round((time.perf_counter() - start) * 1000 / len(pages), 3)
+        results["extracted_bytes_per_page" if name == "main" else "text_bytes_per_page"] = round(kept / len(pages))
+    return results
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3) if samples else None
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def hit_rate(results, queries):
+    hits = sum(any(doc.metadata.get('page_url') == url for doc in docs) for docs, (_, url) in zip(results, queries))
+    return round(hits / len(queries), 4) if queries else None
+
+
+def run_benchmark(corpus, queries, k=3, model="hashing", index_spec="flat", storage="mmap",
+                  workers=1, llm_latency_ms=0.0, workdir=None):
+    """
+    Builds an index over corpus in workdir (a fresh temporary directory by
+    default), then measures loading, retrieval and /chat. Returns the
+    metrics as a flat dict.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="occams_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)  # database.db and the index folder are relative paths
+    import rag
+    import app as backend
+    from embedding_cache import EmbeddingCache
+    saved = (rag._embeddings, rag.embedding_cache, backend.get_llm)
+    try:
+        rag._embeddings = HashingEmbeddings() if model == "hashing" else rag.load_embedding_model()
+        # a cold cache of our own, so the build really embeds every chunk
+        rag.embedding_cache = EmbeddingCache(os.path.join(workdir, "embedding_cache.db"), f"bench-{model}")
+        backend.get_llm = lambda: stub_llm(llm_latency_ms)
+        backend.init_db()
+        index_name = "faiss_bench"
+        results = extraction_benchmark(corpus)
+
+        start = time.perf_counter()
+        backend.insert_knowledge(index_name, corpus)
+        stats = rag.build_faiss_index(index_name, corpus, workers=workers, index_spec=index_spec, storage=storage)
+        results["build_seconds"] = round(time.perf_counter() - start, 3)
+        results["build_chunks"] = rag.read_index_spec(index_name).get("chunks")
+        results["build_chunks_per_sec"] = stats.get("chunks_per_sec")
+        results["chunks_removed"] = stats.get("chunks_removed")
+        results["ann_recall_at_10"] = stats.get("recall_at_10")
+        results["index_disk_bytes"] = directory_bytes(index_name)
+
+        load_times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            store = rag.load_index(index_name, rag.get_embeddings())
+            load_times.append(time.perf_counter() - start)
+        results["load_seconds"] = round(float(np.median(load_times)), 4)
+
+        vector_times, lexical_times, vector_docs, lexical_docs = [], [], [], []
+        for query, _ in queries:
+            start = time.perf_counter()
+            vector_docs.append(store.similarity_search_by_vector(rag.get_embeddings().embed_query(query), k=k))
+            vector_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            lexical_docs.append(backend.lexical_search(index_name, query, k=k))
+            lexical_times.append(time.perf_counter() - start)
+        hybrid_docs = [rag.reciprocal_rank_fusion([v, l])[:k] for v, l in zip(vector_docs, lexical_docs)]
+        results.update({
+            "vector_query_p50_ms": percentile_ms(vector_times, 50),
+            "vector_query_p99_ms": percentile_ms(vector_times, 99),
+            "lexical_query_p50_ms": percentile_ms(lexical_times, 50),
+            "lexical_query_p99_ms": percentile_ms(lexical_times, 99),
+            "vector_recall_at_k": hit_rate(vector_docs, queries),
+            "lexical_recall_at_k": hit_rate(lexical_docs, queries),
+            "hybrid_recall_at_k": hit_rate(hybrid_docs, queries),
+        })
+
+        backend.set_active_index(index_name)
+        backend.retrieval_engine.swap(index_name)
+        chat_times = []
+        with backend.app.test_client() as client:
+            for query, _ in queries:
+                start = time.perf_counter()
+                client.post('/chat', json={'user_id': None, 'message': query})
+                chat_times.append(time.perf_counter() - start)
+        backend.retrieval_engine.evict()
+        results["chat_p50_ms"] = percentile_ms(chat_times, 50)
+        results["chat_p99_ms"] = percentile_ms(chat_times, 99)
+        return results
+    finally:
+        rag._embeddings, rag.embedding_cache, backend.get_llm = saved
+        os.chdir(cwd)
+
+
+def compare(current, baseline, tolerance=0.2, recall_tolerance=0.01):
+    """
+    Lists the metrics of current that are worse than baseline by more than
+    tolerance (relative) or, for recall, recall_tolerance (absolute).
+    """
+    regressions = []
+    for metric, old in baseline.items():
+        new = current.get(metric)
+        if metric in INFO_METRICS or not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        if metric in RECALL_METRICS:
+            worse = old - new > recall_tolerance
+        elif metric in LOWER_IS_BETTER:
+            worse = new > old * (1 + tolerance)
+        else:
+            worse = new < old * (1 - tolerance)
+        if worse:
+            change = round((new - old) / old, 4) if old else None
+            regressions.append({"metric": metric, "baseline": old, "current": new, "change": change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200, help="synthetic corpus size")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="JSON list of {'url', 'content'} pages to use instead of the synthetic corpus")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--model", choices=["hashing", "minilm"], default="hashing",
+                        help="minilm needs the model in the local Hugging Face cache")
+    parser.add_argument("--index-spec", default="flat")
+    parser.add_argument("--storage", default="mmap")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown / size growth")
+    parser.add_argument("--recall-tolerance", type=float, default=0.01, help="allowed absolute recall drop")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = json.load(f)
+    else:
+        corpus = generate_corpus(args.pages, args.seed)
+    queries = generate_queries(corpus, args.queries, args.seed + 1)
+
+    workdir = tempfile.mkdtemp(prefix="occams_bench_")
+    try:
+        metrics = run_benchmark(corpus, queries, k=args.k, model=args.model, index_spec=args.index_spec,
+                                storage=args.storage, workers=args.workers,
+                                llm_latency_ms=args.llm_latency_ms, workdir=workdir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "pages": len(corpus),
+            "queries": len(queries),
+            **{key: getattr(args, key) for key in ("seed", "k", "model", "index_spec", "storage", "workers", "llm_latency_ms")},
+            "corpus": args.corpus or "synthetic",
+        },
+        "metrics": metrics,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for metric, value in metrics.items():
+        print(f"{metric:>24}: {value}")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(metrics, baseline["metrics"], args.tolerance, args.recall_tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.1%})"
+                  if r['change'] is not None else f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import re
+import zlib
+from collections import defaultdict
+import numpy as np
+
+# Mersenne prime for the MinHash permutations; (a * x + b) stays below 2**64
+_PRIME = (1 << 31) - 1
+
+
+class BoilerplateFilter:
+    """
+    Learns site chrome (menus, footers, cookie banners) during a crawl: a line
+    becomes boilerplate once it has been seen on min_pages different pages,
+    and is stripped from every page cleaned after that.
+    """
+
+    def __init__(self, min_pages=5):
+        self.min_pages = min_pages
+        self.page_counts = defaultdict(int)  # line -> pages it appeared on
+
+    def clean(self, content):
+        """Counts the lines of one page and returns it without the boilerplate ones."""
+        lines = [line.strip() for line in (content or "").split("\n")]
+        for line in set(filter(None, lines)):
+            self.page_counts[line] += 1
+        return "\n".join(line for line in lines if line and not self.is_boilerplate(line))
+
+    def is_boilerplate(self, line):
+        return self.page_counts.get(line.strip(), 0) >= self.min_pages
+
+    def lines(self):
+        return [line for line, pages in self.page_counts.items() if pages >= self.min_pages]
+
+
+def shingles(text, size=3):
+    """Hashed word size-grams of text (the whole text if it is shorter)."""
+    words = re.findall(r"\w+", (text or "").lower())
+    grams = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.array([zlib.crc32(gram.encode()) for gram in grams], dtype=np.uint64)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures of the chunks kept so far, bucketed by LSH bands.
+    add() returns False for a chunk whose estimated Jaccard similarity to a
+    kept chunk is at least threshold, so it can be dropped before embedding.
+    """
+
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, shingle_size=3, seed=0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+        self._signatures = []
+        self._buckets = defaultdict(list)  # (band, hashed rows) -> signature positions
+
+    def signature(self, text):
+        hashes = shingles(text, self.shingle_size)
+        return ((np.outer(hashes, self._a) + self._b) % _PRIME).min(axis=0)
+
+    def add(self, text):
+        signature = self.signature(text)
+        keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        candidates = {position for key in keys for position in self._buckets.get(key, ())}
+        for position in candidates:
+            if np.mean(self._signatures[position] == signature) >= self.threshold:
+                return False
+        for key in keys:
+            self._buckets[key].append(len(self._signatures))
+        self._signatures.append(signature)
+        return True
@@ -0,0 +1,136 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed store of chunk vectors keyed by sha256(model name + text),
+    shared by every index build. Once the stored vectors exceed max_bytes the
+    least recently used ones are deleted.
+    """
+
+    def __init__(self, path, model_name, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = None  # running total of stored vector bytes, read from the table on first write
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_cache
+                (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB,
+                    last_used REAL
+                )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS embedding_cache_last_used ON embedding_cache (last_used)")
+        return conn
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode()).hexdigest()
+
+    def get_many(self, texts):
+        """Returns a vector (list of floats) or None for each text."""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                c.execute(f"SELECT key, vector FROM embedding_cache WHERE key IN ({','.join('?' * len(batch))})", batch)
+                for key, blob in c.fetchall():
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            c.executemany("UPDATE embedding_cache SET last_used=? WHERE key=?", [(time.time(), key) for key in found])
+            conn.commit()
+            conn.close()
+            self.hits += len([key for key in keys if key in found])
+            self.misses += len([key for key in keys if key not in found])
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts, vectors):
+        now = time.time()
+        rows = [(self.key(text), np.asarray(vector, dtype=np.float32).tobytes(), now) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            conn = self._connect()
+            c = conn.cursor()
+            if self._bytes is None:
+                self._bytes = c.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache").fetchone()[0]
+            replaced = 0
+            for start in range(0, len(rows), 500):
+                batch = [row[0] for row in rows[start:start + 500]]
+                replaced += c.execute(f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache WHERE key IN ({','.join('?' * len(batch))})",
+                                      batch).fetchone()[0]
+            c.executemany("REPLACE INTO embedding_cache (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            conn.commit()
+            self._bytes += sum(len(row[1]) for row in rows) - replaced
+            # the full scan only runs once the cache is over its limit
+            if self._bytes > self.max_bytes:
+                self._evict(conn)
+            conn.close()
+
+    def _evict(self, conn):
+        c = conn.cursor()
+        # recounted here, since another process may share the file
+        total = c.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache").fetchone()[0]
+        self._bytes = total
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        doomed = []
+        for key, size in c.execute("SELECT key, LENGTH(vector) FROM embedding_cache ORDER BY last_used ASC"):
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+        c.executemany("DELETE FROM embedding_cache WHERE key=?", doomed)
+        conn.commit()
+        self._bytes = self.max_bytes + excess  # excess is now <= 0
+        self.evictions += len(doomed)
+
+    def stats(self):
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache").fetchone()
+            conn.close()
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model so embed_documents only computes uncached texts."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(texts)
+        # repeated texts (footers, menus) are computed once
+        missing = list(dict.fromkeys(texts[i] for i, vector in enumerate(vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            vectors = [list(computed[text]) if vector is None else vector for text, vector in zip(texts, vectors)]
+            self.cache.put_many(missing, [computed[text] for text in missing])
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
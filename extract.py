@@ -0,0 +1,225 @@
+import re
+import urllib.parse
+from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
+
+# Turns a fetched or rendered page into what gets stored and indexed:
+#   {'title': str, 'content': str, 'links': [absolute urls]}
+# Crawlers pick an extractor by name (EXTRACTORS) and get links from the same parse.
+
+# never visible content
+DROP_TAGS = ["script", "style", "noscript", "template", "svg", "canvas", "iframe", "object", "embed",
+             "form", "button", "select", "input", "textarea", "nav", "aside", "dialog"]
+# dropped unless they sit inside the page's article or main content
+CHROME_TAGS = ["header", "footer"]
+# class / id tokens that mark site chrome rather than content: the whole token or its first -/_ part,
+# so "menu" and "cookie-banner" match but page-builder wrappers like "elementor-widget-container" don't
+CHROME_HINT = re.compile(
+    r"^(nav|navbar|navigation|menu|megamenu|footer|sidebar|widget|cookie|consent|gdpr|banner|breadcrumbs?"
+    r"|social|share|sharing|popup|modal|newsletter|subscribe|skip-link|screen-reader-text|related)([_-]|$)", re.I)
+# blocks whose text is mostly link text (menus, tag clouds, "related posts") are dropped
+MAX_LINK_DENSITY = 0.6
+LINK_DENSITY_TAGS = ["div", "section", "ul", "ol", "table", "p", "span"]
+
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+BLOCK_TAGS = HEADING_TAGS | {
+    "p", "div", "section", "article", "main", "header", "footer", "ul", "ol", "li", "dl", "dt", "dd",
+    "table", "thead", "tbody", "tr", "blockquote", "pre", "figure", "figcaption", "address", "br", "hr",
+}
+# a "# Heading" line in extracted content
+HEADING_LINE = re.compile(r"^(#{1,6}) (.+)$", re.M)
+
+
+def _collapse(text):
+    return " ".join((text or "").split())
+
+
+def page_links(hrefs, url):
+    """hrefs resolved against url, minus anchors, emails, phone numbers and scripts."""
+    links = {}
+    for href in hrefs:
+        href = (href or "").strip()
+        if not href or href.startswith(("#", "mailto:", "tel:", "javascript:")):
+            continue
+        links[urllib.parse.urljoin(url, href)] = True
+    return list(links)
+
+
+class TextExtractor:
+    """The whole page's visible text, one line per text node (BeautifulSoup's get_text)."""
+
+    def extract(self, html, url):
+        soup = BeautifulSoup(html, 'html.parser')
+        return {
+            "title": _collapse(soup.title.get_text()) if soup.title else "",
+            "content": soup.get_text(separator="\n", strip=True),
+            "links": page_links([a['href'] for a in soup.find_all('a', href=True)], url),
+        }
+
+
+class MainContentExtractor:
+    """
+    Main content only, parsed with lxml: scripts, forms, navigation, page
+    header/footer and blocks marked as chrome by class/id or made mostly of
+    links are dropped, and what is left is written out as lines with
+    "# heading" and "- list item" markup. Links are taken from the same
+    parse, before anything is dropped.
+    """
+
+    def __init__(self, max_link_density=MAX_LINK_DENSITY):
+        self.max_link_density = max_link_density
+
+    def extract(self, html, url):
+        try:
+            tree = self._parse(html)
+        except (etree.ParserError, ValueError) as e:
+            print(f"Can't parse {url}, storing it without content: {e}")
+            return {"title": "", "content": "", "links": []}
+        links = page_links(tree.xpath("//a/@href"), url)
+        title = _collapse(" ".join(tree.xpath("//title//text()")))
+        for element in tree.xpath("//comment() | //processing-instruction()"):
+            self._drop(element)
+        for element in tree.xpath("|".join(f"//{tag}" for tag in DROP_TAGS)):
+            self._drop(element)
+        root = self._main(tree)
+        for element in root.xpath("|".join(f".//{tag}" for tag in CHROME_TAGS)):
+            if not element.xpath("ancestor::article | ancestor::main | ancestor::*[@role='main']"):
+                self._drop(element)
+        # a class like "has-sidebar" on a wrapper must not take the whole page with it
+        most = 0.5 * len(_collapse(root.text_content()))
+        for element in root.xpath(".//*[@class or @id]"):
+            if (self._is_chrome(element) and not element.xpath(".//h1")
+                    and len(_collapse(element.text_content())) < most):
+                self._drop(element)
+        for element in reversed(root.xpath("|".join(f".//{tag}" for tag in LINK_DENSITY_TAGS))):
+            if self._link_density(element) > self.max_link_density:
+                self._drop(element)
+        lines, line = [], []
+        root.tail = None # text after <main> is outside the content
+        self._write(root, lines, line)
+        self._flush(lines, line) # inline text directly in <body>, or after the last block
+        return {"title": title, "content": "\n".join(lines), "links": links}
+
+    @staticmethod
+    def _parse(html):
+        """
+        The lxml tree of html (str or bytes). lxml refuses a str that starts
+        with an <?xml encoding="..."?> declaration (XHTML pages); the text is
+        decoded already, so it is parsed as UTF-8 bytes, ignoring the declaration.
+        """
+        try:
+            return lxml_html.fromstring(html)
+        except ValueError:
+            if not isinstance(html, str):
+                raise
+            return lxml_html.fromstring(html.encode("utf-8"), parser=lxml_html.HTMLParser(encoding="utf-8"))
+
+    @staticmethod
+    def _is_chrome(element):
+        tokens = f"{element.get('class', '')} {element.get('id', '')}".split()
+        return any(CHROME_HINT.match(token) for token in tokens)
+
+    @staticmethod
+    def _drop(element):
+        """Removes element but keeps its tail text, which belongs to the parent."""
+        parent = element.getparent()
+        if parent is None:
+            return
+        tail = element.tail
+        previous = element.getprevious()
+        parent.remove(element)
+        if tail and tail.strip():
+            if previous is not None:
+                previous.tail = (previous.tail or "") + tail
+            else:
+                parent.text = (parent.text or "") + tail
+
+    @staticmethod
+    def _main(tree):
+        """The <main>/role=main element or the longest <article>, else <body>."""
+        candidates = tree.xpath("//main | //*[@role='main']") or tree.xpath("//article")
+        if candidates:
+            return max(candidates, key=lambda element: len(element.text_content()))
+        body = tree.find("body")
+        return body if body is not None else tree
+
+    @staticmethod
+    def _link_density(element):
+        text = len(_collapse(element.text_content()))
+        if not text:
+            return 0.0
+        return sum(len(_collapse(a.text_content())) for a in element.iter("a")) / text
+
+    def _write(self, element, lines, line):
+        """Appends element's text to lines: blocks start new lines, inline text joins the current one."""
+        tag = element.tag if isinstance(element.tag, str) else ""
+        if tag in HEADING_TAGS:
+            self._flush(lines, line)
+            text = _collapse(element.text_content())
+            if text:
+                lines.append(f"{'#' * int(tag[1])} {text}")
+        elif tag in ("td", "th"):
+            if _collapse("".join(line)):
+                line.append(" | ")
+            line.append(element.text or "")
+            for child in element:
+                self._write(child, lines, line)
+        elif tag in BLOCK_TAGS:
+            self._flush(lines, line)
+            if tag == "li":
+                line.append("- ")
+            line.append(element.text or "")
+            for child in element:
+                self._write(child, lines, line)
+            self._flush(lines, line)
+        else:
+            line.append(element.text or "")
+            for child in element:
+                self._write(child, lines, line)
+        line.append(element.tail or "")
+
+    @staticmethod
+    def _flush(lines, line):
+        text = _collapse("".join(line))
+        if text and text != "-":
+            lines.append(text)
+        line.clear()
+
+
+# name -> extractor class; SCRAPER_EXTRACTOR picks one for the app's crawls
+EXTRACTORS = {
+    "main": MainContentExtractor,
+    "text": TextExtractor,
+}
+
+
+def get_extractor(extractor="main"):
+    """An extractor instance from a name in EXTRACTORS (instances are passed through)."""
+    if not isinstance(extractor, str):
+        return extractor
+    if extractor not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor '{extractor}'. Choose from: {', '.join(EXTRACTORS)}")
+    return EXTRACTORS[extractor]()
+
+
+def chunk_sections(content, chunks):
+    """
+    The heading each chunk of content falls under ("" before the first
+    heading), for chunks in the order split_page returned them.
+    """
+    headings = [(match.start(), match.group(2).strip()) for match in HEADING_LINE.finditer(content or "")]
+    sections, cursor = [], 0
+    for chunk in chunks:
+        start = content.find(chunk, cursor)
+        if start < 0:
+            start = cursor
+        else:
+            cursor = start + 1 # chunks overlap, so the next one may start inside this one
+        section = ""
+        for position, heading in headings:
+            if position > start:
+                break
+            section = heading
+        sections.append(section)
+    return sections
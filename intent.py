@@ -0,0 +1,94 @@
+import re
+import threading
+import numpy as np
+
+# keyword rules, checked first
+INTENT_PATTERNS = {
+    "onboarding": [
+        r"\bsign\s*-?\s*up\b", r"\bregister\b", r"\bjoin\b", r"\bonboard", r"\benrol",
+        r"\bget started\b", r"\b(i am|i'm|am) interested\b",
+    ],
+    "goodbye": [
+        r"\bbye\b", r"\bgoodbye\b", r"\bthanks\b", r"\bthank you\b", r"\bsee you\b", r"\bthat'?s all\b",
+    ],
+}
+
+# a rule match in a longer message may be incidental ("thanks, and what are your fees?")
+MAX_RULE_WORDS = {"onboarding": 8, "goodbye": 4}
+
+NEGATION_PATTERN = r"\b(not|no|never|don'?t|do not|won'?t)\b"
+
+# nearest-neighbour examples, for messages the rules don't catch
+INTENT_EXAMPLES = {
+    "onboarding": [
+        "i want to sign up",
+        "how can i become a client",
+        "i would like to work with you",
+        "please create an account for me",
+        "i'm interested in your services, what's next",
+        "can someone contact me",
+    ],
+    "goodbye": [
+        "bye",
+        "thanks for the help",
+        "that's all i needed",
+        "have a nice day",
+        "talk to you later",
+    ],
+}
+
+
+class IntentRouter:
+    """
+    Decides whether a guest message is a request to onboard or a goodbye
+    without calling the LLM. classify() returns "onboarding", "goodbye",
+    "ambiguous" (let the agent decide) or "other" (plain question).
+    """
+
+    def __init__(self, embed_documents, threshold=0.8, ambiguous_margin=0.1):
+        self._embed_documents = embed_documents
+        self.threshold = threshold
+        self.ambiguous_margin = ambiguous_margin
+        self._examples = None  # intent -> normalized example vectors
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _example_vectors(self):
+        with self._lock:
+            if self._examples is None:
+                self._examples = {
+                    intent: self._normalize(self._embed_documents(examples))
+                    for intent, examples in INTENT_EXAMPLES.items()
+                }
+            return self._examples
+
+    def classify(self, message, query_vector=None):
+        text = (message or "").lower().strip()
+        words = re.findall(r"[\w']+", text)
+
+        for intent, patterns in INTENT_PATTERNS.items():
+            if any(re.search(pattern, text) for pattern in patterns):
+                if re.search(NEGATION_PATTERN, text) or len(words) > MAX_RULE_WORDS[intent]:
+                    return "ambiguous"
+                return intent
+
+        if query_vector is None:
+            return "other"
+
+        query = self._normalize(query_vector)
+        best_intent, best_score = None, -1.0
+        for intent, vectors in self._example_vectors().items():
+            score = float(np.max(vectors @ query))
+            if score > best_score:
+                best_intent, best_score = intent, score
+
+        if best_score >= self.threshold:
+            return best_intent
+        if best_score >= self.threshold - self.ambiguous_margin:
+            return "ambiguous"
+        return "other"
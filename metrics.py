@@ -0,0 +1,172 @@
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, math.inf)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# print one JSON line per request with its stage timings
+REQUEST_LOG = os.getenv("REQUEST_LOG", "") == "1"
+
+_lock = threading.Lock()
+_histograms = {}  # stage -> Histogram
+_counters = {}  # event -> count
+_gauge_sources = []  # callables returning {name: value}
+
+# stage timings of the request being served, if any
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class Histogram:
+    """Cumulative bucket counts plus a window of recent samples for quantiles."""
+
+    def __init__(self, window=2048):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def quantile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def observe(stage, seconds):
+    with _lock:
+        _histograms.setdefault(stage, Histogram()).observe(seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans[stage] = spans.get(stage, 0.0) + seconds
+
+
+def inc(event, amount=1):
+    with _lock:
+        _counters[event] = _counters.get(event, 0) + amount
+
+
+def register_gauges(source):
+    """Adds a callable whose {name: value} result is exported on every scrape."""
+    _gauge_sources.append(source)
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block as stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorator form of span()."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def request_scope(name, **fields):
+    """
+    Collects the spans recorded while serving one request. The whole request
+    is timed as name; with REQUEST_LOG=1 a JSON line with every stage is
+    printed at the end. Extra fields can be added to the yielded dict.
+    """
+    spans = {}
+    token = _request_spans.set(spans)
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        total = time.perf_counter() - start
+        _request_spans.reset(token)
+        observe(name, total)
+        if REQUEST_LOG:
+            print(json.dumps({
+                "request": name,
+                "total_ms": round(total * 1000, 2),
+                "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in spans.items()},
+                **fields,
+            }))
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_prometheus():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        histograms = dict(_histograms)
+        counters = dict(_counters)
+
+        lines.append("# HELP occams_stage_seconds Time spent in each stage.")
+        lines.append("# TYPE occams_stage_seconds histogram")
+        for stage, hist in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.bucket_counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'occams_stage_seconds_bucket{{stage="{_label(stage)}",le="{le}"}} {cumulative}')
+            lines.append(f'occams_stage_seconds_sum{{stage="{_label(stage)}"}} {hist.sum}')
+            lines.append(f'occams_stage_seconds_count{{stage="{_label(stage)}"}} {hist.count}')
+
+        lines.append("# HELP occams_stage_latency_seconds Recent per-stage latency quantiles.")
+        lines.append("# TYPE occams_stage_latency_seconds summary")
+        for stage, hist in sorted(histograms.items()):
+            for q in QUANTILES:
+                lines.append(f'occams_stage_latency_seconds{{stage="{_label(stage)}",quantile="{q}"}} {hist.quantile(q)}')
+            lines.append(f'occams_stage_latency_seconds_sum{{stage="{_label(stage)}"}} {hist.sum}')
+            lines.append(f'occams_stage_latency_seconds_count{{stage="{_label(stage)}"}} {hist.count}')
+
+    lines.append("# HELP occams_events_total Counted events (fallbacks, cache hits, LLM errors, ...).")
+    lines.append("# TYPE occams_events_total counter")
+    for event, count in sorted(counters.items()):
+        lines.append(f'occams_events_total{{event="{_label(event)}"}} {count}')
+
+    for source in _gauge_sources:
+        try:
+            gauges = source()
+        except Exception as e:
+            print(f"Error collecting gauges: {e}")
+            continue
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE occams_{name} gauge")
+            lines.append(f"occams_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Stage quantiles and counters as a dict, for tests and JSON views."""
+    with _lock:
+        return {
+            "stages": {
+                stage: {"count": h.count, **{f"p{int(q * 100)}": h.quantile(q) for q in QUANTILES}}
+                for stage, h in _histograms.items()
+            },
+            "events": dict(_counters),
+        }
@@ -1,42 +1,994 @@
 import os
 import sqlite3
+import hashlib
+import json
+import math
+import operator
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import threading
+import queue
+import time
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from collections.abc import Mapping
+import metrics
+from dedup import BoilerplateFilter, NearDuplicateIndex
+from extract import chunk_sections
+from embedding_cache import EmbeddingCache, CachedEmbeddings
 
-def build_faiss_index(index_name, data_list):
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+# chunk vectors shared across index builds, keyed by model + chunk text
+embedding_cache = EmbeddingCache(
+    os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db"),
+    EMBEDDING_MODEL_NAME,
+    max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024,
+)
+
+
+def get_embeddings():
+    """
+    Returns the process-wide embedding model, loading it on first use
+    so every index build and chat request shares one copy.
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                _embeddings = load_embedding_model()
+    return _embeddings
+
+
+def load_embedding_model(model_name=EMBEDDING_MODEL_NAME):
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+# model held by each ParallelEmbeddings worker process
+_worker_embeddings = None
+
+
+def _init_embedding_worker(factory, model_name, threads):
+    global _worker_embeddings
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_embeddings = factory(model_name)
+
+
+def _embed_batch(texts):
+    return _worker_embeddings.embed_documents(texts)
+
+
+class ParallelEmbeddings(Embeddings):
+    """
+    Embeds documents on a pool of worker processes, each holding its own copy
+    of the model. Texts are cut into batches of batch_size, spread over the
+    workers, and the vectors come back in the original order. The pool is
+    started on the first call and kept, so the model is loaded once per
+    worker; close() shuts it down.
+    """
+
+    def __init__(self, workers, batch_size=64, model_name=EMBEDDING_MODEL_NAME, factory=load_embedding_model):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.model_name = model_name
+        self.factory = factory
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            # spawn, not fork: the app process has threads (batcher, writers) running
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_embedding_worker,
+                initargs=(self.factory, self.model_name, threads),
+            )
+        return self._pool
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        return [vector for batch in self._get_pool().map(_embed_batch, batches) for vector in batch]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def embed_query(self, text):
+        return get_embeddings().embed_query(text)
+
+
+_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+
+
+def split_page(content):
+    """Splits one page's content into the chunks that get indexed."""
+    return _splitter.split_text(content)
+
+
+def reciprocal_rank_fusion(result_lists, k=60):
+    """
+    Merges ranked lists of documents into one ranking. Each document scores
+    sum(1 / (k + rank)) over the lists it appears in; documents with the same
+    page_url and chunk_index (or, without those, the same page_content) are
+    treated as one.
+    """
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            metadata = doc.metadata or {}
+            if metadata.get('page_url') is not None and metadata.get('chunk_index') is not None:
+                key = (metadata['page_url'], metadata['chunk_index'])
+            else:
+                key = doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class EmbeddingBatcher:
+    """
+    Groups queries embedded by concurrent requests into one forward pass.
+    The first waiting query opens a batch; it is encoded once max_batch_size
+    queries have joined or max_wait seconds have passed, whichever is first.
+    """
+
+    def __init__(self, embed_documents, max_batch_size=16, max_wait=0.005):
+        self._embed_documents = embed_documents
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.batch_sizes = {}  # batch size -> number of batches
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def embed(self, text):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+        item = {'text': text, 'queued': time.time(), 'done': threading.Event(), 'vector': None, 'error': None}
+        self._queue.put(item)
+        item['done'].wait()
+        if item['error'] is not None:
+            raise item['error']
+        return item['vector']
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            started = time.time()
+            with self._stats_lock:
+                self.batches += 1
+                self.queries += len(batch)
+                self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+                for item in batch:
+                    wait = started - item['queued']
+                    self.total_wait += wait
+                    self.max_wait_seen = max(self.max_wait_seen, wait)
+
+            try:
+                vectors = self._embed_documents([item['text'] for item in batch])
+                for item, vector in zip(batch, vectors):
+                    item['vector'] = vector
+            except Exception as e:
+                for item in batch:
+                    item['error'] = e
+            for item in batch:
+                item['done'].set()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "mean_queue_wait_ms": round(1000 * self.total_wait / self.queries, 3) if self.queries else 0.0,
+                "max_queue_wait_ms": round(1000 * self.max_wait_seen, 3),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": 1000 * self.max_wait,
+            }
+
+
+class RetrievalEngine:
+    """
+    Keeps the vectorstore of the active index loaded between chat requests.
+    The store is keyed by index name, so a changed active index (from this
+    or another worker) is picked up on the next lookup. Swapping only replaces
+    the reference: requests already holding the old store finish with it, and
+    the previous store stays reachable until the next swap so requests that
+    read the old active index name just before a switch don't reload it.
+    """
+
+    def __init__(self, max_batch_size=16, max_wait=0.005):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._index_name = None
+        self._vectorstore = None
+        self._retired = (None, None)  # (index_name, vectorstore) served before the last swap
+        self._loading = set()
+        self.batcher = EmbeddingBatcher(
+            lambda texts: get_embeddings().embed_documents(texts), max_batch_size, max_wait
+        )
+
+    @metrics.timed("rag.load_index")
+    def load(self, index_name):
+        """Loads index_name without serving it."""
+        return load_index(index_name, get_embeddings())
+
+    def _cached(self, index_name):
+        for name, vectorstore in ((self._index_name, self._vectorstore), self._retired):
+            if vectorstore is not None and name == index_name:
+                return vectorstore
+        return None
+
+    def _set(self, index_name, vectorstore):
+        if self._index_name != index_name:
+            self._retired = (self._index_name, self._vectorstore)
+        self._index_name = index_name
+        self._vectorstore = vectorstore
+
+    def get_vectorstore(self, index_name):
+        """Returns the loaded vectorstore for index_name, loading it if needed."""
+        with self._lock:
+            vectorstore = self._cached(index_name)
+            if vectorstore is not None:
+                return vectorstore
+        with self._load_lock:
+            # another request may have loaded it while we waited
+            with self._lock:
+                vectorstore = self._cached(index_name)
+                if vectorstore is not None:
+                    return vectorstore
+            vectorstore = self.load(index_name)
+            with self._lock:
+                self._set(index_name, vectorstore)
+            return vectorstore
+
+    def peek(self, index_name):
+        """Returns the vectorstore for index_name only if it is already loaded."""
+        with self._lock:
+            return self._cached(index_name)
+
+    def load_in_background(self, index_name):
+        """Starts loading index_name on a background thread (once at a time)."""
+        with self._lock:
+            if index_name in self._loading:
+                return
+            self._loading.add(index_name)
+
+        def load():
+            try:
+                self.get_vectorstore(index_name)
+            except Exception as e:
+                print(f"Background load of FAISS index {index_name} failed: {e}")
+            finally:
+                with self._lock:
+                    self._loading.discard(index_name)
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def embed_documents(self, texts):
+        return get_embeddings().embed_documents(texts)
+
+    def embed_query(self, text):
+        """Embeds a chat query with the shared model, batched with concurrent queries."""
+        return self.batcher.embed(text)
+
+    def install(self, index_name, vectorstore):
+        """Serves an already loaded (and warmed) vectorstore as index_name."""
+        with self._lock:
+            self._set(index_name, vectorstore)
+        print(f"Retrieval engine now serving index: {index_name}")
+
+    def swap(self, index_name):
+        """Loads index_name and makes it the served index in one step."""
+        with self._load_lock:
+            vectorstore = self.load(index_name)
+            self.install(index_name, vectorstore)
+
+    def evict(self, index_name=None):
+        """Drops the loaded index (only if it is index_name, when given)."""
+        with self._lock:
+            if index_name is None or self._retired[0] == index_name:
+                self._retired = (None, None)
+            if index_name is None or self._index_name == index_name:
+                self._index_name = None
+                self._vectorstore = None
+
+    @property
+    def index_name(self):
+        return self._index_name
+
+
+def validate_vectorstore(vectorstore, dim=None):
+    """
+    Checks that a loaded store can serve searches: it has vectors, every
+    vector maps to a stored chunk, the first chunk can be read back, and the
+    vector size matches the embedding model (when dim is given).
+    Raises ValueError describing the first problem found.
+    """
+    index = vectorstore.index
+    if index.ntotal == 0:
+        raise ValueError("index has no vectors")
+    if len(vectorstore.index_to_docstore_id) != index.ntotal:
+        raise ValueError(f"index has {index.ntotal} vectors but {len(vectorstore.index_to_docstore_id)} chunk ids")
+    if dim is not None and index.d != dim:
+        raise ValueError(f"index vectors have {index.d} dimensions, the embedding model produces {dim}")
+    first = vectorstore.docstore.search(vectorstore.index_to_docstore_id[0])
+    if not isinstance(first, Document):
+        raise ValueError(f"chunk store is missing chunks: {first}")
+
+
+# index types build_faiss_index can create, with their default parameters
+INDEX_TYPES = {
+    "flat": {},
+    "ivf_flat": {"nlist": 64, "nprobe": 8},
+    "hnsw": {"m": 32, "ef_construction": 64, "ef_search": 64},
+    "ivf_pq": {"nlist": 64, "m": 8, "nbits": 8, "nprobe": 8},
+    # scalar-quantized vectors; the best rerank * k are re-scored exactly
+    "sq_fp16": {"rerank": 4},
+    "sq8": {"rerank": 4},
+}
+
+# index types whose stored vectors can be reconstructed exactly
+EXACT_INDEX_TYPES = {"flat", "ivf_flat", "hnsw"}
+
+SCALAR_QUANTIZERS = {"sq_fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+# full-precision copy of the vectors, kept next to scalar-quantized indexes
+FULL_VECTORS_FILE = "vectors.npy"
+
+
+def parse_index_spec(spec):
+    """
+    Parses an index spec such as "flat", "hnsw:m=16" or
+    "ivf_pq:nlist=128,m=16,nprobe=16" into (kind, params).
+    """
+    kind, _, args = (spec or "flat").partition(":")
+    kind = kind.strip().lower()
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{kind}', expected one of {sorted(INDEX_TYPES)}")
+    params = dict(INDEX_TYPES[kind])
+    for arg in filter(None, (a.strip() for a in args.split(","))):
+        key, _, value = arg.partition("=")
+        if key not in params:
+            raise ValueError(f"Unknown parameter '{key}' for index type '{kind}'")
+        params[key] = int(value)
+    return kind, params
+
+
+def apply_search_params(index, kind, params):
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    elif kind == "hnsw":
+        index.hnsw.efSearch = params["ef_search"]
+
+
+def create_faiss_index(kind, params, vectors):
+    """
+    Creates, trains and fills a FAISS index of the given kind (L2 distance,
+    like the default LangChain index). Parameters too large for the number
+    of vectors are scaled down; the ones actually used are returned.
+    """
+    n, dim = vectors.shape
+    params = dict(params)
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif kind in SCALAR_QUANTIZERS:
+        index = faiss.IndexScalarQuantizer(dim, SCALAR_QUANTIZERS[kind], faiss.METRIC_L2)
+        index.train(vectors)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    else:
+        # k-means needs a few dozen training points per list
+        params["nlist"] = max(1, min(params["nlist"], n // 39 or 1))
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, params["nlist"])
+        else:
+            if dim % params["m"]:
+                raise ValueError(f"ivf_pq m={params['m']} must divide the vector size {dim}")
+            params["nbits"] = max(1, min(params["nbits"], int(math.log2(max(n, 2)))))
+            index = faiss.IndexIVFPQ(quantizer, dim, params["nlist"], params["m"], params["nbits"])
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, kind, params)
+    return index, params
+
+
+class RerankedIndex:
+    """
+    Wraps a scalar-quantized index: search() shortlists rerank * k candidates
+    on the compressed vectors, then orders them by exact L2 distance against
+    the full-precision vectors (normally a read-only memmap, so only the
+    shortlisted rows are read). Anything else is passed to the wrapped index.
+    """
+
+    def __init__(self, index, vectors, rerank):
+        self.index = index
+        self.vectors = vectors
+        self.rerank = rerank
+
+    def search(self, queries, k):
+        queries = np.asarray(queries, dtype=np.float32)
+        _, candidates = self.index.search(queries, min(self.index.ntotal, k * self.rerank))
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, found) in enumerate(zip(queries, candidates)):
+            found = np.sort(found[found >= 0])  # sorted rows read the memmap sequentially
+            exact = ((np.asarray(self.vectors[found]) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:k]
+            distances[row, :len(order)] = exact[order]
+            ids[row, :len(order)] = found[order]
+        return distances, ids
+
+    def reconstruct(self, position):
+        return np.array(self.vectors[position], dtype=np.float32)
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+
+def measure_recall(index, vectors, k=10, sample=100, seed=0):
+    """
+    recall@k of index against exact search, using a sample of the indexed
+    vectors with a little noise added as held-out queries.
+    """
+    n = len(vectors)
+    if n == 0:
+        return None
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(n, size=min(sample, n), replace=False)
+    queries = vectors[picks] + rng.normal(0, 0.05 * float(vectors.std()), size=(len(picks), vectors.shape[1])).astype(np.float32)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / (len(picks) * k)
+
+
+def read_index_spec(index_name):
+    """The index_spec.json saved with an index, or the flat default for older indexes."""
+    try:
+        with open(os.path.join(index_name, "index_spec.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"kind": "flat", "params": {}}
+
+
+# storage formats: "pickle" is LangChain's save_local (docstore unpickled into
+# RAM on load); "mmap" writes only the FAISS index, memory-mapped read-only on
+# load, and keeps chunk text and metadata in the index_chunks table
+STORAGE_FORMATS = ("mmap", "pickle")
+MMAP_READ_FLAGS = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+
+class PositionIds(Mapping):
+    """Index position -> docstore id for mmap indexes, where the id is the position."""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise KeyError(position)
+        return str(position)
+
+    def __iter__(self):
+        return iter(range(self.size))
+
+    def __len__(self):
+        return self.size
+
+
+class SQLiteDocstore(Docstore):
+    """Read-only docstore that looks chunks up in index_chunks on demand."""
+
+    def __init__(self, index_name):
+        self.index_name = index_name
+
+    def search(self, search):
+        docs = self.search_many([search])
+        return docs[0] if docs[0] is not None else f"ID {search} not found."
+
+    def search_many(self, ids):
+        positions = [int(i) for i in ids]
+        found = {}
+        conn = sqlite3.connect('database.db')
+        c = conn.cursor()
+        for start in range(0, len(positions), 500):
+            batch = positions[start:start + 500]
+            c.execute(f"SELECT position, page_content, metadata FROM index_chunks WHERE index_name=? AND position IN ({','.join('?' * len(batch))})",
+                      (self.index_name, *batch))
+            for position, page_content, metadata in c.fetchall():
+                found[position] = Document(page_content=page_content, metadata=json.loads(metadata))
+        conn.close()
+        return [found.get(position) for position in positions]
+
+
+class ChunkTableFAISS(FAISS):
+    """
+    FAISS over an SQLiteDocstore: the chunks of all hits of a search are read
+    in one search_many query instead of one docstore lookup (and connection)
+    per hit.
+    """
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        scores, indices = self.index.search(vector, k if filter is None else fetch_k)
+        hits = [(j, self.index_to_docstore_id[i]) for j, i in enumerate(indices[0]) if i != -1]
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+        docs = []
+        for (j, _id), doc in zip(hits, self.docstore.search_many([_id for _, _id in hits])):
+            if doc is None:
+                raise ValueError(f"Could not find document for id {_id}")
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, scores[0][j]))
+
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            higher_is_better = self.distance_strategy in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+            cmp = operator.ge if higher_is_better else operator.le
+            docs = [(doc, similarity) for doc, similarity in docs if cmp(similarity, score_threshold)]
+        return docs[:k]
+
+
+def _ensure_chunk_table(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS index_chunks
+            (
+                index_name TEXT,
+                position INTEGER,
+                page_content TEXT,
+                metadata TEXT,
+                PRIMARY KEY (index_name, position)
+            )
+    ''')
+
+
+def create_fts_table(c):
+    """The BM25 index over the chunks of every index, one row per chunk."""
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5
+            (
+                content,
+                index_name UNINDEXED,
+                page_url UNINDEXED,
+                chunk_index UNINDEXED,
+                tokenize='porter unicode61'
+            )
+    ''')
+
+
+def save_lexical_chunks(index_name, texts, metadatas):
+    """
+    Replaces the BM25 rows of index_name with the chunks that were indexed,
+    so lexical search sees the same cleaned chunks as vector search.
+    """
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    create_fts_table(c)
+    c.execute("DELETE FROM knowledge_fts WHERE index_name=?", (index_name,))
+    c.executemany("INSERT INTO knowledge_fts (content, index_name, page_url, chunk_index) VALUES (?, ?, ?, ?)",
+                  [(text, index_name, metadata.get('page_url'), metadata.get('chunk_index'))
+                   for text, metadata in zip(texts, metadatas)])
+    conn.commit()
+    conn.close()
+
+
+def save_index_chunks(index_name, texts, metadatas):
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    _ensure_chunk_table(c)
+    c.execute("DELETE FROM index_chunks WHERE index_name=?", (index_name,))
+    c.executemany("INSERT INTO index_chunks (index_name, position, page_content, metadata) VALUES (?, ?, ?, ?)",
+                  [(index_name, i, text, json.dumps(metadata)) for i, (text, metadata) in enumerate(zip(texts, metadatas))])
+    conn.commit()
+    conn.close()
+
+
+def delete_index_chunks(index_name):
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    _ensure_chunk_table(c)
+    c.execute("DELETE FROM index_chunks WHERE index_name=?", (index_name,))
+    conn.commit()
+    conn.close()
+
+
+def load_index(index_name, embeddings):
+    """Loads a saved index (either storage format) and restores its search parameters."""
+    spec = read_index_spec(index_name)
+    if spec.get("storage") == "mmap":
+        index = faiss.read_index(os.path.join(index_name, "index.faiss"), MMAP_READ_FLAGS)
+        vectorstore = ChunkTableFAISS(embeddings, index, SQLiteDocstore(index_name), PositionIds(index.ntotal))
+    else:
+        vectorstore = FAISS.load_local(index_name, embeddings, allow_dangerous_deserialization=True)
+    apply_search_params(vectorstore.index, spec["kind"], spec["params"])
+    full_vectors = load_full_vectors(index_name)
+    if spec["kind"] in SCALAR_QUANTIZERS and spec["params"].get("rerank") and full_vectors is not None:
+        vectorstore.index = RerankedIndex(vectorstore.index, full_vectors, spec["params"]["rerank"])
+    return vectorstore
+
+
+def load_full_vectors(index_name):
+    """The full-precision vectors saved with a scalar-quantized index, memory-mapped, or None."""
+    path = os.path.join(index_name, FULL_VECTORS_FILE)
+    return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+
+def page_hash(content):
+    return hashlib.sha256((content or "").encode()).hexdigest()
+
+
+def get_page_hashes(index_name):
+    """Content hash of every page stored under index_name in the knowledge table."""
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute("SELECT page_url, content FROM knowledge WHERE index_name=?", (index_name,))
+    hashes = {url: page_hash(content) for url, content in c.fetchall()}
+    conn.close()
+    return hashes
+
+
+def load_reusable_vectors(previous_index, new_hashes=None):
+    """
+    Returns {page_url: [(chunk_text, vector, metadata), ...]} for the pages of
+    previous_index whose content is unchanged in new_hashes, in chunk order.
+    Without new_hashes every page of previous_index is returned.
+    """
+    previous_hashes = get_page_hashes(previous_index)
+    if new_hashes is None:
+        unchanged = set(previous_hashes)
+    else:
+        unchanged = {url for url, h in new_hashes.items() if previous_hashes.get(url) == h}
+    if not unchanged:
+        return {}
+    try:
+        previous = load_index(previous_index, get_embeddings())
+    except Exception as e:
+        print(f"Can't reuse vectors from {previous_index}, embedding every page: {e}")
+        return {}
+
+    # compressed (PQ) vectors are not carried over; their chunks are re-embedded,
+    # which the embedding cache usually answers
+    full_vectors = load_full_vectors(previous_index)
+    exact = full_vectors is not None or read_index_spec(previous_index)["kind"] in EXACT_INDEX_TYPES
+    if exact and isinstance(previous.index, faiss.IndexIVF):
+        previous.index.make_direct_map()
+    reusable = {}
+    ids = list(previous.index_to_docstore_id.items())
+    if isinstance(previous.docstore, SQLiteDocstore):
+        docs = previous.docstore.search_many([doc_id for _, doc_id in ids])
+    else:
+        docs = [previous.docstore.search(doc_id) for _, doc_id in ids]
+    for (position, _), doc in zip(ids, docs):
+        url = doc.metadata.get('page_url')
+        if url in unchanged:
+            if full_vectors is not None:
+                vector = np.array(full_vectors[position])
+            else:
+                vector = previous.index.reconstruct(position) if exact else None
+            reusable.setdefault(url, []).append((doc.page_content, vector, doc.metadata))
+    for chunks in reusable.values():
+        chunks.sort(key=lambda chunk: chunk[2].get('chunk_index', 0))
+    return reusable
+
+
+class IndexBuilder:
+    """
+    Builds a FAISS index one page at a time, so pages can be added while a
+    crawl is still producing them. Chunks are embedded as soon as a batch
+    for every worker has accumulated; finish() embeds the rest, creates the
+    index and saves it. See build_faiss_index for the parameters.
+    """
+
+    def __init__(self, index_name, previous_index=None, workers=1, batch_size=64, index_spec="flat",
+                 storage="mmap", boilerplate_min_pages=5, near_duplicate_threshold=0.9):
+        self.kind, self.params = parse_index_spec(index_spec)
+        if storage not in STORAGE_FORMATS:
+            raise ValueError(f"Unknown storage format '{storage}', expected one of {STORAGE_FORMATS}")
+        self.index_name = index_name
+        self.previous_index = previous_index
+        self.storage = storage
+        self.flush_size = batch_size * max(workers, 1)
+        self.model = ParallelEmbeddings(workers, batch_size) if workers > 1 else get_embeddings()
+        self.embeddings = CachedEmbeddings(self.model, embedding_cache)
+        self.cache_hits_before = embedding_cache.hits
+
+        # unchanged pages keep the vectors they have in previous_index
+        self.previous_hashes = get_page_hashes(previous_index) if previous_index else {}
+        self.reusable = load_reusable_vectors(previous_index) if previous_index else {}
+
+        self.texts, self.vectors, self.metadatas = [], [], []
+        self.to_embed = []  # positions still missing a vector
+        self.urls = set()
+        self.embed_seconds = 0.0
+        self.stats = {'pages_reused': 0, 'pages_embedded': 0, 'chunks_reused': 0, 'chunks_embedded': 0,
+                      'chunks_near_duplicate': 0, 'chunks_boilerplate': 0, 'vectors_removed': 0}
+
+        # repeated site chrome and near-duplicate chunks are dropped before embedding
+        self.boilerplate = BoilerplateFilter(boilerplate_min_pages) if boilerplate_min_pages else None
+        self.near_duplicates = NearDuplicateIndex(near_duplicate_threshold) if near_duplicate_threshold else None
+
+    def add_page(self, item):
+        """
+        Adds one {'url', 'content'} page (plus an optional 'title'), embedding
+        a batch of chunks if one is ready. Chunks carry the page title and
+        the heading they fall under as metadata.
+        """
+        url = item['url']
+        self.urls.add(url)
+        with metrics.span("rag.split"):
+            content = self.boilerplate.clean(item['content']) if self.boilerplate else item['content']
+            if url in self.reusable and self.previous_hashes.get(url) == page_hash(item['content']):
+                self.stats['pages_reused'] += 1
+                for text, vector, metadata in self.reusable.pop(url):
+                    if not self._is_new(text):
+                        continue
+                    if vector is None:
+                        self.to_embed.append(len(self.texts))
+                    else:
+                        self.stats['chunks_reused'] += 1
+                    self.texts.append(text)
+                    self.vectors.append(vector)
+                    self.metadatas.append(metadata)
+            else:
+                self.stats['pages_embedded'] += 1
+                chunks = split_page(content)
+                for i, (chunk, section) in enumerate(zip(chunks, chunk_sections(content, chunks))):
+                    if not self._is_new(chunk):
+                        continue
+                    metadata = {'page_url': url, 'chunk_index': i}
+                    if item.get('title'):
+                        metadata['title'] = item['title']
+                    if section:
+                        metadata['section'] = section
+                    self.to_embed.append(len(self.texts))
+                    self.texts.append(chunk)
+                    self.vectors.append(None)
+                    self.metadatas.append(metadata)
+        if len(self.to_embed) >= self.flush_size:
+            self._embed_pending()
+
+    def _is_new(self, text):
+        if self.near_duplicates is None or self.near_duplicates.add(text):
+            return True
+        self.stats['chunks_near_duplicate'] += 1
+        return False
+
+    def _drop_boilerplate_chunks(self):
+        """
+        Removes boilerplate lines from the chunks of pages scraped before the
+        line had been seen often enough, keeping the first chunk that covers
+        each line. Chunks not embedded yet lose those lines; embedded ones
+        are only dropped when nothing else is left in them.
+        """
+        covered = set()
+        pending = set(self.to_embed)
+        keep = []
+        for position, text in enumerate(self.texts):
+            lines = [line.strip() for line in text.split("\n") if line.strip()]
+            chrome = {line for line in lines if self.boilerplate.is_boilerplate(line)}
+            if position in pending and chrome & covered:
+                lines = [line for line in lines if line not in covered]
+                self.texts[position] = "\n".join(lines)
+            if not lines or set(lines) <= covered:
+                self.stats['chunks_boilerplate'] += 1
+                if position not in pending:
+                    self.stats['vectors_removed'] += 1
+                continue
+            covered |= chrome
+            keep.append(position)
+        if len(keep) == len(self.texts):
+            return
+        self.to_embed = [new for new, old in enumerate(keep) if old in pending]
+        self.texts = [self.texts[i] for i in keep]
+        self.vectors = [self.vectors[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+
+    def _embed_pending(self):
+        if not self.to_embed:
+            return
+        pending, self.to_embed = self.to_embed, []
+        with metrics.span("rag.embed"):
+            start = time.perf_counter()
+            for position, vector in zip(pending, self.embeddings.embed_documents([self.texts[i] for i in pending])):
+                self.vectors[position] = vector
+            self.embed_seconds += time.perf_counter() - start
+        self.stats['chunks_embedded'] += len(pending)
+
+    def close(self):
+        """Stops the embedding worker processes, if any; finish() calls it once everything is embedded."""
+        if hasattr(self.model, "close"):
+            self.model.close()
+
+    def finish(self):
+        """Embeds the remaining chunks, then creates and saves the index. Returns build stats."""
+        index_path = self.index_name
+        if not self.urls:
+            print(f"No data provided for index: {self.index_name}")
+            return
+        if not self.texts:
+            print(f"No text chunks generated for index: {self.index_name}")
+            return
+
+        stats = self.stats
+        if self.boilerplate:
+            self._drop_boilerplate_chunks()
+            stats['boilerplate_lines'] = len(self.boilerplate.lines())
+        stats['chunks_removed'] = stats['chunks_near_duplicate'] + stats['chunks_boilerplate']
+        self._embed_pending()
+        self.close()
+        if stats['chunks_embedded']:
+            stats['chunks_per_sec'] = round(stats['chunks_embedded'] / self.embed_seconds, 1) if self.embed_seconds else None
+        if self.previous_index:
+            stats['pages_removed'] = len(set(self.previous_hashes) - self.urls)
+
+        with metrics.span("rag.create_index"):
+            matrix = np.asarray(self.vectors, dtype=np.float32)
+            index, params = create_faiss_index(self.kind, self.params, matrix)
+        stats['chunks_from_cache'] = embedding_cache.hits - self.cache_hits_before
+        stats['index_type'] = self.kind
+        with metrics.span("rag.recall"):
+            stats['recall_at_10'] = measure_recall(index, matrix) if self.kind != "flat" else 1.0
+            if self.kind in SCALAR_QUANTIZERS and params["rerank"]:
+                stats['recall_at_10_before_rerank'] = stats['recall_at_10']
+                stats['recall_at_10'] = measure_recall(RerankedIndex(index, matrix, params["rerank"]), matrix)
+        # what the searched vectors take in RAM, against plain float32
+        stats['index_bytes'] = int(faiss.serialize_index(index).nbytes)
+        stats['float32_bytes'] = int(matrix.nbytes)
+        with metrics.span("rag.save"):
+            if self.kind in SCALAR_QUANTIZERS:
+                os.makedirs(index_path, exist_ok=True)
+                np.save(os.path.join(index_path, FULL_VECTORS_FILE), matrix)
+            if self.storage == "mmap":
+                os.makedirs(index_path, exist_ok=True)
+                faiss.write_index(index, os.path.join(index_path, "index.faiss"))
+                save_index_chunks(self.index_name, self.texts, self.metadatas)
+            else:
+                docstore = InMemoryDocstore({
+                    str(i): Document(page_content=text, metadata=metadata)
+                    for i, (text, metadata) in enumerate(zip(self.texts, self.metadatas))
+                })
+                FAISS(self.embeddings, index, docstore, {i: str(i) for i in range(len(self.texts))}).save_local(index_path)
+            save_lexical_chunks(self.index_name, self.texts, self.metadatas)
+            with open(os.path.join(index_path, "index_spec.json"), "w") as f:
+                json.dump({"kind": self.kind, "params": params, "storage": self.storage,
+                           "recall_at_10": stats['recall_at_10'],
+                           "recall_at_10_before_rerank": stats.get('recall_at_10_before_rerank'),
+                           "index_bytes": stats['index_bytes'], "float32_bytes": stats['float32_bytes'],
+                           "chunks": len(self.texts)}, f, indent=2)
+        print(f"FAISS index rebuilt and saved to: {index_path} ({stats})")
+        return stats
+
+
+@metrics.timed("rag.build_faiss_index")
+def build_faiss_index(index_name, data_list, previous_index=None, workers=1, batch_size=64, index_spec="flat",
+                      storage="mmap", boilerplate_min_pages=5, near_duplicate_threshold=0.9):
     """
     Builds a FAISS index from a list of scraped data and saves it
     to a folder named after the index_name.
+    With previous_index, pages whose content is unchanged since that index
+    (compared by hash against its knowledge rows) keep their vectors and only
+    new or changed pages are embedded. With workers > 1 chunks are embedded
+    on that many processes. index_spec picks the FAISS index type (see
+    parse_index_spec); it is saved with the index along with its recall@10
+    against exact search. storage is "mmap" (vectors memory-mapped, chunks
+    in SQLite) or "pickle" (LangChain's save_local). Lines found on at least
+    boilerplate_min_pages pages are stripped as site chrome and chunks with
+    an estimated Jaccard similarity of near_duplicate_threshold to an earlier
+    chunk are dropped (0 turns either off). Returns build stats.
     """
-    index_path = index_name
-
     if not data_list:
         print(f"No data provided for index: {index_name}")
         return
 
     print(f"Rebuilding FAISS index for: {index_name}...")
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-
-    # Get content from the provided data list
-    docs = [item['content'] for item in data_list]
-
-    chunks = []
-    for doc in docs:
-        chunks.extend(splitter.split_text(doc))
-    
-    if not chunks:
-        print(f"No text chunks generated for index: {index_name}")
-        return
+    builder = IndexBuilder(index_name, previous_index=previous_index, workers=workers, batch_size=batch_size,
+                           index_spec=index_spec, storage=storage, boilerplate_min_pages=boilerplate_min_pages,
+                           near_duplicate_threshold=near_duplicate_threshold)
+    try:
+        for item in data_list:
+            builder.add_page(item)
+        return builder.finish()
+    finally:
+        builder.close()
 
-    documents = [Document(page_content=chunk) for chunk in chunks]
+def estimate_tokens(text):
+    """Rough token count for English text (about 4 characters per token)."""
+    return (len(text) + 3) // 4
 
-    vectorstore = FAISS.from_documents(documents, embeddings)
-    vectorstore.save_local(index_path)
-    print(f"FAISS index rebuilt and saved to: {index_path}")
 
-def combine_retrieved_chunks(chunks):
-    """Joins the page_content of retrieved documents."""
-    return "\n".join(chunk.page_content for chunk in chunks)
\ No newline at end of file
+def _overlap(first, second, min_overlap=20):
+    """Length of the longest suffix of first that is also a prefix of second."""
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    probe = second[:min_overlap]
+    start = max(0, len(first) - len(second))
+    while True:
+        pos = first.find(probe, start)
+        if pos == -1:
+            return 0
+        if second.startswith(first[pos:]):
+            return len(first) - pos
+        start = pos + 1
+
+
+def combine_retrieved_chunks(chunks, token_budget=None):
+    """
+    Joins the page_content of retrieved documents, most relevant first.
+    Text a chunk shares with an already kept chunk of the same page (the
+    splitter's overlap) is dropped, and when token_budget is given chunks are
+    added until it is spent; the chunk that crosses it is cut to fit.
+    """
+    kept = []  # (page_url, text)
+    used = 0
+    for chunk in chunks:
+        text = chunk.page_content
+        page_url = chunk.metadata.get('page_url')
+        for kept_url, kept_text in kept:
+            if page_url and kept_url and page_url != kept_url:
+                continue
+            if text in kept_text:
+                text = ""
+                break
+            text = text[_overlap(kept_text, text):]
+            tail = _overlap(text, kept_text)
+            if tail:
+                text = text[:-tail]
+        text = text.strip()
+        if not text:
+            continue
+
+        if token_budget is not None:
+            remaining = token_budget - used
+            if remaining <= 0:
+                break
+            if estimate_tokens(text) > remaining:
+                text = text[:remaining * 4].rsplit(" ", 1)[0]
+        used += estimate_tokens(text)
+        kept.append((page_url, text))
+    return "\n".join(text for _, text in kept)
\ No newline at end of file
@@ -7,12 +7,21 @@ from selenium.webdriver.chrome.options import Options
 from webdriver_manager.chrome import ChromeDriverManager
 import time
 from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+from selenium.common.exceptions import WebDriverException
 import pandas as pd
 import json
 import os
-from collections import deque
 import urllib.parse # to manipulate urls
+import asyncio
+import hashlib
+import queue as queue_module
+import re
+import sqlite3
+import threading
+from xml.etree import ElementTree
+import httpx
+import metrics
+from extract import get_extractor
 
 
 # options
@@ -27,6 +36,8 @@ chrome_options.add_argument('--no-sandbox')
 chrome_options.add_argument('--disable-dev-shm-usage')
 chrome_options.add_argument('--headless')
 
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.63 Safari/537.36"
+
 
 # wait
 def wait_for_page_to_load(driver, wait):
@@ -40,67 +51,759 @@ def wait_for_page_to_load(driver, wait):
         print(f"The Webpage {title} did not get loaded.")
 
 
+def is_internal(url, base_url):
+    """Whether url stays under base_url and isn't a blog or podcast page."""
+    if "/blog/" in url:
+        print(f"DEBUG: skipping blog page -> {url}")
+        return False
+    if "/podcasts" in url:
+        print(f"DEBUG: skipping podcast -> {url}")
+        return False
+    return url.startswith(base_url)
+
+
+def internal_links(links, base_url):
+    """The absolute links that stay under base_url, minus blog and podcasts."""
+    return [url for url in links if is_internal(url, base_url)]
+
+
+def extract_page(extractor, html, url):
+    """Runs extractor on one page: {'title', 'content', 'links'}."""
+    with metrics.span("scrape.extract"):
+        return extractor.extract(html, url)
+
+
+# resources never needed for get_text(): blocked by URL pattern through DevTools
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp", "*.avif",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.m4a", "*.ogg", "*.wav", "*.m3u8",
+]
+# third-party scripts (analytics, ads, chat widgets) that don't render page content
+BLOCKED_SCRIPT_HOSTS = [
+    "googletagmanager.com", "google-analytics.com", "doubleclick.net", "googleadservices.com",
+    "connect.facebook.net", "hotjar.com", "hs-scripts.com", "hs-analytics.net", "hubspot.com",
+    "linkedin.com/px", "snap.licdn.com", "clarity.ms", "intercom.io", "drift.com", "youtube.com", "vimeo.com",
+]
+
+
+def new_driver(block_resources=False):
+    """A headless Chrome; with block_resources, images, fonts, media and tracker scripts are never downloaded."""
+    options = chrome_options
+    if block_resources:
+        options = Options()
+        for argument in chrome_options.arguments:
+            options.add_argument(argument)
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.media_stream": 2,
+        })
+    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    if block_resources:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {
+            "urls": BLOCKED_URL_PATTERNS + [f"*{host}*" for host in BLOCKED_SCRIPT_HOSTS],
+        })
+    return driver
+
+
+# counts DOM mutations (installed once per page) and resources fetched so far
+SETTLE_PROBE_JS = """
+if (window.__crawlMutations === undefined) {
+    window.__crawlMutations = 0;
+    new MutationObserver(function () { window.__crawlMutations++; })
+        .observe(document, {subtree: true, childList: true, characterData: true, attributes: true});
+}
+return [window.__crawlMutations, performance.getEntriesByType('resource').length];
+"""
+
+TRANSFER_JS = """
+var entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+return [entries.reduce(function (total, e) { return total + (e.transferSize || 0); }, 0), entries.length];
+"""
+
+
+def wait_until_settled(driver, quiet=0.5, max_wait=2.0, poll=0.1):
+    """
+    Waits until the DOM has not changed, or no new resource has been
+    requested, for quiet seconds, but no longer than max_wait. Returns the
+    seconds waited.
+    """
+    start = time.monotonic()
+    if max_wait <= 0:
+        return 0.0
+    last_mutations = last_resources = None
+    dom_since = net_since = start
+    while True:
+        now = time.monotonic()
+        try:
+            mutations, resources = driver.execute_script(SETTLE_PROBE_JS)
+        except Exception:
+            break # page can't be probed; what has rendered so far will do
+        if mutations != last_mutations:
+            last_mutations, dom_since = mutations, now
+        if resources != last_resources:
+            last_resources, net_since = resources, now
+        if now - dom_since >= quiet or now - net_since >= quiet or now - start >= max_wait:
+            break
+        time.sleep(poll)
+    return time.monotonic() - start
+
+
+def transferred_bytes(driver):
+    """(bytes, requests) the page has transferred so far, or (None, None) if the browser can't say."""
+    try:
+        total, requests = driver.execute_script(TRANSFER_JS)
+        return int(total), int(requests)
+    except Exception:
+        return None, None
+
+
+def load_page(driver, url, max_settle=2.0, quiet=0.5):
+    """
+    Opens url and returns the rendered HTML once the page has loaded and
+    settled (see wait_until_settled). Logs the time spent and bytes transferred.
+    """
+    start = time.monotonic()
+    driver.get(url)
+    wait_for_page_to_load(driver, WebDriverWait(driver, 10))
+    loaded = time.monotonic() - start
+    settled = wait_until_settled(driver, quiet, max_settle)
+    size, requests = transferred_bytes(driver)
+    transfer = f", {size / 1024:.0f} KB in {requests} requests" if size is not None else ""
+    print(f"DEBUG: page ready -> {url} (load {loaded * 1000:.0f} ms + settle {settled * 1000:.0f} ms{transfer})")
+    return driver.page_source
+
+
+# <------------------------------------------------ CRAWL FRONTIER ------------------------------------------------>
+# Shared by every crawler: URLs are deduplicated on a canonical form and kept
+# in SQLite, so memory stays flat as the site grows and an interrupted crawl
+# can pick up where it stopped.
+
+# query parameters that only track campaigns and never change the page
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|gclid|fbclid|msclkid|mc_cid|mc_eid|_ga)$", re.I)
+
+
+def canonical_url(url):
+    """
+    The dedup key of url: lower-case scheme and host, no default port,
+    fragment, tracking parameters or trailing slash, and query parameters
+    sorted, so variants of one page are crawled once.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    path = re.sub(r"/{2,}", "/", parts.path or "/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = sorted((key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if not TRACKING_PARAMS.match(key))
+    return urllib.parse.urlunsplit((scheme, host, path, urllib.parse.urlencode(query), ""))
+
+
+def sitemap_urls(base_url, timeout=10.0, max_sitemaps=20):
+    """
+    Page URLs under base_url listed in the sitemaps named by robots.txt, or
+    in /sitemap.xml; sitemap indexes are followed. [] if the site has none.
+    """
+    root = urllib.parse.urljoin(base_url, "/")
+    urls, pending, fetched = [], [], set()
+    with httpx.Client(timeout=timeout, follow_redirects=True, headers={"User-Agent": USER_AGENT}) as client:
+        try:
+            robots = client.get(root + "robots.txt")
+            if robots.status_code == 200:
+                pending = re.findall(r"(?im)^\s*sitemap:\s*(\S+)", robots.text)
+        except httpx.HTTPError as e:
+            print(f"DEBUG: no robots.txt -> {e}")
+        pending = pending or [root + "sitemap.xml"]
+        while pending and len(fetched) < max_sitemaps:
+            sitemap = pending.pop(0)
+            if sitemap in fetched:
+                continue
+            fetched.add(sitemap)
+            try:
+                response = client.get(sitemap)
+                response.raise_for_status()
+                tree = ElementTree.fromstring(response.content)
+            except (httpx.HTTPError, ElementTree.ParseError) as e:
+                print(f"DEBUG: no sitemap at {sitemap} -> {e}")
+                continue
+            locations = [loc.text.strip() for loc in tree.iter() if loc.tag.endswith("loc") and loc.text]
+            if tree.tag.endswith("sitemapindex"):
+                pending.extend(locations)
+            else:
+                urls.extend(url for url in locations if is_internal(url, base_url))
+    print(f"DEBUG: {len(urls)} urls in sitemaps of {base_url}")
+    return urls
+
+
+class CrawlFrontier:
+    """
+    Thread-safe BFS frontier, stored in the crawl_frontier table of the
+    SQLite database at path (in memory by default) under crawl_id. A URL is
+    queued at most once per canonical form (plus retries). get() blocks
+    while other workers may still add links and returns None once the
+    crawl is finished or stopped.
+
+    Reopening a file-backed frontier with the same crawl_id resumes it:
+    pages that were being fetched when it stopped are queued again. Which
+    URLs are being fetched is only kept in memory, so a page costs one
+    commit: done() stores its links and its state in one transaction.
+    """
+
+    def __init__(self, seeds=(), max_attempts=2, path=":memory:", crawl_id="crawl"):
+        self._cond = threading.Condition()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_frontier
+                (
+                    id INTEGER PRIMARY KEY,
+                    crawl_id TEXT,
+                    url_key TEXT,
+                    url TEXT,
+                    state TEXT DEFAULT 'queued',
+                    attempts INTEGER DEFAULT 0,
+                    UNIQUE (crawl_id, url_key)
+                )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS crawl_frontier_state ON crawl_frontier (crawl_id, state, id)")
+        self._conn.commit()
+        self.crawl_id = crawl_id
+        self._in_progress = set()  # ids of the rows being fetched
+        self.max_attempts = max_attempts
+        self.stopped = False
+        self.add_many(seeds)
+
+    def add(self, url):
+        return bool(self.add_many([url]))
+
+    def add_many(self, urls):
+        """Queues the new ones among urls in one transaction and returns them."""
+        with self._cond:
+            added = self._insert(urls)
+            self._conn.commit()
+            self._cond.notify_all()
+            return added
+
+    def _insert(self, urls):
+        return [url for url in urls
+                if self._conn.execute("INSERT OR IGNORE INTO crawl_frontier (crawl_id, url_key, url) VALUES (?, ?, ?)",
+                                      (self.crawl_id, canonical_url(url), url)).rowcount]
+
+    def _next(self):
+        return self._conn.execute(f"SELECT id, url FROM crawl_frontier WHERE crawl_id=? AND state='queued'"
+                                  f" AND id NOT IN ({','.join('?' * len(self._in_progress))}) ORDER BY id LIMIT 1",
+                                  (self.crawl_id, *self._in_progress)).fetchone()
+
+    def get(self, block=True):
+        """Next URL to crawl; None when there is none (without block: none right now)."""
+        with self._cond:
+            row = self._next()
+            while block and not row and self._in_progress and not self.stopped:
+                self._cond.wait()
+                row = self._next()
+            if self.stopped or not row:
+                return None
+            self._in_progress.add(row[0])
+            return row[1]
+
+    def done(self, url, retry=False, links=()):
+        """
+        Marks url as handled and queues the links found on it, committing
+        both at once; with retry url is queued again if it has attempts
+        left. Returns the links that were new.
+        """
+        with self._cond:
+            added = self._insert(links)
+            row_id, attempts = self._conn.execute("SELECT id, attempts + 1 FROM crawl_frontier WHERE crawl_id=? AND url_key=?",
+                                                  (self.crawl_id, canonical_url(url))).fetchone()
+            self._in_progress.discard(row_id)
+            state = "queued" if retry and attempts < self.max_attempts else "failed" if retry else "done"
+            self._conn.execute("UPDATE crawl_frontier SET state=?, attempts=? WHERE id=?", (state, attempts, row_id))
+            self._conn.commit()
+            self._cond.notify_all()
+            return added
+
+    def finished(self):
+        with self._cond:
+            return self.stopped or (not self._in_progress and not self._next())
+
+    def requeue_done(self, keep=()):
+        """Queues finished URLs again, except the canonical forms of keep (the pages that were actually stored)."""
+        keep = {canonical_url(url) for url in keep}
+        with self._cond:
+            rows = self._conn.execute("SELECT id, url_key FROM crawl_frontier WHERE crawl_id=? AND state='done'",
+                                      (self.crawl_id,)).fetchall()
+            self._conn.executemany("UPDATE crawl_frontier SET state='queued' WHERE id=?",
+                                   [(row_id,) for row_id, key in rows if key not in keep])
+            self._conn.commit()
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+
+    def seen(self):
+        with self._cond:
+            return self._conn.execute("SELECT COUNT(*) FROM crawl_frontier WHERE crawl_id=?", (self.crawl_id,)).fetchone()[0]
+
+    def clear(self):
+        """Forgets this crawl once its pages are safely stored."""
+        with self._cond:
+            self._conn.execute("DELETE FROM crawl_frontier WHERE crawl_id=?", (self.crawl_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._cond:
+            self._conn.close()
+
+
+def seed_frontier(frontier, base_url, sitemap=True):
+    """Queues base_url and, with sitemap, every page its sitemaps list."""
+    frontier.add(base_url)
+    if sitemap:
+        frontier.add_many(sitemap_urls(base_url))
+
+
 # scrapping logic
-def scraper(base_url="https://www.occamsadvisory.com/"):
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-    wait = WebDriverWait(driver, 10)
+def iter_pages(base_url="https://www.occamsadvisory.com/", block_resources=True, max_settle=2.0, quiet=0.5,
+               frontier=None, sitemap=True, extractor="main"):
+    """
+    Crawls base_url breadth-first, yielding each page as {'url', 'title', 'content'} as soon as it is scraped.
+    Pass a file-backed CrawlFrontier to make the crawl resumable.
+    """
+    extractor = get_extractor(extractor)
+    own_frontier = frontier is None
+    frontier = frontier or CrawlFrontier()
+    seed_frontier(frontier, base_url, sitemap)
+    driver = new_driver(block_resources)
     driver.maximize_window()
     
-    data  = [] # to store: {'url':str, 'content':str}
-    visited = set() # to track already visited urls
-    queue = deque([base_url]) # starting with homepage
-    
+    scraped = 0
     print("Starting scraping .....")
-    while queue:
-        current_url = queue.popleft() # getting next url (bfs)
-        if current_url in visited:
-            continue
-        try:
-            print(f"DEBUG: scraping url -> {current_url}")
-            driver.get(current_url)
-            wait_for_page_to_load(driver, wait)
-            time.sleep(2) # extra delay for js rendering
-            
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            content = soup.get_text(separator="\n", strip=True)
-            
-            # adding url to data
-            data.append({"url": current_url, "content": content})
-            visited.add(current_url)
-            
-            # PREVIEW
-            # print(f"content length: {len(content)} chars\n")
-            # print(f"content snippet: {content[:200]}\n")
-            # print("-"*50 + "\n")
+    try:
+        while True:
+            current_url = frontier.get() # getting next url (bfs)
+            if current_url is None:
+                break
+            page, links = None, []
+            try:
+                print(f"DEBUG: scraping url -> {current_url}")
+                extracted = extract_page(extractor, load_page(driver, current_url, max_settle, quiet), current_url)
+                content = extracted["content"]
+                
+                page = {"url": current_url, "title": extracted["title"], "content": content}
+                
+                # PREVIEW
+                # print(f"content length: {len(content)} chars\n")
+                # print(f"content snippet: {content[:200]}\n")
+                # print("-"*50 + "\n")
+                
+                # Find internal links 
+                links = internal_links(extracted["links"], base_url)
+                        
+            except Exception as e:
+                print(f"Can't scrape -> {current_url}: {e}\n")
+            finally:
+                for full_url in frontier.done(current_url, links=links):
+                    print(f"DEBUG: adding to the queue -> {full_url}")
             
-            # Find internal links 
-            links = soup.find_all('a', href=True)
-            for a in links:
-                href = a['href']
-                if not href or href.startswith("#") or href.startswith("mailto:") or href.startswith("tel:"):
-                    continue # skipping achors, emails, phone numbers
-                full_url = urllib.parse.urljoin(base_url, href)
-                if "/blog/" in full_url:
-                    print(f"DEBUG: skipping blog page -> {full_url}")
+            # handed over outside the try, so the consumer's errors aren't mistaken for ours
+            if page:
+                scraped += 1
+                yield page
+    finally:
+        driver.quit()
+        if own_frontier:
+            frontier.close()
+        print(f"Scarping completed......")
+        print(f"No of pages scraped: {scraped}")
+
+
+def scraper(base_url="https://www.occamsadvisory.com/"):
+    """Crawls the whole site and returns every page as a list of {'url', 'title', 'content'}."""
+    return list(iter_pages(base_url))
+
+
+# <------------------------------------------------ HTTP CRAWLER ------------------------------------------------>
+# Most pages are static HTML: fetch them directly, many at a time, and only
+# hand the ones that need JavaScript to a (single, lazily started) browser.
+
+# pages with less visible text than this and some scripts are treated as client-rendered
+JS_MIN_TEXT_CHARS = 200
+JS_APP_ROOT = re.compile(r'<div[^>]+id=["\'](root|app|__next|__nuxt)["\'][^>]*>\s*</div>', re.I)
+JS_NOSCRIPT_HINT = re.compile(r"enable javascript|requires javascript|javascript is (disabled|required)", re.I)
+
+
+JS_NOSCRIPT = re.compile(r"<noscript\b[^>]*>(.*?)</noscript>", re.I | re.S)
+JS_SCRIPT_TAG = re.compile(r"<script\b", re.I)
+
+
+def needs_javascript(html, text):
+    """Guesses whether html (whose extracted text is text) only gets its content once scripts run."""
+    if JS_APP_ROOT.search(html):
+        return True
+    if JS_NOSCRIPT_HINT.search(" ".join(JS_NOSCRIPT.findall(html))):
+        return True
+    return len(text) < JS_MIN_TEXT_CHARS and bool(JS_SCRIPT_TAG.search(html))
+
+
+class BrowserRenderer:
+    """Renders pages in one headless Chrome, started on first use; one page at a time."""
+
+    def __init__(self, block_resources=True, max_settle=2.0, quiet=0.5):
+        self.block_resources = block_resources
+        self.max_settle = max_settle
+        self.quiet = quiet
+        self._driver = None
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        with self._lock:
+            if self._driver is None:
+                self._driver = new_driver(self.block_resources)
+            return load_page(self._driver, url, self.max_settle, self.quiet)
+
+    def close(self):
+        with self._lock:
+            if self._driver is not None:
+                self._driver.quit()
+                self._driver = None
+
+
+class _Politeness:
+    """Spaces request starts at least delay seconds apart."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if self.delay <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.delay
+
+
+def conditional_headers(previous):
+    """If-None-Match / If-Modified-Since headers from a page's stored validators."""
+    headers = {}
+    if previous and previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous and previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+    return headers
+
+
+async def crawl_async(base_url="https://www.occamsadvisory.com/", concurrency=8, delay=0.0, render=None, timeout=15.0,
+                      known=None, frontier=None, extractor="main"):
+    """
+    Crawls base_url breadth-first over HTTP with up to concurrency requests
+    in flight, starting them at least delay seconds apart. Pages that look
+    client-rendered are passed to render(url) -> html (run in a thread), if
+    given. Yields {'url', 'title', 'content', 'etag', 'last_modified',
+    'content_hash', 'reused'} pages as they are extracted.
+
+    known maps URLs from a previous crawl to their page dicts: they are
+    requested conditionally, and a 304 or an identical body (content_hash is
+    the sha256 of the raw HTML) carries the previous content forward without
+    parsing or rendering (reused=True). Unchanged pages aren't parsed for
+    links, so the known URLs seed the frontier too. Pages rendered in the
+    browser are stored without validators: their fetched HTML is only the
+    app shell, which stays the same when the content changes, so they are
+    rendered again on every crawl.
+
+    URLs come from frontier (a new in-memory CrawlFrontier seeded with
+    base_url if not given). Its SQLite reads and commits run in threads, so
+    a locked database doesn't hold up the fetches in flight.
+    """
+    extractor = get_extractor(extractor)
+    frontier = frontier or CrawlFrontier([base_url])
+    await asyncio.to_thread(frontier.add_many, list(known or {}))
+    known = {canonical_url(url): page for url, page in (known or {}).items()}
+    results = asyncio.Queue(maxsize=concurrency * 2)
+    politeness = _Politeness(delay)
+
+    async def fetch(client, url):
+        await politeness.wait()
+        return await client.get(url, headers=conditional_headers(known.get(canonical_url(url))))
+
+    async def worker(client):
+        while True:
+            url = await asyncio.to_thread(frontier.get, False)
+            if url is None:
+                if await asyncio.to_thread(frontier.finished):
+                    return
+                await asyncio.sleep(0.02) # other workers may still add links
+                continue
+            links = []
+            try:
+                print(f"DEBUG: fetching url -> {url}")
+                response = await fetch(client, url)
+                previous = known.get(canonical_url(url))
+                page = {
+                    "url": url,
+                    "etag": response.headers.get("etag"),
+                    "last_modified": response.headers.get("last-modified"),
+                    "reused": False,
+                }
+                if response.status_code == 304 and previous:
+                    print(f"DEBUG: not modified -> {url}")
+                    await results.put({**page, "title": previous.get("title"), "content": previous["content"],
+                                       "content_hash": previous.get("content_hash"),
+                                       "etag": page["etag"] or previous.get("etag"),
+                                       "last_modified": page["last_modified"] or previous.get("last_modified"),
+                                       "reused": True})
                     continue
-                if "/podcasts" in full_url:
-                    print(f"DEBUG: skipping podcast -> {full_url}")
+                response.raise_for_status()
+                if "html" not in response.headers.get("content-type", "text/html"):
                     continue
-                if full_url.startswith(base_url) and full_url not in visited and full_url not in queue:
-                    queue.append(full_url)
-                    print(f"DEBUG: adding to the queue -> {full_url}")
-                # break
-                    
+                page["content_hash"] = hashlib.sha256(response.content).hexdigest()
+                if previous and previous.get("content_hash") == page["content_hash"]:
+                    print(f"DEBUG: unchanged -> {url}")
+                    await results.put({**page, "title": previous.get("title"), "content": previous["content"], "reused": True})
+                    continue
+                html = response.text
+                extracted = extract_page(extractor, html, url)
+                if render is not None and needs_javascript(html, extracted["content"]):
+                    print(f"DEBUG: rendering in browser -> {url}")
+                    html = await asyncio.to_thread(render, url)
+                    extracted = extract_page(extractor, html, url)
+                    page.update({"etag": None, "last_modified": None, "content_hash": None})
+                links = internal_links(extracted["links"], base_url)
+                await results.put({**page, "title": extracted["title"], "content": extracted["content"]})
+            except Exception as e:
+                print(f"Can't scrape -> {url}: {e}\n")
+            finally:
+                await asyncio.to_thread(frontier.done, url, links=links)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True,
+                                 headers={"User-Agent": USER_AGENT}) as client:
+        workers = [asyncio.create_task(worker(client)) for _ in range(concurrency)]
+        done = asyncio.ensure_future(asyncio.gather(*workers))
+        try:
+            while True:
+                next_page = asyncio.create_task(results.get())
+                await asyncio.wait({next_page, done}, return_when=asyncio.FIRST_COMPLETED)
+                if next_page.done():
+                    yield next_page.result()
+                    continue
+                next_page.cancel()
+                while not results.empty():
+                    yield results.get_nowait()
+                break
+        finally:
+            done.cancel()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, done, return_exceptions=True)
+
+
+def iter_pages_http(base_url="https://www.occamsadvisory.com/", concurrency=8, delay=0.0, browser_fallback=True,
+                    block_resources=True, max_settle=2.0, quiet=0.5, known=None, frontier=None, sitemap=True,
+                    extractor="main"):
+    """
+    Runs crawl_async on its own event loop thread and yields its pages, so it
+    can stand in for iter_pages. With browser_fallback, client-rendered pages
+    go through headless Chrome; known enables a conditional re-crawl.
+    """
+    pages = queue_module.Queue(maxsize=concurrency * 2)
+    stop = threading.Event()
+    end = object()
+    renderer = BrowserRenderer(block_resources, max_settle, quiet) if browser_fallback else None
+    own_frontier = frontier is None
+    frontier = frontier or CrawlFrontier()
+
+    async def produce():
+        crawl = crawl_async(base_url, concurrency, delay, renderer, known=known, frontier=frontier, extractor=extractor)
+        try:
+            async for page in crawl:
+                while not stop.is_set():
+                    try:
+                        pages.put_nowait(page)
+                        break
+                    except queue_module.Full:
+                        await asyncio.sleep(0.05)
+                if stop.is_set():
+                    break
+        finally:
+            await crawl.aclose()
+
+    def run():
+        try:
+            seed_frontier(frontier, base_url, sitemap)
+            asyncio.run(produce())
         except Exception as e:
-            print(f"Can't scrape -> {current_url}: {e}\n")
-            
-    driver.quit()
-    print(f"Scarping completed......")
-    print(f"No of pages scraped: {len(data)}")
-    return data
+            print(f"HTTP crawl failed: {e}")
+        finally:
+            pages.put(end)
+
+    print("Starting scraping .....")
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    scraped = reused = 0
+    try:
+        while True:
+            page = pages.get()
+            if page is end:
+                break
+            scraped += 1
+            reused += page["reused"]
+            yield page
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                pages.get(timeout=0.1) # unblock a producer waiting on a full queue
+            except queue_module.Empty:
+                pass
+        if renderer:
+            renderer.close()
+        if own_frontier:
+            frontier.close()
+        print(f"Scarping completed......")
+        print(f"No of pages scraped: {scraped} ({reused} unchanged since the last crawl)")
+
+
+def scraper_http(base_url="https://www.occamsadvisory.com/", concurrency=8, delay=0.0, browser_fallback=True, known=None,
+                 frontier=None, sitemap=True, extractor="main"):
+    """HTTP counterpart of scraper(): the whole site as a list of page dicts (see crawl_async)."""
+    return list(iter_pages_http(base_url, concurrency, delay, browser_fallback, known=known, frontier=frontier,
+                                sitemap=sitemap, extractor=extractor))
 
 # scraped_data = scraper() # Appx 15 mins
 
 # with open('occams_scraped_data.json', 'w') as f:
 #     json.dump(scraped_data, f, indent=4)
-# print("saved as json ....")
\ No newline at end of file
+# print("saved as json ....")
+
+# <------------------------------------------------ BROWSER POOL ------------------------------------------------>
+# For sites that need JavaScript everywhere: N browsers, each on its own
+# thread with its own driver, share one frontier.
+
+class HostRateLimiter:
+    """Spaces requests to the same host at least delay seconds apart, across threads."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if self.delay <= 0:
+            return
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, 0.0))
+            self._next[host] = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+def _quit(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        print(f"Could not quit browser: {e}")
+
+
+def _browser_worker(base_url, frontier, limiter, emit, driver_factory, recycle_after, max_settle, quiet, extractor):
+    """One browser: takes URLs from frontier until it is exhausted, restarting the driver every recycle_after pages or after a crash."""
+    driver, used = None, 0
+    try:
+        while True:
+            url = frontier.get()
+            if url is None:
+                break
+            retry, links = False, []
+            try:
+                if driver is None:
+                    driver, used = driver_factory(), 0
+                limiter.wait(url)
+                print(f"DEBUG: scraping url -> {url}")
+                extracted = extract_page(extractor, load_page(driver, url, max_settle, quiet), url)
+                used += 1
+                links = internal_links(extracted["links"], base_url)
+                emit({"url": url, "title": extracted["title"], "content": extracted["content"]})
+            except WebDriverException as e:
+                # crashed or wedged browser: start a fresh one and give the page another go
+                print(f"Browser failed on {url}, restarting it: {e}")
+                _quit(driver)
+                driver, retry = None, True
+            except Exception as e:
+                print(f"Can't scrape -> {url}: {e}\n")
+            finally:
+                frontier.done(url, retry=retry, links=links)
+            if driver is not None and used >= recycle_after:
+                _quit(driver)
+                driver = None
+    finally:
+        if driver is not None:
+            _quit(driver)
+
+
+def iter_pages_pool(base_url="https://www.occamsadvisory.com/", workers=4, delay=0.0, recycle_after=50,
+                    block_resources=True, max_settle=2.0, quiet=0.5, driver_factory=None, frontier=None, sitemap=True,
+                    extractor="main"):
+    """
+    Crawls base_url with workers browsers in parallel, each on its own
+    thread and driver, all pulling from one CrawlFrontier. Requests to a
+    host start at least delay seconds apart. Yields {'url', 'title', 'content'}
+    pages in the order they finish.
+    """
+    extractor = get_extractor(extractor)
+    driver_factory = driver_factory or (lambda: new_driver(block_resources))
+    own_frontier = frontier is None
+    frontier = frontier or CrawlFrontier()
+    seed_frontier(frontier, base_url, sitemap)
+    limiter = HostRateLimiter(delay)
+    pages = queue_module.Queue(maxsize=workers * 2)
+    end = object()
+
+    def emit(page):
+        while not frontier.stopped:
+            try:
+                pages.put(page, timeout=0.5)
+                return
+            except queue_module.Full:
+                pass
+
+    threads = [threading.Thread(target=_browser_worker, daemon=True,
+                                args=(base_url, frontier, limiter, emit, driver_factory, recycle_after, max_settle, quiet,
+                                      extractor))
+               for _ in range(workers)]
+
+    def finish():
+        for thread in threads:
+            thread.join()
+        pages.put(end)
+
+    print(f"Starting scraping with {workers} browsers .....")
+    for thread in threads:
+        thread.start()
+    threading.Thread(target=finish, daemon=True).start()
+    scraped = 0
+    try:
+        while True:
+            page = pages.get()
+            if page is end:
+                break
+            scraped += 1
+            yield page
+    finally:
+        frontier.stop()
+        for thread in threads:
+            thread.join()
+        if own_frontier:
+            frontier.close()
+        print(f"Scarping completed......")
+        print(f"No of pages scraped: {scraped}")
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Caches chat responses by query embedding. A new query is a hit when its
+    cosine similarity to a previously answered query in the same scope is at
+    least `threshold`. Entries are evicted least-recently-used once
+    `max_entries` is reached, and expire after `ttl_seconds`.
+    """
+
+    def __init__(self, threshold=0.92, max_entries=256, ttl_seconds=3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> entry dict, oldest first
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_llm_seconds = 0.0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope, vector):
+        """Returns the cached entry closest to vector in scope, or None."""
+        query = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id, entry in list(self._entries.items()):
+                if now - entry["created"] > self.ttl_seconds:
+                    del self._entries[entry_id]
+                    continue
+                if entry["scope"] != scope:
+                    continue
+                score = float(np.dot(query, entry["vector"]))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            self.hits += 1
+            self.saved_llm_seconds += entry["llm_seconds"]
+            return entry
+
+    def store(self, scope, vector, response, action=None, llm_seconds=0.0):
+        with self._lock:
+            self._entries[self._next_id] = {
+                "scope": scope,
+                "vector": self._normalize(vector),
+                "response": response,
+                "action": action,
+                "llm_seconds": llm_seconds,
+                "created": time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, index_name=None):
+        """Drops every entry, or only those scoped to index_name."""
+        with self._lock:
+            if index_name is None:
+                self._entries.clear()
+                return
+            for entry_id in [i for i, e in self._entries.items() if e["scope"][0] == index_name]:
+                del self._entries[entry_id]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_llm_seconds": round(self.saved_llm_seconds, 3),
+                "threshold": self.threshold,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import time
+import json
 
 st.set_page_config(page_title="Occams Advisory App", layout="wide")
 
@@ -61,10 +62,25 @@ with st.sidebar:
     if user_input := st.chat_input("Ask about Occams Advisory:"):
         try:
             st.session_state.chat_history.append({'role': 'You', 'content': user_input})
-            response = requests.post("http://127.0.0.1:5000/chat", json={
+            with chat_box:
+                st.write(f"You: {user_input}")
+                bot_placeholder = st.empty()
+
+            # render tokens as the backend streams them, then keep the final reply
+            response, streamed = {}, ""
+            with requests.post("http://127.0.0.1:5000/chat_stream", json={
                 'user_id': st.session_state.user_id,
                 'message': user_input
-            }).json()
+            }, stream=True) as stream_resp:
+                for line in stream_resp.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event.get('done'):
+                        response = event
+                    else:
+                        streamed += event.get('token', '')
+                        bot_placeholder.write(f"Bot: {streamed}")
             
             st.session_state.chat_history.append({'role': 'Bot', 'content': response['response']})
 
@@ -204,6 +220,7 @@ else:
                             resp = requests.post("http://127.0.0.1:5000/set_active_index", 
                                                  json={'index_name': selected_index, 'user_id': st.session_state.user_id}).json()
                             st.write(resp.get('status', resp.get('error')))
+                            time.sleep(1)
                             st.rerun()
                         except Exception as e:
                             st.error(f"Set index failed: {e}")
@@ -217,6 +234,28 @@ else:
                             st.rerun()
                         except Exception as e:
                             st.error(f"Delete index failed: {e}")
+                activation = requests.get("http://127.0.0.1:5000/activation_status",
+                                          params={'user_id': st.session_state.user_id}).json()
+                if activation.get('index_name'):
+                    st.write(f"**Activation of** `{activation['index_name']}`: {activation.get('stage')} - {activation.get('progress', '')}")
+                    if activation.get('timings'):
+                        st.json(activation['timings'], expanded=False)
+                    if activation.get('running'):
+                        time.sleep(2)
+                        st.rerun()
+                details = idx_resp.get('details', {})
+                if details:
+                    st.dataframe([
+                        {
+                            "index": name,
+                            "type": spec.get('kind'),
+                            "recall@10": spec.get('recall_at_10'),
+                            "recall@10 before re-rank": spec.get('recall_at_10_before_rerank'),
+                            "vector MB": round(spec['index_bytes'] / 2**20, 2) if spec.get('index_bytes') else None,
+                            "float32 MB": round(spec['float32_bytes'] / 2**20, 2) if spec.get('float32_bytes') else None,
+                        }
+                        for name, spec in details.items()
+                    ], hide_index=True)
             else:
                 st.write("No indexes available. Run the scraper to create one.")
         except Exception as e:
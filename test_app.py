@@ -1,7 +1,11 @@
 import pytest
 import os
+import re
 import sqlite3
-from app import app, init_db, validate_email, validate_phone
+import time
+import zlib
+from langchain_community.vectorstores import FAISS
+from app import app, init_db, validate_email, validate_phone, retrieval_engine, response_cache
 
 # Setup Fixture
 
@@ -34,6 +38,8 @@ def client():
 
     # 4. Now that the patch is active, init_db() will create "test_database.db"
     init_db()
+    retrieval_engine.evict() # no index or cached answers carried over from a previous test
+    response_cache.clear()
     
     # 5. Set the app to testing mode and yield the client
     app.config.update({"TESTING": True})
@@ -46,6 +52,19 @@ def client():
         os.remove(db_path)
 
 
+def fake_embeddings(mocker):
+    """Bag-of-words embeddings, so similar questions get similar vectors without a model download."""
+    def embed(text):
+        vector = [0.0] * 64
+        for word in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(word.encode()) % 64] += 1.0
+        return vector
+    embeddings = mocker.MagicMock()
+    embeddings.embed_query.side_effect = embed
+    embeddings.embed_documents.side_effect = lambda texts: [embed(t) for t in texts]
+    return embeddings
+
+
 # Test Cases
 
 ## 1. Validation Tests
@@ -103,7 +122,9 @@ def test_chat_nudges_user_to_onboard(client, mocker):
     # Mock the function that checks the DB for the active index:
     mocker.patch('app.get_active_index_name', return_value="fake_index_123")
     # Mock the FAISS.load_local so it doesn't fail trying to load a file:
-    mocker.patch('app.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    # Don't download the embedding model:
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
     # Mock the retriever functions (we don't care about the context for this test):
     mocker.patch('app.combine_retrieved_chunks', return_value="")
     
@@ -129,4 +150,459 @@ def test_chat_nudges_user_to_onboard(client, mocker):
     # Check that the response text was correctly replaced
     assert json_data['response'] == "I can help with that! Please complete the form below to sign up."
     # Check that the 'action' key was added, which tells Streamlit to open the dialog
-    assert json_data['action'] == 'open_pii_dialog'
\ No newline at end of file
+    assert json_data['action'] == 'open_pii_dialog'
+
+## 4. Retrieval Engine Tests
+def test_chat_reuses_loaded_index(client, mocker):
+    """
+    Tests that the FAISS index is loaded once and then served from memory
+    for every following chat against the same active index.
+    """
+    print("Running test: test_chat_reuses_loaded_index")
+    mocker.patch('app.get_active_index_name', return_value="fake_index_123")
+    load_local = mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    mocker.patch('app.combine_retrieved_chunks', return_value="")
+    mock_llm = mocker.patch('app.ChatGoogleGenerativeAI').return_value
+    mock_llm.invoke.return_value.content = "We offer tax advisory."
+
+    for _ in range(3):
+        response = client.post('/chat', json={'user_id': 1, 'message': 'What services do you offer?'})
+        assert response.get_json()['response'] == "We offer tax advisory."
+
+    assert load_local.call_count == 1
+
+def fake_store(embeddings, texts=("We offer tax advisory.",)):
+    """A small real FAISS store, so activation can validate and search it."""
+    return FAISS.from_texts(list(texts), embeddings)
+
+
+def wait_for_activation(client):
+    """Polls /activation_status until the background activation has finished."""
+    for _ in range(100):
+        status = client.get('/activation_status', query_string={'user_id': 1}).get_json()
+        if not status['running']:
+            return status
+        time.sleep(0.05)
+    raise AssertionError("activation did not finish")
+
+
+def test_set_active_index_swaps_engine(client, mocker):
+    """Tests that activating and deleting an index swaps and evicts the loaded store."""
+    print("Running test: test_set_active_index_swaps_engine")
+    embeddings = fake_embeddings(mocker)
+    new_store = fake_store(embeddings)
+    mocker.patch('rag.FAISS.load_local', return_value=new_store)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+
+    response = client.post('/set_active_index', json={'user_id': 1, 'index_name': 'faiss_1'})
+    assert response.status_code == 202
+    assert wait_for_activation(client)['stage'] == 'active'
+    assert retrieval_engine.index_name == 'faiss_1'
+    assert retrieval_engine.get_vectorstore('faiss_1') is new_store
+
+    response = client.post('/delete_index', json={'user_id': 1, 'index_name': 'faiss_1'})
+    assert response.status_code == 200
+    assert retrieval_engine.index_name is None
+
+
+def test_concurrent_activations_start_one_thread(client, mocker):
+    """Tests that simultaneous activation requests start exactly one activation."""
+    print("Running test: test_concurrent_activations_start_one_thread")
+    import threading
+    import app as backend
+
+    class SlowStatus(dict):
+        """Widens the gap between reading and claiming the running flag."""
+        def __getitem__(self, key):
+            value = super().__getitem__(key)
+            time.sleep(0.05)
+            return value
+
+    mocker.patch('app.activation_status', SlowStatus(backend.activation_status))
+    activate = mocker.patch('app.run_activation_background')
+    codes = []
+    def post():
+        with app.test_client() as other:
+            codes.append(other.post('/set_active_index', json={'user_id': 1, 'index_name': 'faiss_1'}).status_code)
+    requests = [threading.Thread(target=post) for _ in range(4)]
+    for thread in requests:
+        thread.start()
+    for thread in requests:
+        thread.join()
+
+    assert sorted(codes) == [202, 429, 429, 429]
+    assert activate.call_count == 1
+
+## 5. Response Cache Tests
+def test_similar_question_served_from_cache(client, mocker):
+    """Tests that a near-identical question reuses the cached answer instead of calling the LLM."""
+    print("Running test: test_similar_question_served_from_cache")
+    mocker.patch('app.get_active_index_name', return_value="fake_index_123")
+    mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    mocker.patch('app.combine_retrieved_chunks', return_value="")
+    mock_llm = mocker.patch('app.ChatGoogleGenerativeAI').return_value
+    mock_llm.invoke.return_value.content = "We offer tax advisory."
+    before = response_cache.stats()
+
+    client.post('/chat', json={'user_id': 2, 'message': 'What services do you offer?'})
+    response = client.post('/chat', json={'user_id': 2, 'message': 'what services do you offer'})
+    assert response.get_json()['response'] == "We offer tax advisory."
+    assert mock_llm.invoke.call_count == 1
+
+    # an unrelated question misses the cache
+    client.post('/chat', json={'user_id': 2, 'message': 'Where is the office located?'})
+    assert mock_llm.invoke.call_count == 2
+
+    stats = client.get('/cache_stats', query_string={'user_id': 1}).get_json()
+    assert stats['hits'] - before['hits'] == 1
+    assert stats['misses'] - before['misses'] == 2
+
+def test_cache_dropped_when_active_index_changes(client, mocker):
+    """Tests that switching the active index clears cached answers."""
+    print("Running test: test_cache_dropped_when_active_index_changes")
+    response_cache.store(("faiss_1", True), [1.0, 0.0], "old answer")
+    embeddings = fake_embeddings(mocker)
+    mocker.patch('rag.FAISS.load_local', return_value=fake_store(embeddings))
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+
+    client.post('/set_active_index', json={'user_id': 1, 'index_name': 'faiss_2'})
+    wait_for_activation(client)
+    assert response_cache.stats()['entries'] == 0
+
+## 6. Streaming Chat Tests
+def test_chat_stream_sends_tokens_then_full_reply(client, mocker):
+    """Tests that /chat_stream forwards LLM chunks as they arrive and ends with the logged reply."""
+    print("Running test: test_chat_stream_sends_tokens_then_full_reply")
+    import json
+    mocker.patch('app.get_active_index_name', return_value="fake_index_123")
+    mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    mocker.patch('app.combine_retrieved_chunks', return_value="")
+    mock_llm = mocker.patch('app.ChatGoogleGenerativeAI').return_value
+    mock_llm.stream.return_value = [mocker.MagicMock(content=part) for part in ["We offer ", "tax ", "advisory."]]
+    log_chat = mocker.patch('app.log_chat')
+
+    response = client.post('/chat_stream', json={'user_id': 2, 'message': 'What services do you offer?'})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert [line['token'] for line in lines[:-1]] == ["We offer ", "tax ", "advisory."]
+    assert lines[-1] == {'done': True, 'response': "We offer tax advisory."}
+    log_chat.assert_called_with(2, "We offer tax advisory.", True)
+
+def test_chat_stream_guest_onboarding_action(client, mocker):
+    """Tests that the streaming endpoint still asks guests to onboard."""
+    print("Running test: test_chat_stream_guest_onboarding_action")
+    import json
+    mocker.patch('app.get_active_index_name', return_value="fake_index_123")
+    mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    mocker.patch('app.combine_retrieved_chunks', return_value="")
+    mocker.patch('app.ChatGoogleGenerativeAI')
+    mock_agent = mocker.MagicMock()
+    mock_agent.run.return_value = "ACTION_TRIGGER_ONBOARDING"
+    mocker.patch('app.initialize_agent', return_value=mock_agent)
+
+    response = client.post('/chat_stream', json={'user_id': None, 'message': 'i want to signup'})
+    final = json.loads(response.get_data(as_text=True).splitlines()[-1])
+
+    assert final['action'] == 'open_pii_dialog'
+    assert final['response'] == "I can help with that! Please complete the form below to sign up."
+
+## 7. Async Chat Tests
+def test_async_chat_caps_llm_concurrency(client, mocker):
+    """
+    Tests that the ASGI /chat answers concurrent requests, never runs more
+    Gemini calls at once than the semaphore allows, and writes history in
+    the background.
+    """
+    print("Running test: test_async_chat_caps_llm_concurrency")
+    import asyncio
+    import httpx
+    import app as backend
+    import asgi_app
+
+    mocker.patch('app.get_active_index_name', return_value="fake_index_123")
+    mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    mocker.patch('app.combine_retrieved_chunks', return_value="")
+
+    in_flight = {'now': 0, 'max': 0}
+    async def slow_ainvoke(prompt):
+        in_flight['now'] += 1
+        in_flight['max'] = max(in_flight['max'], in_flight['now'])
+        await asyncio.sleep(0.05)
+        in_flight['now'] -= 1
+        return mocker.MagicMock(content="We offer tax advisory.")
+    mock_llm = mocker.patch('app.ChatGoogleGenerativeAI').return_value
+    mock_llm.ainvoke.side_effect = slow_ainvoke
+
+    async def run_chats():
+        asgi_app.llm_semaphore = asyncio.Semaphore(2)
+        transport = httpx.ASGITransport(app=asgi_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            questions = [f"question number {i} about topic {i}" for i in range(6)]
+            return await asyncio.gather(*[
+                http.post('/chat', json={'user_id': 2, 'message': q}) for q in questions
+            ])
+
+    responses = asyncio.run(run_chats())
+    assert all(r.json()['response'] == "We offer tax advisory." for r in responses)
+    assert in_flight['max'] == 2
+
+    backend.chat_log_queue.join()
+    history = client.get('/chat_history', query_string={'user_id': 2}).get_json()
+    assert len(history) == 12
+
+## 8. Hybrid Retrieval Tests
+def test_lexical_search_finds_exact_terms(client):
+    """Tests that insert_knowledge keeps the FTS index in sync and exact terms are found."""
+    print("Running test: test_lexical_search_finds_exact_terms")
+    from app import insert_knowledge, lexical_search, delete_index
+    insert_knowledge("faiss_1", [
+        {'url': 'https://example.com/erc', 'content': 'We help businesses claim the ERC payroll credit.'},
+        {'url': 'https://example.com/about', 'content': 'Occams Advisory was founded to help growing companies.'},
+    ])
+
+    docs = lexical_search("faiss_1", "How does ERC work?")
+    assert [doc.metadata['page_url'] for doc in docs] == ['https://example.com/erc']
+    assert lexical_search("faiss_2", "ERC") == []
+
+    delete_index("faiss_1")
+    assert lexical_search("faiss_1", "ERC") == []
+
+def test_init_db_rebuilds_fts_index_without_chunk_positions(client):
+    """Tests that an FTS index from before chunk positions were stored is rebuilt from knowledge."""
+    print("Running test: test_init_db_rebuilds_fts_index_without_chunk_positions")
+    from app import init_db, lexical_search
+    conn = sqlite3.connect('database.db')
+    conn.execute("DROP TABLE knowledge_fts")
+    conn.execute("CREATE VIRTUAL TABLE knowledge_fts USING fts5 (content, index_name UNINDEXED, page_url UNINDEXED)")
+    conn.execute("INSERT INTO knowledge (index_name, page_url, content) VALUES ('faiss_1', 'https://example.com/erc', 'ERC payroll credit.')")
+    conn.commit()
+    conn.close()
+
+    init_db()
+
+    docs = lexical_search("faiss_1", "ERC")
+    assert [doc.metadata for doc in docs] == [{'page_url': 'https://example.com/erc', 'chunk_index': 0}]
+
+def test_chat_answers_lexically_when_vectors_unavailable(client, mocker):
+    """Tests that a broken FAISS index no longer forces the static fallback when FTS has hits."""
+    print("Running test: test_chat_answers_lexically_when_vectors_unavailable")
+    from app import insert_knowledge
+    insert_knowledge("faiss_1", [
+        {'url': 'https://example.com/erc', 'content': 'We help businesses claim the ERC payroll credit.'},
+    ])
+    mocker.patch('app.get_active_index_name', return_value="faiss_1")
+    mocker.patch('rag.FAISS.load_local', side_effect=RuntimeError("index folder missing"))
+    mock_llm = mocker.patch('app.ChatGoogleGenerativeAI').return_value
+    mock_llm.invoke.return_value.content = "Yes, we file ERC claims."
+
+    response = client.post('/chat', json={'user_id': 2, 'message': 'Do you do ERC?'})
+
+    assert response.get_json()['response'] == "Yes, we file ERC claims."
+    assert "ERC payroll credit" in mock_llm.invoke.call_args[0][0]
+
+## 9. Guest Intent Routing Tests
+def test_guest_question_skips_agent(client, mocker):
+    """Tests that a plain guest question is answered with one direct LLM call, not the agent."""
+    print("Running test: test_guest_question_skips_agent")
+    mocker.patch('app.get_active_index_name', return_value="fake_index_123")
+    mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    mocker.patch('app.combine_retrieved_chunks', return_value="")
+    mock_llm = mocker.patch('app.ChatGoogleGenerativeAI').return_value
+    mock_llm.invoke.return_value.content = "We offer tax advisory."
+    initialize_agent = mocker.patch('app.initialize_agent')
+
+    response = client.post('/chat', json={'user_id': None, 'message': 'What services do you offer?'})
+
+    assert response.get_json() == {'response': "We offer tax advisory."}
+    initialize_agent.assert_not_called()
+
+def test_guest_signup_opens_dialog_without_llm(client, mocker):
+    """Tests that a clear sign-up request opens the onboarding form before any LLM call."""
+    print("Running test: test_guest_signup_opens_dialog_without_llm")
+    mocker.patch('app.get_active_index_name', return_value="fake_index_123")
+    mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    llm_class = mocker.patch('app.ChatGoogleGenerativeAI')
+
+    response = client.post('/chat', json={'user_id': None, 'message': 'How do I sign up?'})
+
+    assert response.get_json()['action'] == 'open_pii_dialog'
+    llm_class.assert_not_called()
+
+## 10. Metrics Tests
+def test_metrics_endpoint_reports_chat_stages(client, mocker):
+    """Tests that a chat records per-stage timings and counters exported in Prometheus format."""
+    print("Running test: test_metrics_endpoint_reports_chat_stages")
+    mocker.patch('app.get_active_index_name', return_value="fake_index_123")
+    mocker.patch('rag.FAISS.load_local', return_value=mocker.MagicMock())
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    mocker.patch('app.combine_retrieved_chunks', return_value="")
+    mock_llm = mocker.patch('app.ChatGoogleGenerativeAI').return_value
+    mock_llm.invoke.side_effect = RuntimeError("quota exceeded")
+
+    client.post('/chat', json={'user_id': 2, 'message': 'What services do you offer?'})
+    body = client.get('/metrics').get_data(as_text=True)
+
+    assert 'occams_stage_seconds_count{stage="chat"}' in body
+    assert 'occams_stage_seconds_bucket{stage="chat.llm",le="+Inf"}' in body
+    assert 'occams_stage_latency_seconds{stage="db.get_user_name",quantile="0.99"}' in body
+    assert 'occams_events_total{event="llm_error"}' in body
+    assert 'occams_response_cache_hits' in body
+
+## 11. Scrape Pipeline Tests
+def test_pages_are_indexed_while_crawl_is_running(client, mocker, tmp_path):
+    """Tests that pages reach the knowledge table and the index builder before the crawl finishes."""
+    print("Running test: test_pages_are_indexed_while_crawl_is_running")
+    import threading
+    from app import stream_pages_to_index
+    from rag import IndexBuilder, load_index
+    embeddings = fake_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    index_name = str(tmp_path / "faiss_1")
+    first_page_indexed = threading.Event()
+
+    class SignallingBuilder(IndexBuilder):
+        def add_page(self, item):
+            super().add_page(item)
+            first_page_indexed.set()
+    builder = SignallingBuilder(index_name)
+
+    def crawl():
+        yield {'url': 'https://example.com/', 'content': 'Home page about tax credits.'}
+        # the crawler is still "running" when the first page gets indexed
+        assert first_page_indexed.wait(timeout=5)
+        yield {'url': 'https://example.com/erc', 'content': 'We file ERC payroll claims.'}
+
+    assert stream_pages_to_index(crawl(), index_name, builder) == 2
+    stats = builder.finish()
+
+    assert stats['pages_embedded'] == 2
+    conn = sqlite3.connect('database.db')
+    assert conn.execute("SELECT COUNT(*) FROM knowledge WHERE index_name=?", (index_name,)).fetchone()[0] == 2
+    conn.close()
+    store = load_index(index_name, embeddings)
+    doc = store.similarity_search_by_vector(embeddings.embed_query("ERC payroll claims"), k=1)[0]
+    assert doc.metadata['page_url'] == 'https://example.com/erc'
+
+def test_crawl_error_stops_pipeline(client, mocker, tmp_path):
+    """Tests that a crawler failure reaches the caller and the crawler is closed."""
+    print("Running test: test_crawl_error_stops_pipeline")
+    from app import stream_pages_to_index
+    from rag import IndexBuilder
+    mocker.patch('rag.get_embeddings', return_value=fake_embeddings(mocker))
+    closed = []
+
+    def crawl():
+        try:
+            yield {'url': 'https://example.com/', 'content': 'Home page.'}
+            raise RuntimeError("browser crashed")
+        finally:
+            closed.append(True)
+
+    with pytest.raises(RuntimeError, match="browser crashed"):
+        stream_pages_to_index(crawl(), str(tmp_path / "faiss_1"), IndexBuilder(str(tmp_path / "faiss_1")))
+    assert closed == [True]
+
+
+def test_knowledge_keeps_page_validators(client, mocker):
+    """Tests that old knowledge tables gain the validator columns and pages round-trip through page_validators."""
+    print("Running test: test_knowledge_keeps_page_validators")
+    from app import insert_knowledge, page_validators
+    conn = sqlite3.connect('database.db')
+    conn.execute("DROP TABLE knowledge")
+    conn.execute("CREATE TABLE knowledge (id INTEGER PRIMARY KEY, index_name TEXT, page_url TEXT, content TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    conn.commit()
+    conn.close()
+    init_db()
+
+    insert_knowledge("faiss_1", [
+        {'url': 'https://example.com/', 'title': 'Home', 'content': 'Home page.', 'etag': '"abc"',
+         'last_modified': 'Wed, 01 Jan 2025 00:00:00 GMT', 'content_hash': 'f00d'},
+        {'url': 'https://example.com/erc', 'content': 'ERC claims.'},
+    ])
+    pages = page_validators("faiss_1")
+    assert pages['https://example.com/']['etag'] == '"abc"'
+    assert pages['https://example.com/']['content_hash'] == 'f00d'
+    assert pages['https://example.com/']['title'] == 'Home'
+    assert pages['https://example.com/erc'] == {'url': 'https://example.com/erc', 'title': None, 'content': 'ERC claims.',
+                                                'etag': None, 'last_modified': None, 'content_hash': None}
+    assert page_validators("faiss_2") == {}
+
+def test_interrupted_scrape_resumes_into_same_index(client, mocker, tmp_path):
+    """Tests that a scrape left unfinished is resumed under its index name, keeping the pages it already stored."""
+    print("Running test: test_interrupted_scrape_resumes_into_same_index")
+    import app as backend
+    from app import insert_knowledge, set_crawl_checkpoint, crawl_checkpoint, run_scraper_background
+    from rag import load_index
+    embeddings = fake_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    index_name = str(tmp_path / "faiss_1")
+    insert_knowledge(index_name, [{'url': 'https://example.com/', 'content': 'Home page about tax credits.'}])
+    set_crawl_checkpoint(index_name)
+    frontiers = []
+
+    def crawl(frontier=None, **kwargs):
+        frontiers.append(frontier)
+        yield {'url': 'https://example.com/erc', 'content': 'We file ERC payroll claims.'}
+    mocker.patch.object(backend, 'SCRAPER_MODE', 'http')
+    mocker.patch('app.iter_pages_http', side_effect=crawl)
+
+    run_scraper_background()
+
+    assert frontiers[0].crawl_id == index_name
+    assert "Resumed an interrupted crawl" in backend.scraping_status["progress"]
+    assert crawl_checkpoint() == ""
+    store = load_index(index_name, embeddings)
+    assert {doc.metadata['page_url'] for doc in store.docstore.search_many(range(store.index.ntotal))} == \
+        {'https://example.com/', 'https://example.com/erc'}
+
+
+## 12. Index Activation Tests
+def test_activation_warms_up_with_recent_questions(client, mocker):
+    """Tests that recent questions are replayed against the new index before it becomes active."""
+    print("Running test: test_activation_warms_up_with_recent_questions")
+    from app import log_chat, get_active_index_name
+    embeddings = fake_embeddings(mocker)
+    store = fake_store(embeddings)
+    mocker.patch('rag.FAISS.load_local', return_value=store)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    search = mocker.spy(store, 'similarity_search_by_vector')
+    log_chat(2, "What services do you offer?", False)
+    log_chat(2, "We offer tax advisory.", True)
+    log_chat(2, "Do you file ERC claims?", False)
+
+    client.post('/set_active_index', json={'user_id': 1, 'index_name': 'faiss_1'})
+    status = wait_for_activation(client)
+
+    assert status['stage'] == 'active'
+    assert status['timings']['warmup_queries'] == 2
+    assert {'load_ms', 'validate_ms', 'warmup_ms', 'first_query_ms'} <= set(status['timings'])
+    assert search.call_count == 2
+    assert get_active_index_name() == 'faiss_1'
+    assert retrieval_engine.peek('faiss_1') is store
+
+def test_broken_index_is_never_activated(client, mocker):
+    """Tests that an index failing validation leaves the active index and loaded store alone."""
+    print("Running test: test_broken_index_is_never_activated")
+    from app import set_active_index, get_active_index_name
+    embeddings = fake_embeddings(mocker)
+    good, broken = fake_store(embeddings), fake_store(embeddings)
+    broken.index_to_docstore_id = {}
+    set_active_index('faiss_1')
+    retrieval_engine.install('faiss_1', good)
+    mocker.patch('rag.FAISS.load_local', return_value=broken)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+
+    client.post('/set_active_index', json={'user_id': 1, 'index_name': 'faiss_2'})
+    status = wait_for_activation(client)
+
+    assert status['stage'] == 'failed'
+    assert "chunk ids" in status['error']
+    assert get_active_index_name() == 'faiss_1'
+    assert retrieval_engine.peek('faiss_1') is good
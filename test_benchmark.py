@@ -0,0 +1,41 @@
+import os
+from benchmark import compare, generate_corpus, generate_queries, run_benchmark
+
+
+## 1. Regression Check Tests
+def test_compare_flags_only_real_regressions():
+    """Tests that slowdowns and recall drops beyond the tolerance are flagged, and improvements are not."""
+    print("Running test: test_compare_flags_only_real_regressions")
+    baseline = {"build_seconds": 10.0, "build_chunks_per_sec": 100.0, "vector_recall_at_k": 0.90,
+                "chat_p99_ms": 50.0, "build_chunks": 300}
+    current = {"build_seconds": 13.0, "build_chunks_per_sec": 150.0, "vector_recall_at_k": 0.85,
+               "chat_p99_ms": 55.0, "build_chunks": 200}
+
+    regressions = {r["metric"]: r for r in compare(current, baseline, tolerance=0.2, recall_tolerance=0.01)}
+
+    assert set(regressions) == {"build_seconds", "vector_recall_at_k"}
+    assert regressions["build_seconds"]["change"] == 0.3
+
+
+## 2. Benchmark Run Tests
+def test_corpus_is_reproducible():
+    """Tests that the same seed gives the same corpus and queries, so runs are comparable."""
+    print("Running test: test_corpus_is_reproducible")
+    corpus = generate_corpus(pages=10, seed=3)
+    assert corpus == generate_corpus(pages=10, seed=3)
+    assert generate_queries(corpus, 5, seed=4) == generate_queries(generate_corpus(pages=10, seed=3), 5, seed=4)
+
+def test_small_benchmark_run_reports_every_metric(tmp_path):
+    """Tests an end-to-end run on a tiny corpus, offline, leaving the working directory unchanged."""
+    print("Running test: test_small_benchmark_run_reports_every_metric")
+    cwd = os.getcwd()
+    corpus = generate_corpus(pages=20)
+
+    results = run_benchmark(corpus, generate_queries(corpus, 10), workdir=str(tmp_path))
+
+    assert os.getcwd() == cwd
+    for metric in ("extract_ms_per_page", "extracted_bytes_per_page", "build_seconds", "build_chunks_per_sec", "index_disk_bytes", "load_seconds",
+                   "vector_query_p50_ms", "vector_query_p99_ms", "chat_p50_ms", "chat_p99_ms", "vector_recall_at_k"):
+        assert results[metric] is not None
+    assert results["vector_recall_at_k"] > 0.5
+    assert results["extracted_bytes_per_page"] < results["text_bytes_per_page"]
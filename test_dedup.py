@@ -0,0 +1,25 @@
+from dedup import BoilerplateFilter, NearDuplicateIndex
+
+
+## 1. Boilerplate Tests
+def test_lines_on_many_pages_become_boilerplate():
+    """Tests that a line is stripped once it has been seen on min_pages pages, and not before."""
+    print("Running test: test_lines_on_many_pages_become_boilerplate")
+    boilerplate = BoilerplateFilter(min_pages=3)
+    assert boilerplate.clean("Home\nAbout\nWe file ERC claims.") == "Home\nAbout\nWe file ERC claims."
+    assert boilerplate.clean("Home\nAbout\nTax planning for small business.") == "Home\nAbout\nTax planning for small business."
+    assert boilerplate.clean("Home\nAbout\nContact our team.") == "Contact our team."
+    assert sorted(boilerplate.lines()) == ["About", "Home"]
+
+
+## 2. Near-Duplicate Tests
+def test_near_duplicate_chunks_are_collapsed():
+    """Tests that a chunk differing by a word is a duplicate, while a different chunk is kept."""
+    print("Running test: test_near_duplicate_chunks_are_collapsed")
+    index = NearDuplicateIndex(threshold=0.8)
+    text = ("Occams Advisory helps growing businesses with tax credits, payroll, accounting, "
+            "capital raising and strategic growth advice from a team of experienced advisors.")
+    assert index.add(text)
+    assert not index.add(text)
+    assert not index.add(text.replace("experienced", "seasoned"))
+    assert index.add("The Employee Retention Credit is a refundable payroll tax credit for eligible employers.")
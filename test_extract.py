@@ -0,0 +1,131 @@
+import pytest
+from extract import MainContentExtractor, TextExtractor, get_extractor, chunk_sections
+
+PARAGRAPH = "Our advisors help growing businesses claim tax credits and plan their payroll. " * 4
+
+PAGE = f"""<html><head><title>ERC Services | Occams</title><style>p {{ color: red }}</style>
+<script>window.dataLayer = [];</script></head><body>
+<header class="site-header"><a href="/">Home</a><nav><ul><li><a href="/services">Services</a></li>
+<li><a href="/about">About</a></li><li><a href="/contact">Contact</a></li></ul></nav></header>
+<div id="cookie-consent">We use cookies to improve your experience. <a href="/privacy">Privacy</a></div>
+<main>
+  <article>
+    <header><h1>Employee Retention Credit</h1></header>
+    <p>{PARAGRAPH}<a href="erc/apply">Apply</a> today.</p>
+    <h2>Who qualifies</h2>
+    <ul><li>Employers with <em>W-2</em> staff</li><li>A revenue decline in 2020 or 2021</li></ul>
+    <table><tr><th>Year</th><th>Max credit</th></tr><tr><td>2021</td><td>$7,000</td></tr></table>
+    <div class="tags"><a href="/t/erc">ERC</a> <a href="/t/tax">Tax</a> <a href="/t/payroll">Payroll</a></div>
+  </article>
+  <aside><h3>Related</h3><a href="/blog/post">Read our blog</a></aside>
+</main>
+<footer><p>© Occams Advisory. All rights reserved.</p><a href="mailto:hi@example.com">Email</a>
+<a href="tel:123">Call</a></footer>
+</body></html>"""
+
+
+## 1. Main Content Extraction Tests
+def test_main_content_keeps_structure_and_drops_chrome():
+    """Tests that headings, lists and tables are kept as markup while menus, banners, tags and footers go."""
+    print("Running test: test_main_content_keeps_structure_and_drops_chrome")
+    page = MainContentExtractor().extract(PAGE, "https://example.com/services/erc")
+
+    assert page["title"] == "ERC Services | Occams"
+    assert page["content"].split("\n") == [
+        "# Employee Retention Credit",
+        f"{PARAGRAPH.strip()} Apply today.",
+        "## Who qualifies",
+        "- Employers with W-2 staff",
+        "- A revenue decline in 2020 or 2021",
+        "Year | Max credit",
+        "2021 | $7,000",
+    ]
+
+def test_links_come_from_the_same_parse():
+    """Tests that links are collected before chrome is dropped, resolved against the page URL."""
+    print("Running test: test_links_come_from_the_same_parse")
+    links = MainContentExtractor().extract(PAGE, "https://example.com/services/erc")["links"]
+
+    assert "https://example.com/services" in links # from the dropped menu
+    assert "https://example.com/services/erc/apply" in links
+    assert "https://example.com/blog/post" in links
+    assert not any(link.startswith(("mailto:", "tel:")) for link in links)
+    assert links == TextExtractor().extract(PAGE, "https://example.com/services/erc")["links"]
+
+def test_main_content_is_smaller_than_whole_page_text():
+    """Tests that the main content stores far fewer bytes than the whole-page text it replaces."""
+    print("Running test: test_main_content_is_smaller_than_whole_page_text")
+    menu = "".join(f"<li><a href='/p{i}'>Menu entry {i}</a></li>" for i in range(60))
+    html = PAGE.replace("<nav><ul>", f"<nav><ul>{menu}")
+    main = MainContentExtractor().extract(html, "https://example.com/")["content"]
+    text = TextExtractor().extract(html, "https://example.com/")["content"]
+
+    assert "Menu entry" in text and "Menu entry" not in main
+    assert len(main.encode()) < 0.5 * len(text.encode())
+
+def test_page_without_main_falls_back_to_body():
+    """Tests that pages without <main> or <article> keep their body text, and broken input yields nothing."""
+    print("Running test: test_page_without_main_falls_back_to_body")
+    html = f"<html><body><div class='menu'><a href='/'>Home</a></div><h2>Contact</h2><p>{PARAGRAPH}</p></body></html>"
+    assert MainContentExtractor().extract(html, "https://example.com/")["content"] == f"## Contact\n{PARAGRAPH.strip()}"
+    assert MainContentExtractor().extract("", "https://example.com/")["content"] == ""
+
+
+def test_xhtml_page_with_encoding_declaration_is_extracted(capsys):
+    """Tests that a decoded XHTML page starting with an <?xml encoding?> declaration still yields its content."""
+    print("Running test: test_xhtml_page_with_encoding_declaration_is_extracted")
+    html = ('<?xml version="1.0" encoding="ISO-8859-1"?>\n<html xmlns="http://www.w3.org/1999/xhtml">'
+            f'<head><title>Café</title></head><body><main><h1>Résumé</h1><p>{PARAGRAPH}</p>'
+            '<a href="/next">Next</a></main></body></html>')
+
+    page = MainContentExtractor().extract(html, "https://example.com/")
+
+    assert page["title"] == "Café"
+    assert page["content"].startswith(f"# Résumé\n{PARAGRAPH.strip()}")
+    assert page["links"] == ["https://example.com/next"]
+    assert "Can't parse" not in capsys.readouterr().out
+
+def test_page_builder_widgets_are_kept():
+    """Tests that page-builder wrapper classes containing a chrome word (elementor-widget-*) don't drop the content."""
+    print("Running test: test_page_builder_widgets_are_kept")
+    widget = '<div class="elementor-element elementor-widget elementor-widget-{kind}"><div class="elementor-widget-container">{body}</div></div>'
+    html = ("<html><body><div class='elementor-section'>"
+            + widget.format(kind="heading", body="<h2>Payroll services</h2>")
+            + "".join(widget.format(kind="text-editor", body=f"<p>Part {i}. {PARAGRAPH}</p>") for i in range(3))
+            + widget.format(kind="nav-menu", body="<div class='menu-main'>Home Services Contact</div>")
+            + "</div></body></html>")
+
+    content = MainContentExtractor().extract(html, "https://example.com/")["content"]
+
+    assert content.startswith("## Payroll services\nPart 0.")
+    assert all(f"Part {i}." in content for i in range(3))
+    assert "Home Services" not in content
+
+def test_inline_body_text_is_kept():
+    """Tests that text directly in <body>, or after the last block, is written out."""
+    print("Running test: test_inline_body_text_is_kept")
+    extract = MainContentExtractor().extract
+    assert extract("<html><body>Hello <b>world</b> this is plain text</body></html>", "https://example.com/")["content"] \
+        == "Hello world this is plain text"
+    assert extract("<html><body><div>a block</div>trailing text</body></html>", "https://example.com/")["content"] \
+        == "a block\ntrailing text"
+    assert extract("<html><body><main><p>Inside</p></main>after main</body></html>", "https://example.com/")["content"] \
+        == "Inside"
+
+## 2. Extractor Registry and Section Tests
+def test_get_extractor_by_name():
+    """Tests that extractors are looked up by name and unknown names are rejected."""
+    print("Running test: test_get_extractor_by_name")
+    assert isinstance(get_extractor("main"), MainContentExtractor)
+    assert isinstance(get_extractor("text"), TextExtractor)
+    extractor = TextExtractor()
+    assert get_extractor(extractor) is extractor
+    with pytest.raises(ValueError, match="Unknown extractor"):
+        get_extractor("readability")
+
+def test_chunk_sections_follow_headings():
+    """Tests that every chunk is labelled with the last heading before it."""
+    print("Running test: test_chunk_sections_follow_headings")
+    content = "Intro line.\n# Services\nWe file credits.\n## Pricing\nFlat fee.\nNo hidden costs."
+    chunks = ["Intro line.", "# Services\nWe file credits.", "We file credits.\n## Pricing\nFlat fee.", "No hidden costs."]
+    assert chunk_sections(content, chunks) == ["", "Services", "Services", "Pricing"]
@@ -0,0 +1,30 @@
+from intent import IntentRouter
+
+
+def keyword_embeddings(texts):
+    """Two-dimensional embeddings: [mentions a client relationship, mentions leaving]."""
+    return [[float("client" in t or "work with" in t), float("later" in t or "day" in t)] for t in texts]
+
+
+## 1. Intent Classification Tests
+def test_rules_decide_clear_intents():
+    """Tests that short, unambiguous messages are classified by the keyword rules alone."""
+    print("Running test: test_rules_decide_clear_intents")
+    router = IntentRouter(keyword_embeddings)
+    assert router.classify("I want to sign up") == "onboarding"
+    assert router.classify("Thanks, bye!") == "goodbye"
+    assert router.classify("What services do you offer?") == "other"
+
+def test_negated_or_long_rule_matches_are_ambiguous():
+    """Tests that rule matches the router can't be sure about are left to the agent."""
+    print("Running test: test_negated_or_long_rule_matches_are_ambiguous")
+    router = IntentRouter(keyword_embeddings)
+    assert router.classify("I don't want to sign up yet") == "ambiguous"
+    assert router.classify("thanks, and what do you charge for a full tax review?") == "ambiguous"
+
+def test_nearest_example_decides_without_keywords():
+    """Tests the embedding check for messages with no keyword."""
+    print("Running test: test_nearest_example_decides_without_keywords")
+    router = IntentRouter(keyword_embeddings, threshold=0.9)
+    assert router.classify("could I become a client", query_vector=[1.0, 0.0]) == "onboarding"
+    assert router.classify("what are your fees", query_vector=[0.0, 0.0]) == "other"
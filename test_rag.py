@@ -0,0 +1,459 @@
+import pytest
+import os
+import sqlite3
+import threading
+import time
+from rag import EmbeddingBatcher
+
+
+## 1. Query Embedding Batching Tests
+def test_batcher_groups_concurrent_queries():
+    """Tests that queries arriving together are encoded in one call and each caller gets its own vector."""
+    print("Running test: test_batcher_groups_concurrent_queries")
+    calls = []
+    def embed_documents(texts):
+        calls.append(list(texts))
+        time.sleep(0.01)
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(embed_documents, max_batch_size=8, max_wait=0.05)
+    results = {}
+    def ask(text):
+        results[text] = batcher.embed(text)
+
+    threads = [threading.Thread(target=ask, args=("q" * n,)) for n in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(results["q" * n] == [float(n)] for n in range(1, 9))
+    assert len(calls) < 8
+    stats = batcher.stats()
+    assert stats["queries"] == 8
+    assert stats["batches"] == len(calls)
+
+def test_batcher_passes_errors_to_callers():
+    """Tests that a failed forward pass raises in every waiting caller."""
+    print("Running test: test_batcher_passes_errors_to_callers")
+    def embed_documents(texts):
+        raise RuntimeError("model not loaded")
+
+    batcher = EmbeddingBatcher(embed_documents, max_wait=0.001)
+    try:
+        batcher.embed("hello")
+        assert False, "expected the model error"
+    except RuntimeError as e:
+        assert "model not loaded" in str(e)
+
+
+## 2. Rank Fusion Tests
+def test_reciprocal_rank_fusion_prefers_documents_in_both_lists():
+    """Tests that a chunk ranked by both retrievers beats chunks found by only one."""
+    print("Running test: test_reciprocal_rank_fusion_prefers_documents_in_both_lists")
+    from langchain_core.documents import Document
+    from rag import reciprocal_rank_fusion
+    vector = [Document(page_content="a"), Document(page_content="b")]
+    lexical = [Document(page_content="c"), Document(page_content="b")]
+
+    fused = reciprocal_rank_fusion([vector, lexical])
+
+    assert [doc.page_content for doc in fused] == ["b", "a", "c"]
+
+    # chunks are matched on page and chunk position when both retrievers report them
+    chunk = {'page_url': 'https://example.com/', 'chunk_index': 1}
+    vector = [Document(page_content="x", metadata={'page_url': 'https://example.com/', 'chunk_index': 0}),
+              Document(page_content="Tax credits", metadata=chunk)]
+    lexical = [Document(page_content="y"), Document(page_content="Tax credits\n", metadata=chunk)]
+
+    assert [doc.page_content for doc in reciprocal_rank_fusion([vector, lexical])] == ["Tax credits", "x", "y"]
+
+
+## 3. Context Packing Tests
+def test_combine_drops_overlap_between_chunks_of_a_page():
+    """Tests that text repeated by the splitter's chunk overlap reaches the prompt once."""
+    print("Running test: test_combine_drops_overlap_between_chunks_of_a_page")
+    from langchain_core.documents import Document
+    from rag import combine_retrieved_chunks
+    shared = "Our team files Employee Retention Credit claims for small businesses."
+    first = Document(page_content="Occams Advisory helps growing companies. " + shared, metadata={'page_url': 'a'})
+    second = Document(page_content=shared + " We also offer tax advisory.", metadata={'page_url': 'a'})
+    other_page = Document(page_content=shared, metadata={'page_url': 'b'})
+
+    context = combine_retrieved_chunks([first, second])
+    assert context.count(shared) == 1
+    assert context.endswith("We also offer tax advisory.")
+
+    # identical text on a different page is not treated as overlap
+    assert combine_retrieved_chunks([first, other_page]).count(shared) == 2
+
+def test_combine_respects_token_budget_in_relevance_order():
+    """Tests that the most relevant chunks fill the budget and the rest are left out."""
+    print("Running test: test_combine_respects_token_budget_in_relevance_order")
+    from langchain_core.documents import Document
+    from rag import combine_retrieved_chunks, estimate_tokens
+    chunks = [Document(page_content=f"chunk {i} " + "word " * 40) for i in range(5)]
+
+    context = combine_retrieved_chunks(chunks, token_budget=120)
+
+    assert estimate_tokens(context) <= 125
+    assert context.startswith("chunk 0")
+    assert "chunk 4" not in context
+
+
+## 4. Incremental Build Tests
+@pytest.fixture
+def knowledge_db(tmp_path, monkeypatch):
+    """Points every sqlite3.connect at a fresh database in tmp_path."""
+    import sqlite3
+    from app import init_db
+    original_connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, 'connect', lambda db_name, *a, **kw: original_connect(str(tmp_path / "test.db"), *a, **kw))
+    init_db()
+    return tmp_path
+
+
+def counting_embeddings(mocker):
+    """Deterministic embeddings that remember every text they were asked to embed."""
+    embedded = []
+    def embed_documents(texts):
+        embedded.extend(texts)
+        return [[float(len(t)), float(sum(map(ord, t)) % 97), 1.0] for t in texts]
+    embeddings = mocker.MagicMock()
+    embeddings.embed_documents.side_effect = embed_documents
+    embeddings.embed_query.side_effect = lambda text: embed_documents([text])[0]
+    return embeddings, embedded
+
+
+def test_incremental_build_embeds_only_changed_pages(knowledge_db, mocker):
+    """Tests that unchanged pages keep their vectors, changed/new pages are embedded and removed pages dropped."""
+    print("Running test: test_incremental_build_embeds_only_changed_pages")
+    from app import insert_knowledge
+    from rag import build_faiss_index, load_index
+    embeddings, embedded = counting_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+
+    first = str(knowledge_db / "faiss_1")
+    pages_v1 = [
+        {'url': 'https://example.com/', 'content': 'Home page of Occams Advisory.'},
+        {'url': 'https://example.com/erc', 'content': 'ERC claims, old wording.'},
+        {'url': 'https://example.com/old', 'content': 'A page that was removed.'},
+    ]
+    insert_knowledge(first, pages_v1)
+    build_faiss_index(first, pages_v1)
+
+    second = str(knowledge_db / "faiss_2")
+    pages_v2 = [
+        pages_v1[0],
+        {'url': 'https://example.com/erc', 'content': 'ERC claims, new wording.'},
+        {'url': 'https://example.com/new', 'content': 'A brand new page.'},
+    ]
+    insert_knowledge(second, pages_v2)
+    embedded.clear()
+    stats = build_faiss_index(second, pages_v2, previous_index=first)
+
+    assert embedded == ['ERC claims, new wording.', 'A brand new page.']
+    assert stats['pages_reused'] == 1 and stats['pages_embedded'] == 2 and stats['pages_removed'] == 1
+    assert stats['chunks_reused'] == 1 and stats['chunks_embedded'] == 2
+    store = load_index(second, embeddings)
+    contents = [store.docstore.search(i).page_content for i in store.index_to_docstore_id.values()]
+    assert contents == ['Home page of Occams Advisory.', 'ERC claims, new wording.', 'A brand new page.']
+
+
+
+## 5. Embedding Cache Tests
+def test_rebuild_from_unchanged_pages_hits_embedding_cache(knowledge_db, mocker):
+    """Tests that a full (non-incremental) rebuild of the same pages takes every vector from the cache."""
+    print("Running test: test_rebuild_from_unchanged_pages_hits_embedding_cache")
+    from rag import build_faiss_index, embedding_cache
+    embeddings, embedded = counting_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    pages = [
+        {'url': 'https://example.com/', 'content': 'Home page of Occams Advisory.'},
+        {'url': 'https://example.com/erc', 'content': 'ERC claims for small businesses.'},
+    ]
+
+    build_faiss_index(str(knowledge_db / "faiss_1"), pages)
+    assert len(embedded) == 2
+    stats = build_faiss_index(str(knowledge_db / "faiss_2"), pages)
+
+    assert len(embedded) == 2
+    assert stats['chunks_from_cache'] == 2
+    assert embedding_cache.stats()['entries'] == 2
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path):
+    """Tests size-based eviction keeps the most recently used vectors."""
+    print("Running test: test_embedding_cache_evicts_least_recently_used")
+    from embedding_cache import EmbeddingCache
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), "model", max_bytes=2 * 4 * 4)  # two 4-dim vectors
+    cache.put_many(["a"], [[1.0, 0.0, 0.0, 0.0]])
+    cache.put_many(["b"], [[0.0, 1.0, 0.0, 0.0]])
+    cache.get_many(["a"])
+    cache.put_many(["c"], [[0.0, 0.0, 1.0, 0.0]])
+
+    assert cache.get_many(["a", "b", "c"]) == [[1.0, 0.0, 0.0, 0.0], None, [0.0, 0.0, 1.0, 0.0]]
+    assert cache.stats()['evictions'] == 1
+
+def test_embedding_cache_scans_only_when_over_limit(tmp_path, mocker):
+    """Tests that writes below max_bytes never run the eviction scan, and replacing a vector doesn't grow the total."""
+    print("Running test: test_embedding_cache_scans_only_when_over_limit")
+    from embedding_cache import EmbeddingCache
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), "model", max_bytes=3 * 4 * 4)  # three 4-dim vectors
+    evict = mocker.spy(cache, "_evict")
+    for text in ["a", "b", "a", "c", "c"]:
+        cache.put_many([text], [[1.0, 2.0, 3.0, 4.0]])
+    assert evict.call_count == 0
+    assert cache.stats()['bytes'] == 3 * 4 * 4
+
+    cache.put_many(["d"], [[1.0, 2.0, 3.0, 4.0]])
+    assert evict.call_count == 1
+    assert cache.stats()['entries'] == 3
+    cache.put_many(["d"], [[4.0, 3.0, 2.0, 1.0]])
+    assert evict.call_count == 1
+
+
+## 6. Parallel Embedding Tests
+class LengthEmbeddings:
+    """Stand-in model for worker processes: vector = [len(text), first char code]."""
+    def __init__(self, model_name):
+        self.model_name = model_name
+    def embed_documents(self, texts):
+        return [[float(len(t)), float(ord(t[0]))] for t in texts]
+
+
+def test_parallel_embeddings_keep_chunk_order():
+    """Tests that vectors sharded over worker processes come back in the original order."""
+    print("Running test: test_parallel_embeddings_keep_chunk_order")
+    from rag import ParallelEmbeddings
+    texts = [chr(ord('a') + i) * (i + 1) for i in range(10)]
+
+    vectors = ParallelEmbeddings(workers=2, batch_size=3, factory=LengthEmbeddings).embed_documents(texts)
+
+    assert vectors == LengthEmbeddings("m").embed_documents(texts)
+
+
+class CountingEmbeddings(LengthEmbeddings):
+    """LengthEmbeddings that appends a line to the file named by model_name each time a worker loads it."""
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        with open(model_name, "a") as f:
+            f.write("loaded\n")
+
+
+def test_parallel_embeddings_load_model_once_per_worker(knowledge_db, mocker):
+    """Tests that an index build keeps one worker pool across flushes and shuts it down in finish()."""
+    print("Running test: test_parallel_embeddings_load_model_once_per_worker")
+    from rag import IndexBuilder, ParallelEmbeddings
+    loads = knowledge_db / "loads.txt"
+    mocker.patch('rag.ParallelEmbeddings', side_effect=lambda workers, batch_size: ParallelEmbeddings(
+        workers, batch_size, model_name=str(loads), factory=CountingEmbeddings))
+    builder = IndexBuilder(str(knowledge_db / "faiss_1"), workers=2, batch_size=1, near_duplicate_threshold=0)
+
+    for i in range(6):
+        builder.add_page({'url': f'https://example.com/{i}', 'content': f'page {i} ' * (i + 1)})
+    pool = builder.model._pool
+    builder.finish()
+
+    assert builder.stats['chunks_embedded'] == 6
+    assert 1 <= len(loads.read_text().splitlines()) <= 2
+    assert builder.model._pool is None and pool._shutdown_thread
+
+
+## 7. Index Type Tests
+def random_embeddings(mocker, dim=16):
+    """Deterministic pseudo-random vectors per text."""
+    import zlib
+    import numpy as np
+    def embed_documents(texts):
+        return [np.random.default_rng(zlib.crc32(t.encode())).normal(size=dim).tolist() for t in texts]
+    embeddings = mocker.MagicMock()
+    embeddings.embed_documents.side_effect = embed_documents
+    embeddings.embed_query.side_effect = lambda text: embed_documents([text])[0]
+    return embeddings
+
+
+@pytest.mark.parametrize("spec, index_class", [
+    ("hnsw:m=8", "IndexHNSWFlat"),
+    ("ivf_flat:nlist=4,nprobe=2", "IndexIVFFlat"),
+    ("ivf_pq:nlist=4,m=4,nbits=4,nprobe=2", "IndexIVFPQ"),
+])
+def test_build_with_index_spec_saves_type_and_recall(knowledge_db, mocker, spec, index_class):
+    """Tests that approximate index types are built, saved with their spec and recall, and reloaded with it."""
+    print("Running test: test_build_with_index_spec_saves_type_and_recall")
+    from rag import build_faiss_index, load_index, read_index_spec
+    embeddings = random_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    pages = [{'url': f'https://example.com/{i}', 'content': f'page number {i}'} for i in range(300)]
+    index_name = str(knowledge_db / "faiss_1")
+
+    stats = build_faiss_index(index_name, pages, index_spec=spec)
+
+    assert 0.0 < stats['recall_at_10'] <= 1.0
+    saved = read_index_spec(index_name)
+    assert saved['kind'] == spec.split(":")[0]
+    store = load_index(index_name, embeddings)
+    assert type(store.index).__name__ == index_class
+    query = embeddings.embed_query("page number 7")
+    assert store.similarity_search_by_vector(query, k=1)[0].page_content == "page number 7"
+
+def test_parse_index_spec_rejects_unknown_types():
+    """Tests that typos in the index spec fail loudly instead of building a flat index."""
+    print("Running test: test_parse_index_spec_rejects_unknown_types")
+    from rag import parse_index_spec
+    assert parse_index_spec("hnsw:m=16") == ("hnsw", {"m": 16, "ef_construction": 64, "ef_search": 64})
+    with pytest.raises(ValueError):
+        parse_index_spec("annoy")
+    with pytest.raises(ValueError):
+        parse_index_spec("hnsw:nlist=4")
+
+
+## 8. Storage Format Tests
+@pytest.mark.parametrize("storage", ["mmap", "pickle"])
+def test_storage_formats_load_and_search(knowledge_db, mocker, storage):
+    """Tests that both storage formats round-trip chunks, metadata and search results."""
+    print("Running test: test_storage_formats_load_and_search")
+    from rag import build_faiss_index, load_index, SQLiteDocstore
+    embeddings = random_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    pages = [{'url': f'https://example.com/{i}', 'content': f'page number {i}'} for i in range(20)]
+    index_name = str(knowledge_db / "faiss_1")
+
+    build_faiss_index(index_name, pages, storage=storage)
+    store = load_index(index_name, embeddings)
+
+    assert os.path.exists(os.path.join(index_name, "index.pkl")) == (storage == "pickle")
+    assert isinstance(store.docstore, SQLiteDocstore) == (storage == "mmap")
+    doc = store.similarity_search_by_vector(embeddings.embed_query("page number 12"), k=1)[0]
+    assert doc.page_content == "page number 12"
+    assert doc.metadata == {'page_url': 'https://example.com/12', 'chunk_index': 0}
+
+def test_mmap_search_reads_all_hits_in_one_query(knowledge_db, mocker):
+    """Tests that a search over an mmap index opens one connection for all of its hits."""
+    print("Running test: test_mmap_search_reads_all_hits_in_one_query")
+    from rag import build_faiss_index, load_index
+    embeddings = random_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    pages = [{'url': f'https://example.com/{i}', 'content': f'page number {i}'} for i in range(20)]
+    index_name = str(knowledge_db / "faiss_1")
+    build_faiss_index(index_name, pages, storage="mmap")
+    store = load_index(index_name, embeddings)
+
+    connect = mocker.spy(sqlite3, 'connect')
+    docs = store.similarity_search_by_vector(embeddings.embed_query("page number 12"), k=8)
+    filtered = store.similarity_search_by_vector(embeddings.embed_query("page number 12"), k=2,
+                                                 filter={'page_url': 'https://example.com/3'})
+
+    assert len(docs) == 8 and docs[0].page_content == "page number 12"
+    assert [doc.page_content for doc in filtered] == ["page number 3"]
+    assert connect.call_count == 2
+
+def test_delete_index_drops_stored_chunks(knowledge_db, mocker):
+    """Tests that deleting an mmap index removes its chunk rows too."""
+    print("Running test: test_delete_index_drops_stored_chunks")
+    from app import delete_index
+    from rag import build_faiss_index, SQLiteDocstore
+    mocker.patch('rag.get_embeddings', return_value=random_embeddings(mocker))
+    index_name = str(knowledge_db / "faiss_1")
+    build_faiss_index(index_name, [{'url': 'https://example.com/', 'content': 'Home page.'}])
+
+    delete_index(index_name)
+
+    assert SQLiteDocstore(index_name).search_many(["0"]) == [None]
+    assert not os.path.exists(index_name)
+
+
+## 9. Quantized Vector Tests
+@pytest.mark.parametrize("spec, max_ratio", [("sq8", 0.3), ("sq_fp16", 0.55)])
+def test_quantized_index_reranks_with_full_vectors(knowledge_db, mocker, spec, max_ratio):
+    """Tests that scalar-quantized indexes shrink the vectors and re-score the shortlist exactly."""
+    print("Running test: test_quantized_index_reranks_with_full_vectors")
+    import numpy as np
+    from rag import build_faiss_index, load_index, read_index_spec, RerankedIndex
+    embeddings = random_embeddings(mocker, dim=32)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    pages = [{'url': f'https://example.com/{i}', 'content': f'page number {i}'} for i in range(300)]
+    index_name = str(knowledge_db / "faiss_1")
+
+    stats = build_faiss_index(index_name, pages, index_spec=spec)
+
+    assert stats['index_bytes'] < max_ratio * stats['float32_bytes']
+    assert stats['recall_at_10'] >= stats['recall_at_10_before_rerank']
+    assert read_index_spec(index_name)['index_bytes'] == stats['index_bytes']
+    store = load_index(index_name, embeddings)
+    assert isinstance(store.index, RerankedIndex)
+    assert isinstance(store.index.vectors, np.memmap)
+    query = embeddings.embed_query("page number 7")
+    doc, distance = store.similarity_search_with_score_by_vector(query, k=1)[0]
+    assert doc.page_content == "page number 7"
+    assert distance == pytest.approx(0.0, abs=1e-4)
+
+def test_rebuild_reuses_full_vectors_of_quantized_index(knowledge_db, mocker):
+    """Tests that unchanged pages of a quantized index keep their full-precision vectors."""
+    print("Running test: test_rebuild_reuses_full_vectors_of_quantized_index")
+    from app import insert_knowledge
+    from rag import build_faiss_index
+    embeddings, embedded = counting_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    mocker.patch('rag.embedding_cache.get_many', side_effect=lambda texts: [None] * len(texts))
+    pages = [{'url': f'https://example.com/{i}', 'content': f'page number {i}'} for i in range(50)]
+    first, second = str(knowledge_db / "faiss_1"), str(knowledge_db / "faiss_2")
+    insert_knowledge(first, pages)
+    build_faiss_index(first, pages, index_spec="sq8")
+    insert_knowledge(second, pages)
+    embedded.clear()
+
+    stats = build_faiss_index(second, pages, previous_index=first, index_spec="sq8")
+
+    assert stats['chunks_reused'] == 50
+    assert embedded == []
+
+
+## 10. De-duplication Tests
+def test_build_drops_site_chrome_and_duplicate_chunks(knowledge_db, mocker):
+    """Tests that menus repeated on every page are indexed once, for vector and lexical search, and duplicate pages are not embedded."""
+    print("Running test: test_build_drops_site_chrome_and_duplicate_chunks")
+    from app import insert_knowledge, lexical_search
+    from rag import build_faiss_index, load_index
+    embeddings, embedded = counting_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    mocker.patch('rag.embedding_cache.get_many', side_effect=lambda texts: [None] * len(texts))
+    menu = "Home\nServices\nAbout Us\nContact\nAccept cookies"
+    pages = [{'url': f'https://example.com/{i}', 'content': f"{menu}\nService number {i} is explained in detail here."}
+             for i in range(10)]
+    pages.append({'url': 'https://example.com/copy', 'content': pages[3]['content']})
+    index_name = str(knowledge_db / "faiss_1")
+    insert_knowledge(index_name, pages)
+
+    stats = build_faiss_index(index_name, pages, boilerplate_min_pages=3)
+
+    assert stats['boilerplate_lines'] == 5
+    assert stats['chunks_removed'] > 0
+    store = load_index(index_name, embeddings)
+    texts = [store.docstore.search(i).page_content for i in store.index_to_docstore_id.values()]
+    assert sum("Accept cookies" in text for text in texts) == 1
+    assert len(embedded) == len(texts) == 10
+    assert all(f"Service number {i} " in "\n".join(texts) for i in range(10))
+    lexical = lexical_search(index_name, "cookies services", k=20)
+    assert sorted(doc.page_content for doc in lexical) == sorted(texts)
+    vector = store.similarity_search_by_vector(embeddings.embed_query(texts[4]), k=1)[0]
+    assert vector.metadata in [doc.metadata for doc in lexical]
+
+
+## 11. Chunk Metadata Tests
+def test_chunks_carry_page_title_and_section(knowledge_db, mocker):
+    """Tests that extracted headings and the page title end up in the chunk metadata."""
+    print("Running test: test_chunks_carry_page_title_and_section")
+    from rag import build_faiss_index, load_index
+    embeddings = random_embeddings(mocker)
+    mocker.patch('rag.get_embeddings', return_value=embeddings)
+    content = ("# Employee Retention Credit\n" + "We help employers claim the credit. " * 30 +
+               "\n## Who qualifies\n" + "Employers with a revenue decline qualify. " * 30)
+    index_name = str(knowledge_db / "faiss_1")
+
+    build_faiss_index(index_name, [{'url': 'https://example.com/erc', 'title': 'ERC | Occams', 'content': content}])
+
+    store = load_index(index_name, embeddings)
+    docs = [store.docstore.search(i) for i in store.index_to_docstore_id.values()]
+    assert all(doc.metadata['title'] == 'ERC | Occams' for doc in docs)
+    assert docs[0].metadata['section'] == 'Employee Retention Credit'
+    assert docs[-1].metadata['section'] == 'Who qualifies'
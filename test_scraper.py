@@ -0,0 +1,369 @@
+import pytest
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from scraper import (scraper_http, iter_pages_http, needs_javascript, iter_pages_pool, HostRateLimiter, new_driver,
+                     wait_until_settled, transferred_bytes, canonical_url, CrawlFrontier)
+from selenium.common.exceptions import WebDriverException
+from extract import MainContentExtractor, TextExtractor
+
+PARAGRAPH = "We help growing businesses with tax credits, payroll and accounting. " * 5
+
+SITE = {
+    "/": f"<html><body><h1>Home</h1><p>{PARAGRAPH}</p>"
+         "<a href='/about'>About</a> <a href='/app'>Portal</a> <a href='/blog/post'>Blog</a>"
+         "<a href='mailto:hi@example.com'>Mail</a> <a href='https://other.example.com/'>Elsewhere</a></body></html>",
+    "/about": f"<html><body><h1>About</h1><p>{PARAGRAPH}</p><a href='/'>Home</a> <a href='/team'>Team</a></body></html>",
+    "/team": f"<html><body><h1>Team</h1><p>{PARAGRAPH}</p></body></html>",
+    "/app": "<html><body><div id='root'></div><script src='/bundle.js'></script></body></html>",
+    "/blog/post": f"<html><body><p>{PARAGRAPH}</p></body></html>",
+}
+
+
+@pytest.fixture
+def site():
+    """
+    Serves SITE on a local port; yields (base_url, list of requested paths).
+    Pages other than /team carry an ETag and answer a matching If-None-Match with 304.
+    """
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            time.sleep(0.05) # a little latency, like a real server
+            body = SITE.get(self.path)
+            etag = f'"{zlib.crc32(body.encode())}"' if body and self.path != "/team" else None
+            if etag and self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200 if body else 404)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            if etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write((body or "not found").encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/", requested
+    server.shutdown()
+    server.server_close()
+
+
+## 1. HTTP Crawler Tests
+def test_http_crawl_matches_scraper_output(site, mocker):
+    """Tests that the HTTP crawler follows internal links only and returns {'url', 'title', 'content'} pages."""
+    print("Running test: test_http_crawl_matches_scraper_output")
+    base_url, requested = site
+    render = mocker.patch('scraper.BrowserRenderer.__call__', return_value=f"<html><body><p>Portal {PARAGRAPH}</p></body></html>")
+    mocker.patch('scraper.BrowserRenderer.close')
+
+    pages = scraper_http(base_url, concurrency=4)
+
+    by_url = {page['url']: page['content'] for page in pages}
+    assert set(by_url) == {base_url, base_url + "about", base_url + "team", base_url + "app"}
+    assert by_url[base_url + "team"] == "# Team\n" + PARAGRAPH.strip()
+    assert by_url[base_url + "app"].startswith("Portal")
+    assert render.call_count == 1
+    assert "/blog/post" not in requested
+    assert sorted(requested) == sorted(set(requested)) # every page fetched once
+
+def test_http_crawl_respects_politeness_delay(site):
+    """Tests that request starts are spaced by the configured delay."""
+    print("Running test: test_http_crawl_respects_politeness_delay")
+    base_url, requested = site
+    start = time.monotonic()
+    pages = scraper_http(base_url, concurrency=4, delay=0.1, browser_fallback=False)
+    assert len(pages) == 4
+    assert time.monotonic() - start >= 0.3
+
+def test_http_recrawl_reuses_unchanged_pages(site, mocker):
+    """Tests that a re-crawl sends conditional requests and carries unchanged pages forward, rendering JavaScript pages again."""
+    print("Running test: test_http_recrawl_reuses_unchanged_pages")
+    base_url, requested = site
+    render = mocker.patch('scraper.BrowserRenderer.__call__', side_effect=[
+        f"<html><body><p>Portal {PARAGRAPH}</p></body></html>",
+        f"<html><body><p>New portal {PARAGRAPH}</p></body></html>",
+    ])
+    mocker.patch('scraper.BrowserRenderer.close')
+    first = {page['url']: page for page in scraper_http(base_url, concurrency=4)}
+    assert first[base_url]['etag'] and first[base_url + "team"]['etag'] is None
+    assert not any(page['reused'] for page in first.values())
+    assert all(page['content_hash'] for url, page in first.items() if url != base_url + "app")
+    # the rendered page's fetched HTML is only the app shell, so it keeps no validators
+    assert first[base_url + "app"]['etag'] is None and first[base_url + "app"]['content_hash'] is None
+
+    # only /about changes; /team has no ETag and is recognised by its content hash
+    mocker.patch.dict(SITE, {"/about": SITE["/about"].replace("About", "About us")})
+    requested.clear()
+    second = {page['url']: page for page in scraper_http(base_url, concurrency=4, known=first)}
+
+    assert set(second) == set(first)
+    assert {url for url, page in second.items() if not page['reused']} == {base_url + "about", base_url + "app"}
+    assert second[base_url + "about"]["content"].startswith("# About us")
+    assert second[base_url + "app"]['content'].startswith("New portal")
+    assert second[base_url]['etag'] == first[base_url]['etag']
+    assert render.call_count == 2
+    assert sorted(requested) == sorted(set(requested))
+
+def test_needs_javascript_heuristics():
+    """Tests the client-rendering guesses on empty app roots, noscript hints and script-only pages."""
+    print("Running test: test_needs_javascript_heuristics")
+    def check(html):
+        return needs_javascript(html, MainContentExtractor().extract(html, "http://site.test/")["content"])
+    assert check(SITE["/app"])
+    assert check("<html><body><noscript>Please enable JavaScript to view this site.</noscript></body></html>")
+    assert check("<html><body><p>Loading</p><script>render()</script></body></html>")
+    assert not check(SITE["/team"])
+
+
+## 2. Browser Pool Tests
+class FakeDriver:
+    """Stands in for webdriver.Chrome, serving SITE pages with a fixed render time."""
+    created = []
+
+    def __init__(self, base_url, render_seconds=0.05, crash_on=(), site=SITE):
+        self.base_url = base_url
+        self.site = site
+        self.render_seconds = render_seconds
+        self.crash_on = set(crash_on)
+        self.page_source = ""
+        self.title = ""
+        self.visited = []
+        self.quit_called = False
+        FakeDriver.created.append(self)
+
+    def get(self, url):
+        path = "/" + url[len(self.base_url):]
+        if path in self.crash_on:
+            self.crash_on.discard(path)
+            raise WebDriverException("tab crashed")
+        time.sleep(self.render_seconds)
+        self.visited.append(path)
+        self.page_source = self.site.get(path, "")
+
+    def execute_script(self, script):
+        return "complete"
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_browser_pool_scrapes_each_page_once_and_recycles(mocker):
+    """Tests that workers share the frontier, drivers are replaced every few pages, and all are quit."""
+    print("Running test: test_browser_pool_scrapes_each_page_once_and_recycles")
+    base_url = "http://site.test/"
+    FakeDriver.created = []
+
+    pages = list(iter_pages_pool(base_url, workers=2, recycle_after=2, max_settle=0, sitemap=False,
+                                 driver_factory=lambda: FakeDriver(base_url)))
+
+    assert sorted(p['url'] for p in pages) == sorted(base_url + path.lstrip("/") for path in SITE if "blog" not in path)
+    visits = [path for driver in FakeDriver.created for path in driver.visited]
+    assert len(visits) == len(set(visits))
+    assert all(len(driver.visited) <= 2 for driver in FakeDriver.created)
+    assert all(driver.quit_called for driver in FakeDriver.created)
+
+def test_browser_pool_restarts_crashed_driver(mocker):
+    """Tests that a browser crash replaces the driver and the page is tried again."""
+    print("Running test: test_browser_pool_restarts_crashed_driver")
+    base_url = "http://site.test/"
+    FakeDriver.created = []
+    crash_once = {"/about"}
+
+    def factory():
+        driver = FakeDriver(base_url, crash_on=set(crash_once))
+        crash_once.clear()
+        return driver
+
+    pages = list(iter_pages_pool(base_url, workers=1, max_settle=0, sitemap=False, driver_factory=factory))
+
+    assert base_url + "about" in {p['url'] for p in pages}
+    assert len(FakeDriver.created) == 2
+    assert FakeDriver.created[0].quit_called
+
+def test_browser_pool_scales_with_workers():
+    """Tests that more browsers finish a crawl faster when there is no politeness delay."""
+    print("Running test: test_browser_pool_scales_with_workers")
+    base_url = "http://site.test/"
+    wide_site = {"/": "".join(f"<a href='/p{i}'>Page {i}</a>" for i in range(12))}
+    wide_site.update({f"/p{i}": f"<p>Page {i}</p>" for i in range(12)})
+    def crawl_seconds(workers):
+        start = time.monotonic()
+        pages = list(iter_pages_pool(base_url, workers=workers, max_settle=0, sitemap=False,
+                                     driver_factory=lambda: FakeDriver(base_url, render_seconds=0.1, site=wide_site)))
+        assert len(pages) == 13
+        return time.monotonic() - start
+    assert crawl_seconds(4) < 0.5 * crawl_seconds(1)
+
+def test_host_rate_limiter_spaces_requests_across_threads():
+    """Tests that concurrent requests to one host are spaced by the delay while other hosts are not held up."""
+    print("Running test: test_host_rate_limiter_spaces_requests_across_threads")
+    limiter = HostRateLimiter(0.1)
+    starts = []
+    def request(url):
+        limiter.wait(url)
+        starts.append((url, time.monotonic()))
+    threads = [threading.Thread(target=request, args=("http://a.test/page",)) for _ in range(4)]
+    threads.append(threading.Thread(target=request, args=("http://b.test/page",)))
+    begin = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    a_starts = sorted(t for url, t in starts if "a.test" in url)
+    assert all(later - earlier >= 0.09 for earlier, later in zip(a_starts, a_starts[1:]))
+    assert next(t for url, t in starts if "b.test" in url) - begin < 0.05
+
+
+## 3. Page Readiness and Resource Blocking Tests
+class SettlingDriver:
+    """Reports DOM mutations and resource counts that stop changing after a few polls."""
+
+    def __init__(self, busy_polls=3, keep_mutating=False):
+        self.busy_polls = busy_polls
+        self.keep_mutating = keep_mutating
+        self.polls = 0
+
+    def execute_script(self, script):
+        if "__crawlMutations" not in script:
+            return [2048, 3]
+        self.polls += 1
+        if self.keep_mutating:
+            return [self.polls, self.polls]
+        return [min(self.polls, self.busy_polls), min(self.polls, self.busy_polls)]
+
+
+def test_wait_until_settled_returns_once_page_is_quiet():
+    """Test that the readiness wait ends after the quiet period instead of the full cap."""
+    print("\nRunning test: test_wait_until_settled_returns_once_page_is_quiet")
+    driver = SettlingDriver(busy_polls=3)
+    waited = wait_until_settled(driver, quiet=0.1, max_wait=5, poll=0.02)
+    assert waited < 1
+    assert driver.polls > 3
+
+    assert wait_until_settled(SettlingDriver(), quiet=0.1, max_wait=0) == 0.0
+    assert 0.3 <= wait_until_settled(SettlingDriver(keep_mutating=True), quiet=1, max_wait=0.3, poll=0.02) < 1
+    assert transferred_bytes(SettlingDriver()) == (2048, 3)
+    assert transferred_bytes(FakeDriver("http://x/")) == (None, None)
+
+
+def test_new_driver_blocks_heavy_resources(mocker):
+    """Test that new_driver blocks images, fonts, media and tracker scripts through DevTools."""
+    print("\nRunning test: test_new_driver_blocks_heavy_resources")
+    mocker.patch("scraper.ChromeDriverManager")
+    mocker.patch("scraper.Service")
+    chrome = mocker.patch("scraper.webdriver.Chrome")
+
+    new_driver(block_resources=True)
+    options = chrome.call_args.kwargs["options"]
+    assert options.experimental_options["prefs"]["profile.managed_default_content_settings.images"] == 2
+    assert "--headless" in options.arguments
+    calls = {call.args[0]: call.args[1] for call in chrome.return_value.execute_cdp_cmd.call_args_list}
+    blocked = calls["Network.setBlockedURLs"]["urls"]
+    assert "*.woff2" in blocked and "*.png" in blocked
+    assert "*googletagmanager.com*" in blocked
+
+    chrome.reset_mock()
+    new_driver(block_resources=False)
+    chrome.return_value.execute_cdp_cmd.assert_not_called()
+
+
+## 4. Crawl Frontier Tests
+def test_canonical_url_collapses_variants():
+    """Test that fragment, query order, tracking parameters, default port and trailing slash don't make new URLs."""
+    print("\nRunning test: test_canonical_url_collapses_variants")
+    variants = [
+        "https://www.example.com/about",
+        "https://www.example.com/about/",
+        "https://WWW.Example.com:443/about#team",
+        "https://www.example.com//about/?utm_source=mail",
+    ]
+    assert {canonical_url(url) for url in variants} == {"https://www.example.com/about"}
+    assert canonical_url("https://example.com/search?b=2&a=1") == canonical_url("https://example.com/search?a=1&b=2")
+    assert canonical_url("https://example.com/search?a=1") != canonical_url("https://example.com/search?a=2")
+    assert canonical_url("https://example.com") == "https://example.com/"
+
+def test_http_crawl_seeds_from_sitemap_and_dedups_variants(site, mocker):
+    """Test that unlinked sitemap pages are crawled and URL variants are fetched once."""
+    print("\nRunning test: test_http_crawl_seeds_from_sitemap_and_dedups_variants")
+    base_url, requested = site
+    sitemap = ("<?xml version='1.0'?><urlset xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>"
+               f"<url><loc>{base_url}hidden</loc></url><url><loc>{base_url}about/?utm_source=x</loc></url>"
+               "<url><loc>https://other.example.com/</loc></url></urlset>")
+    mocker.patch.dict(SITE, {"/sitemap.xml": sitemap, "/hidden": f"<html><body><p>Hidden {PARAGRAPH}</p></body></html>",
+                             "/team": SITE["/team"].replace("</p>", "</p><a href='/about#top'>About</a>")})
+
+    pages = scraper_http(base_url, concurrency=4, browser_fallback=False)
+
+    urls = {page['url'] for page in pages}
+    assert base_url + "hidden" in urls
+    assert len({canonical_url(url) for url in urls}) == len(urls)
+    assert len([path for path in requested if path.startswith("/about")]) == 1
+
+def test_crawl_resumes_from_checkpoint(site, tmp_path):
+    """Test that an interrupted crawl picks up from its SQLite frontier without losing or refetching stored pages."""
+    print("\nRunning test: test_crawl_resumes_from_checkpoint")
+    base_url, requested = site
+    path = str(tmp_path / "frontier.db")
+
+    frontier = CrawlFrontier(path=path, crawl_id="faiss_1")
+    crawl = iter_pages_http(base_url, concurrency=1, browser_fallback=False, frontier=frontier, sitemap=False)
+    stored = [next(crawl), next(crawl)]
+    crawl.close() # the server went down here
+    frontier.close()
+
+    requested.clear()
+    frontier = CrawlFrontier(path=path, crawl_id="faiss_1")
+    frontier.requeue_done(keep=[page['url'] for page in stored])
+    rest = scraper_http(base_url, concurrency=2, browser_fallback=False, frontier=frontier, sitemap=False)
+
+    first_urls = {page['url'] for page in stored}
+    assert first_urls.isdisjoint(page['url'] for page in rest)
+    assert first_urls | {page['url'] for page in rest} == {base_url, base_url + "about", base_url + "team", base_url + "app"}
+    assert "/" not in requested
+    frontier.clear()
+    assert frontier.seen() == 0
+    frontier.close()
+
+def test_frontier_commits_once_per_page(tmp_path, mocker):
+    """Test that taking a URL writes nothing and finishing it stores its links and its state in one commit."""
+    print("\nRunning test: test_frontier_commits_once_per_page")
+    frontier = CrawlFrontier(["http://site.test/"], path=str(tmp_path / "frontier.db"))
+    conn = frontier._conn = mocker.MagicMock(wraps=frontier._conn)
+
+    url = frontier.get()
+    assert conn.commit.call_count == 0
+    added = frontier.done(url, links=["http://site.test/a", "http://site.test/b/", "http://site.test/b", url])
+
+    assert conn.commit.call_count == 1
+    assert added == ["http://site.test/a", "http://site.test/b/"]
+    assert [frontier.get(), frontier.get(block=False)] == ["http://site.test/a", "http://site.test/b/"]
+    assert frontier.get(block=False) is None and not frontier.finished()
+    frontier.close()
+
+def test_http_crawl_keeps_frontier_writes_off_the_event_loop(site):
+    """Test that the async crawler takes and finishes URLs in worker threads, not on its event loop thread."""
+    print("\nRunning test: test_http_crawl_keeps_frontier_writes_off_the_event_loop")
+    base_url, _ = site
+    threads = set()
+
+    class RecordingFrontier(CrawlFrontier):
+        def get(self, block=True):
+            threads.add(threading.current_thread().name)
+            return super().get(block)
+
+        def done(self, url, retry=False, links=()):
+            threads.add(threading.current_thread().name)
+            return super().done(url, retry, links)
+
+    pages = scraper_http(base_url, concurrency=2, browser_fallback=False, frontier=RecordingFrontier(), sitemap=False)
+
+    assert len(pages) == 4
+    assert threads and all(name.startswith("asyncio_") for name in threads)